@@ -0,0 +1,111 @@
+"""
+Micro-benchmark de la Fase 1: implementación anterior (14 re.sub sin compilar por llamada,
+DataFrame + groupby de pandas) contra la actual (patrones precompilados + memo de
+normalize_description, agregando ítem por ítem con ItemAggregator, como en la app).
+
+Uso:
+    python bench_normalize.py [--rows 20000] [--unique 2000] [--repeat 5] [--seed 0]
+
+Antes de medir verifica que ambas variantes den exactamente la misma agregación.
+"""
+import argparse
+import random
+import re
+import time
+import pandas as pd
+from src.models import Item
+from src.services.cleaning import ItemAggregator
+from src.utils import REPLACEMENTS, _normalize, normalize_description
+
+DROGAS = ["IBUPROFENO", "AMOXICILINA", "PARACETAMOL", "OMEPRAZOL", "ENALAPRIL", "DICLOFENAC", "KETOROLAC",
+          "Dipirona", "agua", "SOL. FISIOL", "sol fisiol", "CLORURO DE SODIO", "BAREX UNIPEG"]
+DOSIS = ["500MG", "500 mg", "1G", "10ml", "5 ML", "400MG/5ML", "0,9%", "100 UI", "250mcg", "2 GRS", "1GR", ""]
+FORMAS = ["COMP", "comp.", "COMPRIMIDOS", "CAPS", "caps", "AMP", "INY", "GTS", "FCO", "PDA", "SOL", "Jarabe",
+          "AG DEST", "ag. dest.", "SOBRES", "- SOBRES", "crema", "x 10 amp"]
+ENVASES = ["X 10", "x20", "X 1", "x 100 ML", "(caja)", "F/C", "  ", "nº 3", "ÉTICO", ""]
+
+def legacy_normalize_description(desc: str) -> str:
+    """Implementación anterior, como referencia de resultados y de tiempos."""
+    if not isinstance(desc, str): return ""
+    normalized_desc = desc.upper().strip()
+    for pattern, replacement in REPLACEMENTS.items():
+        normalized_desc = re.sub(pattern, replacement, normalized_desc)
+    normalized_desc = re.sub(r'(\d+)\s*(MG|G|ML|UI|MCG|GRS|GR)', r'\1 \2', normalized_desc)
+    normalized_desc = re.sub(r'[^A-Z0-9\s]', ' ', normalized_desc)
+    normalized_desc = re.sub(r'\s+', ' ', normalized_desc).strip()
+    return normalized_desc
+
+def legacy_aggregate(items: list) -> list:
+    """Agregación anterior de la Fase 1 (clean_and_deduplicate) sobre los ítems como dicts."""
+    df = pd.DataFrame(items)
+    for col in ['cantidad', 'precio_total', 'precio_unitario']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df['normalized_desc'] = df['descripción'].apply(legacy_normalize_description)
+    agg_rules = {
+        'cantidad': 'sum', 'precio_total': 'sum', 'descripción': 'first',
+        'precio_unitario': 'first', 'fecha': 'first', 'notas': 'first'
+    }
+    return df.groupby('normalized_desc').agg(agg_rules).reset_index().to_dict('records')
+
+def aggregate(items: list) -> list:
+    aggregator = ItemAggregator()
+    for item in items:
+        aggregator.add(item)
+    return aggregator.unique_items()
+
+def synthetic_items(n_rows: int, n_unique: int, rng: random.Random) -> list:
+    uniques = [" ".join(p for p in (rng.choice(DROGAS), rng.choice(DOSIS), rng.choice(FORMAS), rng.choice(ENVASES)) if p)
+               for _ in range(n_unique)]
+    items = []
+    for _ in range(n_rows):
+        cantidad = rng.randint(1, 5)
+        items.append(Item(fecha="2024-01-01", descripción=rng.choice(uniques), cantidad=cantidad,
+                          precio_unitario=10.0, precio_total=10.0 * cantidad,
+                          notas=rng.choice([None, None, "urgente"])))
+    return items
+
+def _comparable(rows: list) -> list:
+    # pandas deja NaN en 'notas' cuando ningún ítem del grupo la trae; ItemAggregator deja None
+    return [(r['normalized_desc'], int(r['cantidad']), round(float(r['precio_total']), 6), r['descripción'],
+             r['notas'] if isinstance(r['notas'], str) else None) for r in rows]
+
+def timed(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la Fase 1 (normalize_description + agregación).")
+    parser.add_argument("--rows", type=int, default=20_000, help="Ítems de la factura.")
+    parser.add_argument("--unique", type=int, default=2_000, help="Descripciones distintas entre esos ítems.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por medición (se toma la mejor).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    items = synthetic_items(args.rows, args.unique, rng)
+    dicts = [item.model_dump() for item in items]
+
+    for desc in (None, 12.5, float("nan")):
+        assert normalize_description(desc) == legacy_normalize_description(desc), f"normalize_description difiere para {desc!r}"
+    assert _comparable(aggregate(items)) == _comparable(legacy_aggregate(dicts)), "ItemAggregator difiere de la agregación anterior"
+    print(f"Resultados idénticos en {len(items)} ítems ({args.unique} descripciones distintas).")
+
+    def memo_frio():
+        _normalize.cache_clear()
+        aggregate(items)
+
+    resultados = {
+        "anterior (pandas groupby)": timed(lambda: legacy_aggregate(dicts), args.repeat),
+        "ItemAggregator (memo frío)": timed(memo_frio, args.repeat),
+        "ItemAggregator (memo caliente)": timed(lambda: aggregate(items), args.repeat),
+    }
+    base = resultados["anterior (pandas groupby)"]
+    for nombre, ms in resultados.items():
+        print(f"{nombre:<32} {ms:9.2f} ms   x{base / ms:5.1f}")
+
+if __name__ == "__main__":
+    main()
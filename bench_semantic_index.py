@@ -0,0 +1,108 @@
+"""
+Benchmark de los tipos de índice semántico: recall@k contra Flat, latencia p50/p99 por consulta y RAM.
+
+Uso:
+    python bench_semantic_index.py [--n 500000] [--queries 1000] [--k 10] [--types flat,hnsw,ivf_flat,ivf_pq]
+                                   [--nprobe 16] [--ef-search 64] [--encode]
+
+Por defecto usa vectores sintéticos agrupados (rápido, misma dimensión que el modelo). Con
+--encode genera un catálogo sintético de nombres de medicamentos y lo codifica con el modelo
+configurado (más lento, pero con la distribución real de los embeddings).
+"""
+import argparse
+import random
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import faiss
+from src.config import settings
+from src.services.semantic_search import INDEX_TYPES, apply_search_params, create_index, fill_index, normalize_embeddings
+
+DROGAS = ["IBUPROFENO", "AMOXICILINA", "PARACETAMOL", "OMEPRAZOL", "ENALAPRIL", "LOSARTAN", "METFORMINA",
+          "ATORVASTATINA", "DICLOFENAC", "CEFALEXINA", "AZITROMICINA", "CLONAZEPAM", "LEVOTIROXINA",
+          "SALBUTAMOL", "DEXAMETASONA", "KETOROLAC", "RANITIDINA", "AMLODIPINA", "ACICLOVIR", "FUROSEMIDA"]
+MARCAS = ["ACTRON", "AMOXIDAL", "TAFIROL", "ULCOZOL", "LOTRIAL", "LOSACOR", "GLUCOPHAGE", "LIPITOR",
+          "VOLTAREN", "KEFLEX", "AZITRAL", "RIVOTRIL", "T4 MONTPELLIER", "VENTOLIN", "DECADRON", "DOLOTOR"]
+DOSIS = ["5 MG", "10 MG", "20 MG", "40 MG", "50 MG", "100 MG", "250 MG", "400 MG", "500 MG", "600 MG", "1 G", "5 ML"]
+FORMAS = ["COMPRIMIDOS", "CAPSULAS", "JARABE", "AMPOLLAS", "SOBRES", "CREMA", "GOTAS", "SUSPENSION", "INYECTABLE"]
+ENVASES = ["X 7", "X 10", "X 14", "X 16", "X 20", "X 30", "X 60", "X 100 ML", "X 1 AMP"]
+
+def synthetic_names(n: int, rng: random.Random):
+    return [f"{rng.choice(MARCAS)} {rng.choice(DROGAS)} {rng.choice(DOSIS)} {rng.choice(FORMAS)} {rng.choice(ENVASES)} L{rng.randrange(1000)}"
+            for _ in range(n)]
+
+def perturb(name: str, rng: random.Random) -> str:
+    # Simula una descripción de factura: sin laboratorio y con alguna palabra de menos
+    words = name.split()[:-1]
+    if len(words) > 3:
+        words.pop(rng.randrange(len(words)))
+    return " ".join(words)
+
+def synthetic_vectors(n: int, n_queries: int, dimension: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(n // 50, 1), dimension), dtype=np.float32)
+    base = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.standard_normal((n, dimension), dtype=np.float32)
+    queries = base[rng.integers(n, size=n_queries)] + 0.1 * rng.standard_normal((n_queries, dimension), dtype=np.float32)
+    return normalize_embeddings(base), normalize_embeddings(queries)
+
+def encoded_vectors(n: int, n_queries: int, seed: int):
+    from sentence_transformers import SentenceTransformer
+
+    rng = random.Random(seed)
+    names = synthetic_names(n, rng)
+    queries = [perturb(rng.choice(names), rng) for _ in range(n_queries)]
+    model = SentenceTransformer(settings.SEMANTIC_MODEL_NAME)
+    encode = lambda texts: normalize_embeddings(model.encode(texts, batch_size=settings.SEMANTIC_ENCODE_BATCH_SIZE, convert_to_numpy=True))
+    return encode(names), encode(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara los tipos de índice semántico FAISS.")
+    parser.add_argument("--n", type=int, default=500_000, help="Tamaño del catálogo sintético.")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--dimension", type=int, default=384, help="Dimensión de los vectores sintéticos.")
+    parser.add_argument("--nprobe", type=int, default=settings.SEMANTIC_IVF_NPROBE)
+    parser.add_argument("--ef-search", type=int, default=settings.SEMANTIC_HNSW_EF_SEARCH)
+    parser.add_argument("--encode", action="store_true", help="Codificar nombres sintéticos con el modelo en vez de usar vectores al azar.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings.SEMANTIC_IVF_NPROBE = args.nprobe
+    settings.SEMANTIC_HNSW_EF_SEARCH = args.ef_search
+    faiss.omp_set_num_threads(1)  # Latencia por consulta como la ve un worker
+
+    print(f"Generando {args.n} vectores de catálogo y {args.queries} consultas...")
+    if args.encode:
+        base, queries = encoded_vectors(args.n, args.queries, args.seed)
+    else:
+        base, queries = synthetic_vectors(args.n, args.queries, args.dimension, args.seed)
+
+    ground_truth = None
+    print(f"\n{'índice':<10} {'build (s)':>10} {'RAM (MB)':>10} {'recall@' + str(args.k):>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for index_type in ["flat"] + [t for t in args.types.split(",") if t != "flat"]:
+        start = time.perf_counter()
+        index = create_index(index_type, base.shape[1], len(base))
+        fill_index(index, base)
+        build_seconds = time.perf_counter() - start
+        apply_search_params(index)
+        ram_mb = faiss.serialize_index(index).nbytes / 2**20
+
+        _, ids = index.search(queries, args.k)
+        if ground_truth is None:
+            ground_truth = ids
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ids, ground_truth)])
+
+        latencies = []
+        for i in range(len(queries)):
+            t = time.perf_counter()
+            index.search(queries[i:i + 1], args.k)
+            latencies.append((time.perf_counter() - t) * 1000)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{index_type:<10} {build_seconds:>10.1f} {ram_mb:>10.1f} {recall:>10.3f} {p50:>10.3f} {p99:>10.3f}")
+
+if __name__ == "__main__":
+    main()
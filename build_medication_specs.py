@@ -0,0 +1,31 @@
+"""
+Llena o actualiza la tabla medicamentos_spec con la especificación parseada de cada medicamento
+(marca, principio activo, forma, dosis en unidad base y unidades por envase).
+
+Uso:
+    python build_medication_specs.py [--full]
+
+Requiere `alembic upgrade head`. Por defecto solo parsea los medicamentos nuevos o cuyo nombre
+cambió; --full reparsea todo el catálogo. Los workers de la API toman los cambios con
+POST /db/catalog/refresh (que además ya hace esta sincronización incremental).
+"""
+import argparse
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.db import refresh_medication_specs
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza la tabla medicamentos_spec con medicamentos.")
+    parser.add_argument("--full", action="store_true", help="Reparsear todos los medicamentos, no solo los que cambiaron.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    stats = refresh_medication_specs(full=args.full)
+    print(f"medicamentos_spec sincronizada: {stats['medicamentos']} medicamentos, "
+          f"{stats['actualizados']} parseados, {stats['borrados']} borrados.")
+
+if __name__ == "__main__":
+    main()
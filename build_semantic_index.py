@@ -0,0 +1,33 @@
+"""
+Genera offline el índice de búsqueda semántica (FAISS) a partir del catálogo de medicamentos.
+
+Uso:
+    python build_semantic_index.py [--output semantic_index] [--model paraphrase-MiniLM-L3-v2]
+                                   [--batch-size 256] [--index-type flat|hnsw|ivf_flat|ivf_pq]
+
+Los workers de la API cargan el resultado con mmap al arrancar; volver a correrlo cada vez
+que cambie la tabla medicamentos (el servicio avisa si el índice quedó desactualizado).
+"""
+import argparse
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.config import settings
+from src.services.semantic_search import INDEX_TYPES, build_semantic_index
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice semántico FAISS del catálogo de medicamentos.")
+    parser.add_argument("--output", default=settings.SEMANTIC_INDEX_DIR, help="Directorio de salida del índice.")
+    parser.add_argument("--model", default=settings.SEMANTIC_MODEL_NAME, help="Modelo de SentenceTransformer.")
+    parser.add_argument("--batch-size", type=int, default=settings.SEMANTIC_ENCODE_BATCH_SIZE, help="Nombres por lote al codificar.")
+    parser.add_argument("--index-type", default=settings.SEMANTIC_INDEX_TYPE, choices=INDEX_TYPES, help="Tipo de índice FAISS.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    meta = build_semantic_index(args.output, args.model, args.batch_size, args.index_type)
+    print(f"Índice '{meta['index_type']}' generado en '{args.output}': {meta['count']} medicamentos, catálogo versión {meta['catalog_version']}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Servidor falso de OpenAI para probar la Fase 3 sin gastar tokens.
+
+Responde /v1/chat/completions eligiendo el candidato de mayor score de cada ítem,
+con latencia y errores 429/500 configurables, para ejercitar el planificador
+(concurrencia, rate limit, reintentos y deadline).
+
+Uso:
+    FAKE_OPENAI_LATENCY_MS=300 FAKE_OPENAI_429_RATE=0.2 uvicorn fake_openai_server:app --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn src.main:app
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", "200"))
+RATE_429 = float(os.getenv("FAKE_OPENAI_429_RATE", "0"))
+RATE_500 = float(os.getenv("FAKE_OPENAI_500_RATE", "0"))
+
+app = FastAPI(title="Fake OpenAI")
+stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "errors_429": 0, "errors_500": 0}
+
+def _entrada(prompt: str) -> dict:
+    # La tarea actual es la última sección "### Entrada:" del prompt
+    bloque = prompt.rsplit("### Entrada:", 1)[1].split("### Salida Esperada:", 1)[0]
+    return json.loads(bloque)
+
+def _elegir(candidatos: list):
+    if not candidatos:
+        return None, 0
+    mejor = max(candidatos, key=lambda c: c.get("score") or 0)
+    return mejor.get("codigo"), int(mejor.get("score") or 0)
+
+def _responder(prompt: str) -> dict:
+    entrada = _entrada(prompt)
+    if "items" in entrada:
+        resultados = []
+        for item in entrada["items"]:
+            codigo, confianza = _elegir(item.get("lista_de_candidatos", []))
+            resultados.append({"id": item["id"], "codigo_bd_conciliado": codigo, "confianza": confianza})
+        return {"resultados": resultados}
+    codigo, confianza = _elegir(entrada.get("lista_de_candidatos", []))
+    return {"codigo_bd_conciliado": codigo, "confianza": confianza}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        await asyncio.sleep(LATENCY_MS / 1000)
+        dado = random.random()
+        if dado < RATE_429:
+            stats["errors_429"] += 1
+            return JSONResponse(status_code=429, headers={"retry-after": "0.1"},
+                                content={"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}})
+        if dado < RATE_429 + RATE_500:
+            stats["errors_500"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Internal error", "type": "server_error"}})
+
+        content = json.dumps(_responder(body["messages"][-1]["content"]), ensure_ascii=False)
+        return {
+            "id": f"chatcmpl-fake-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+    finally:
+        stats["in_flight"] -= 1
+
+@app.get("/stats")
+async def get_stats():
+    return stats
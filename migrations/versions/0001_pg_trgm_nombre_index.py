@@ -0,0 +1,26 @@
+"""Índice trigram (pg_trgm) sobre medicamentos.nombre para SEARCH_BACKEND=trgm
+
+Revision ID: 0001_pg_trgm_nombre_index
+Revises:
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+revision = "0001_pg_trgm_nombre_index"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # GIN con gin_trgm_ops: sirve al operador % y al ILIKE '%palabra%' del backend "sql"
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_medicamentos_nombre_trgm "
+        "ON medicamentos USING gin (nombre gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_medicamentos_nombre_trgm")
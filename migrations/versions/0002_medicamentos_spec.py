@@ -0,0 +1,36 @@
+"""Tabla medicamentos_spec con la especificación parseada de cada medicamento
+
+Revision ID: 0002_medicamentos_spec
+Revises: 0001_pg_trgm_nombre_index
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+revision = "0002_medicamentos_spec"
+down_revision = "0001_pg_trgm_nombre_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Se llena con `python build_medication_specs.py` (y se mantiene con POST /db/catalog/refresh)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS medicamentos_spec (
+            codigo VARCHAR(64) PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            brand TEXT NOT NULL DEFAULT '',
+            active TEXT NOT NULL DEFAULT '',
+            form TEXT NOT NULL DEFAULT '',
+            dose TEXT NOT NULL DEFAULT '',
+            pack TEXT NOT NULL DEFAULT '',
+            dose_value DOUBLE PRECISION,
+            dose_unit VARCHAR(8),
+            pack_count INTEGER,
+            parser_version INTEGER NOT NULL
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS medicamentos_spec")
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -6,4 +7,114 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     # Agrega más configs (e.g., embedding model path)
 
+    # Pool de conexiones (engines síncrono y async)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: int = 30
+    # Capa async: por defecto se deriva de DATABASE_URL (asyncpg / aioodbc / aiosqlite)
+    ASYNC_DB_ENABLED: bool = True
+    ASYNC_DATABASE_URL: Optional[str] = None
+
+    # Catálogo de medicamentos en memoria (lookups por código/troquel/nombre sin ir a la BD)
+    CATALOG_SNAPSHOT_ENABLED: bool = True
+    # Si la carga del catálogo falla, segundos hasta el próximo intento (mientras, se consulta la BD)
+    CATALOG_RETRY_SECONDS: float = 30.0
+    # Motor de search_fuzzy: "index" (índice invertido en memoria), "trgm" (pg_trgm en
+    # PostgreSQL, requiere `alembic upgrade head`) o "sql" (ILIKE en la BD)
+    SEARCH_BACKEND: str = "index"
+    TRGM_SIMILARITY_THRESHOLD: float = 0.3
+    # Candidatos fuzzy por ítem en la Fase 2 (con pg_trgm ya vienen rankeados por similitud)
+    FUZZY_CANDIDATES_K: int = 50
+    TRGM_CANDIDATES_K: int = 10
+    # Descartar antes del scoring los candidatos cuya dosis/forma/envase contradicen la línea
+    # de la factura y sumar los compatibles del mismo principio activo (src/db/spec_index.py)
+    SPEC_FILTER_ENABLED: bool = True
+    # Hilos del executor de la Fase 2, compartido por todas las auditorías del worker: acota cuántos
+    # lotes de filtrado por especificaciones y scoring de candidatos corren a la vez (cada auditoría
+    # envía un lote por paso; las búsquedas ya se hacen por lotes, ver SearchEngine.search_many)
+    PHASE2_SCORING_THREADS: int = 8
+    # Aceptación automática (sin IA) del mejor candidato fuzzy cuando es inequívoco:
+    # score mínimo, ventaja sobre el segundo candidato y dosis/forma/envase compatibles
+    AUTO_ACCEPT_ENABLED: bool = True
+    AUTO_ACCEPT_MIN_SCORE: int = 95
+    AUTO_ACCEPT_MIN_MARGIN: int = 5
+    # token_sort_ratio mínimo entre factura y candidato (token_set_ratio ignora lo que sobra)
+    AUTO_ACCEPT_MIN_SORT_SCORE: int = 60
+
+    # Búsqueda semántica: el índice FAISS se genera offline con build_semantic_index.py
+    SEMANTIC_MODEL_NAME: str = "paraphrase-MiniLM-L3-v2"
+    SEMANTIC_INDEX_DIR: str = "semantic_index"
+    SEMANTIC_ENCODE_BATCH_SIZE: int = 256
+    # Tipo de índice: "flat" (exacto), "hnsw", "ivf_flat" o "ivf_pq" (ver bench_semantic_index.py)
+    SEMANTIC_INDEX_TYPE: str = "flat"
+    SEMANTIC_MIN_SIMILARITY: float = 0.5
+    SEMANTIC_HNSW_M: int = 32
+    SEMANTIC_HNSW_EF_CONSTRUCTION: int = 200
+    SEMANTIC_HNSW_EF_SEARCH: int = 64
+    SEMANTIC_IVF_NLIST: int = 0  # 0 = automático (~4·sqrt(n))
+    SEMANTIC_IVF_NPROBE: int = 16
+    SEMANTIC_PQ_M: int = 48
+    SEMANTIC_TRAIN_SAMPLE: int = 100_000
+
+    # SearchEngine: "sequential" (un método tras otro) o "hybrid" (léxico + semántico en
+    # paralelo, fusionados por reciprocal-rank fusion dentro de un presupuesto de latencia)
+    SEARCH_MODE: str = "sequential"
+    SEARCH_LATENCY_BUDGET_MS: int = 300
+    SEARCH_RRF_K: int = 60
+    SEARCH_LEXICAL_WEIGHT: float = 1.0
+    SEARCH_SEMANTIC_WEIGHT: float = 1.0
+    # Hilos dedicados a la búsqueda semántica: una llamada que se pasa del presupuesto se
+    # cancela, pero su hilo sigue hasta terminar de codificar; este pool acota cuántos quedan así
+    SEMANTIC_SEARCH_MAX_THREADS: int = 2
+
+    # Caché en memoria (LRU + TTL) de search_fuzzy y SearchEngine.search_medication, por worker;
+    # se vacía sola cuando cambia la versión del catálogo. Con CATALOG_SNAPSHOT_ENABLED=false
+    # (o mientras el catálogo no cargó) no hay versión y estas búsquedas no se cachean
+    SEARCH_CACHE_ENABLED: bool = True
+    SEARCH_CACHE_MAX_ENTRIES: int = 10_000
+    SEARCH_CACHE_TTL_SECONDS: int = 300
+
+    # Caché persistente (SQLite) de las conciliaciones de la IA
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "llm_cache.sqlite3"
+    LLM_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    LLM_CACHE_MAX_ENTRIES: int = 100_000
+    # Ítems por llamada a la IA en la Fase 3 (1 = una llamada por ítem)
+    LLM_BATCH_SIZE: int = 8
+    # Matches de la IA con confianza alta que se guardan como sinónimos 'IA-Auto'
+    # (en segundo plano, por lotes) para no volver a consultarla por la misma descripción
+    SYNONYM_PROMOTION_ENABLED: bool = True
+    SYNONYM_PROMOTION_MIN_CONFIDENCE: int = 95
+    SYNONYM_PROMOTION_BATCH_SIZE: int = 100
+    SYNONYM_PROMOTION_FLUSH_SECONDS: float = 5.0
+
+    # Planificador de llamadas a OpenAI (ajustar los límites al tier de la cuenta; 0 = sin límite)
+    OPENAI_BASE_URL: Optional[str] = None
+    LLM_MAX_IN_FLIGHT: int = 16
+    LLM_REQUESTS_PER_MINUTE: int = 500
+    LLM_TOKENS_PER_MINUTE: int = 200_000
+    LLM_CALL_TIMEOUT_SECONDS: float = 30.0
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY: float = 0.5
+    LLM_RETRY_MAX_DELAY: float = 20.0
+    # Tiempo total de la Fase 3 por request; al vencer se devuelven resultados parciales
+    LLM_REQUEST_DEADLINE_SECONDS: float = 120.0
+
+    # Auditoría por lotes (/invoices/audit/batch): facturas por lote y tamaño máximo por archivo del .zip
+    BATCH_MAX_INVOICES: int = 200
+    BATCH_MAX_FILE_BYTES: int = 20 * 1024 * 1024
+
+    # Cola de auditorías asíncronas (/invoices/audit/jobs): backend "sqlite" o "memory"
+    AUDIT_JOBS_BACKEND: str = "sqlite"
+    AUDIT_JOBS_DB_PATH: str = "audit_jobs.sqlite3"
+    AUDIT_JOBS_MAX_WORKERS: int = 2
+    AUDIT_JOBS_MAX_QUEUE: int = 100
+    # Un trabajo en proceso sin avances durante este tiempo se considera caído: se puede reintentar
+    # y vuelve a la cola al iniciar la app
+    AUDIT_JOBS_STALE_SECONDS: float = 900.0
+    # Los trabajos completados o fallidos (con su resultado o su factura) se borran pasado este
+    # tiempo sin cambios; 0 = conservarlos siempre
+    AUDIT_JOBS_RETENTION_SECONDS: float = 7 * 24 * 3600.0
+
 settings = Settings()
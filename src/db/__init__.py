@@ -1,31 +1,135 @@
 import logging
-from sqlalchemy import create_engine, text
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, create_engine, text
 from src.config import settings
 from src.utils import normalize_description as normalize_text
+from src.db.catalog import get_catalog, refresh_catalog
+from src.db.token_index import get_token_index
+from src.db.specs import get_medication_specs_many, parse_medication_nombre, refresh_medication_specs, reset_spec_cache
+from src.utils.cache import MISSING, TTLCache
 
 logger = logging.getLogger(__name__)
 
-engine = create_engine(settings.DATABASE_URL)
+def _pool_options(url: str) -> dict:
+    """Parámetros del pool de conexiones (SQLite usa su propio pool y no los admite)."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(settings.DATABASE_URL, **_pool_options(settings.DATABASE_URL))
 
 __all__ = [
-    "get_conn", "get_by_codigo", "search_fuzzy", "get_by_exact_name",
-    "load_all_synonyms_from_db", "upsert_manual_correction"
+    "get_conn", "get_by_codigo", "search_fuzzy", "search_fuzzy_many", "get_by_exact_name",
+    "load_all_synonyms_from_db", "upsert_manual_correction", "upsert_auto_synonyms",
+    "get_catalog", "refresh_catalog", "catalog_version", "get_by_codigo_many", "get_by_exact_name_many",
+    "fuzzy_candidate_limit", "parse_medication_nombre", "get_medication_specs_many", "refresh_medication_specs", "get_async_engine", "get_by_codigo_async", "get_by_exact_name_async",
+    "get_by_codigo_many_async", "get_by_exact_name_many_async", "search_fuzzy_async", "search_fuzzy_many_async", "upsert_manual_correction_async"
 ]
 
+# Claves por consulta en las búsquedas por lotes. PostgreSQL acepta hasta 65535 parámetros por
+# sentencia (asyncpg, 32767); get_by_codigo_many liga su lista dos veces (codigo y troquel), así
+# que cada trozo usa 2000, con margen. Partir las listas largas además mantiene acotados el
+# texto de la consulta y el tiempo de planificación de IN con miles de valores.
+_MAX_KEYS_PER_QUERY = 1000
+
 def get_conn():
     return engine.connect()
 
+def _snapshot():
+    """Catálogo en memoria si está habilitado y disponible; None para ir a la BD."""
+    if not settings.CATALOG_SNAPSHOT_ENABLED:
+        return None
+    return get_catalog()
+
+def catalog_version() -> Optional[str]:
+    """Versión del catálogo en memoria (None si no está habilitado); sirve para invalidar cachés."""
+    catalog = _snapshot()
+    return catalog.version if catalog is not None else None
+
+_GET_BY_CODIGO_QUERY = text("""
+    SELECT codigo, nombre, precio FROM medicamentos WHERE codigo = :codigo
+    UNION
+    SELECT codigo, nombre, precio FROM medicamentos WHERE troquel = :codigo
+""")
+_GET_BY_EXACT_NAME_QUERY = text("SELECT codigo, nombre, precio FROM medicamentos WHERE LOWER(nombre) = LOWER(:nombre)")
+
 def get_by_codigo(codigo: str):
     """Obtiene un medicamento por su código."""
+    catalog = _snapshot()
+    if catalog is not None:
+        return catalog.get_by_codigo(codigo)
     with get_conn() as cn:
-        query = text("""
-            SELECT codigo, nombre, precio FROM medicamentos WHERE codigo = :codigo
-            UNION
-            SELECT codigo, nombre, precio FROM medicamentos WHERE troquel = :codigo
-        """)
-        result = cn.execute(query, {"codigo": codigo}).fetchone()
+        result = cn.execute(_GET_BY_CODIGO_QUERY, {"codigo": codigo}).fetchone()
         return result
 
+def _chunked(values: List[str], size: int = _MAX_KEYS_PER_QUERY):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+_GET_BY_CODIGO_MANY_QUERY = text("""
+    SELECT codigo, troquel, nombre, precio FROM medicamentos
+    WHERE codigo IN :codigos OR troquel IN :codigos
+""").bindparams(bindparam("codigos", expanding=True))
+_GET_BY_EXACT_NAME_MANY_QUERY = text(
+    "SELECT codigo, nombre, precio FROM medicamentos WHERE LOWER(nombre) IN :nombres"
+).bindparams(bindparam("nombres", expanding=True))
+
+# get_by_codigo_many y get_by_exact_name_many (y sus versiones async) comparten el armado del resultado
+
+def _codigo_many_result(codigos: List[str], rows) -> Dict[str, tuple]:
+    by_codigo, by_troquel = {}, {}
+    for codigo, troquel, nombre, precio in rows:
+        by_codigo.setdefault(codigo, (codigo, nombre, precio))
+        if troquel:
+            by_troquel.setdefault(troquel, (codigo, nombre, precio))
+    # Mismo criterio que get_by_codigo: primero por código, luego por troquel
+    return {c: row for c in codigos if (row := by_codigo.get(c) or by_troquel.get(c)) is not None}
+
+def _exact_name_many_result(nombres: List[str], rows) -> Dict[str, tuple]:
+    by_name = {}
+    for codigo, nombre, precio in rows:
+        by_name.setdefault(nombre.lower(), (codigo, nombre, precio))
+    return {n: row for n in nombres if (row := by_name.get(n.lower())) is not None}
+
+def get_by_codigo_many(codigos: Iterable[str]) -> Dict[str, tuple]:
+    """Resuelve varios códigos (o troqueles) en una sola consulta.
+
+    Devuelve un diccionario codigo_buscado -> (codigo, nombre, precio) solo con los encontrados.
+    """
+    codigos = list(dict.fromkeys(c for c in codigos if c))
+    if not codigos: return {}
+
+    catalog = _snapshot()
+    if catalog is not None:
+        return {c: row for c in codigos if (row := catalog.get_by_codigo(c)) is not None}
+
+    with get_conn() as cn:
+        rows = [r for chunk in _chunked(codigos) for r in cn.execute(_GET_BY_CODIGO_MANY_QUERY, {"codigos": chunk})]
+    return _codigo_many_result(codigos, rows)
+
+def get_by_exact_name_many(nombres: Iterable[str]) -> Dict[str, tuple]:
+    """Versión por lotes de get_by_exact_name: una consulta para todos los nombres.
+
+    Devuelve un diccionario nombre_buscado -> (codigo, nombre, precio) solo con los encontrados.
+    """
+    nombres = list(dict.fromkeys(n for n in nombres if n))
+    if not nombres: return {}
+
+    catalog = _snapshot()
+    if catalog is not None:
+        return {n: row for n in nombres if (row := catalog.get_by_exact_name(n)) is not None}
+
+    with get_conn() as cn:
+        rows = [r for chunk in _chunked(list(dict.fromkeys(n.lower() for n in nombres)))
+                for r in cn.execute(_GET_BY_EXACT_NAME_MANY_QUERY, {"nombres": chunk})]
+    return _exact_name_many_result(nombres, rows)
+
 def load_all_synonyms_from_db():
     """Carga todos los sinónimos y correcciones desde la BD a un diccionario."""
     # Usamos la sintaxis de PostgreSQL para la consulta
@@ -39,37 +143,134 @@ def load_all_synonyms_from_db():
     logger.info(f"Cargados {len(mappings)} mapeos desde la base de datos.")
     return mappings
 
+_UPSERT_MANUAL_QUERY = text("""
+    INSERT INTO sinonimos_factura (nombre_factura, codigo_medicamento, metodo)
+    VALUES (:nombre_factura, :codigo_medicamento, 'Manual')
+    ON CONFLICT (nombre_factura)
+    DO UPDATE SET
+        codigo_medicamento = EXCLUDED.codigo_medicamento,
+        metodo = 'Manual';
+""")
+
 def upsert_manual_correction(nombre_factura: str, codigo_medicamento: str):
     """Inserta o actualiza una corrección manual (UPSERT) en PostgreSQL."""
-    query = text("""
-        INSERT INTO sinonimos_factura (nombre_factura, codigo_medicamento, metodo)
-        VALUES (:nombre_factura, :codigo_medicamento, 'Manual')
-        ON CONFLICT (nombre_factura)
-        DO UPDATE SET
-            codigo_medicamento = EXCLUDED.codigo_medicamento,
-            metodo = 'Manual';
-    """)
     with get_conn() as conn:
-        conn.execute(query, {"nombre_factura": nombre_factura, "codigo_medicamento": codigo_medicamento})
+        conn.execute(_UPSERT_MANUAL_QUERY, {"nombre_factura": nombre_factura, "codigo_medicamento": codigo_medicamento})
         conn.commit() # ¡Importante! Confirmar la transacción
 
+# Los sinónimos aprendidos de la IA nunca pisan una corrección manual
+_UPSERT_AUTO_QUERY = text("""
+    INSERT INTO sinonimos_factura (nombre_factura, codigo_medicamento, metodo)
+    VALUES (:nombre_factura, :codigo_medicamento, 'IA-Auto')
+    ON CONFLICT (nombre_factura)
+    DO UPDATE SET
+        codigo_medicamento = EXCLUDED.codigo_medicamento,
+        metodo = 'IA-Auto'
+    WHERE sinonimos_factura.metodo <> 'Manual';
+""")
+
+def upsert_auto_synonyms(mapeos: List[Tuple[str, str]]):
+    """Inserta o actualiza en lote sinónimos (nombre_factura, codigo) aprendidos de la IA."""
+    if not mapeos:
+        return
+    with get_conn() as conn:
+        conn.execute(_UPSERT_AUTO_QUERY, [{"nombre_factura": n, "codigo_medicamento": c} for n, c in mapeos])
+        conn.commit()
+
+# Requiere la extensión pg_trgm y el índice GIN creados por las migraciones de Alembic
+_TRGM_SET_LIMIT_QUERY = text("SELECT set_limit(:limit)")
+_TRGM_SEARCH_QUERY = text("""
+    SELECT codigo, nombre, precio FROM medicamentos
+    WHERE nombre % :q
+    ORDER BY similarity(nombre, :q) DESC, LENGTH(nombre)
+    LIMIT :k
+""")
+
+def fuzzy_candidate_limit() -> int:
+    """Candidatos a traer por ítem en la Fase 2: menos si la BD ya los ordena por similitud."""
+    if settings.SEARCH_BACKEND == "trgm":
+        return settings.TRGM_CANDIDATES_K
+    return settings.FUZZY_CANDIDATES_K
+
+_ILIKE_FALLBACK_QUERY = text("""
+    SELECT codigo, nombre, precio FROM medicamentos 
+    WHERE nombre ILIKE :word0 
+    ORDER BY LENGTH(nombre) 
+    LIMIT :k
+""")
+
+def _ilike_query(words: List[str], k: int):
+    where_clauses = " AND ".join(["nombre ILIKE :word{}".format(i) for i in range(len(words))])
+    params = {f'word{i}': f"%{word}%" for i, word in enumerate(words)}
+    params['k'] = k
+    query = text(f"""
+        SELECT codigo, nombre, precio FROM medicamentos 
+        WHERE {where_clauses} 
+        ORDER BY LENGTH(nombre) 
+        LIMIT :k
+    """)
+    return query, params
+
+def _search_in_memory(qn: str, words: List[str], k: int):
+    """Resuelve search_fuzzy con el índice invertido; None si hay que ir a la BD."""
+    if settings.SEARCH_BACKEND != "index" or not settings.CATALOG_SNAPSHOT_ENABLED:
+        return None
+    index = get_token_index()
+    if index is None:
+        return None
+    results = index.search(words, k)
+    logger.debug(f"Búsqueda fuzzy (índice) para '{qn}' encontró {len(results)} candidatos.")
+    return results
+
+# Caché de search_fuzzy (búsqueda en vivo del front-end y Fase 2), invalidada al cambiar el catálogo.
+# Sin versión de catálogo (snapshot deshabilitado o sin cargar) no se cachea: nada la invalidaría
+_fuzzy_cache = TTLCache("search_fuzzy", settings.SEARCH_CACHE_MAX_ENTRIES, settings.SEARCH_CACHE_TTL_SECONDS)
+
+def _fuzzy_cache_key(qn: str, k: int):
+    return (qn, k, settings.SEARCH_BACKEND), catalog_version()
+
+def _cached_fuzzy(qn: str, k: int):
+    if not settings.SEARCH_CACHE_ENABLED:
+        return MISSING
+    key, version = _fuzzy_cache_key(qn, k)
+    if version is None:
+        return MISSING
+    cached = _fuzzy_cache.get(key, version)
+    return list(cached) if cached is not MISSING else MISSING
+
+def _store_fuzzy(qn: str, k: int, results):
+    if settings.SEARCH_CACHE_ENABLED:
+        key, version = _fuzzy_cache_key(qn, k)
+        if version is not None:
+            _fuzzy_cache.set(key, tuple(results), version)
+    return results
+
 def search_fuzzy(q: str, k: int = 10):
     qn = normalize_text(q)
     if not qn: return []
     words = qn.split()
     if not words: return []
+
+    cached = _cached_fuzzy(qn, k)
+    if cached is not MISSING:
+        return cached
+    return _store_fuzzy(qn, k, _search_fuzzy_uncached(qn, words, k))
+
+def _search_fuzzy_uncached(qn: str, words: List[str], k: int):
+    results = _search_in_memory(qn, words, k)
+    if results is not None:
+        return results
+
+    if settings.SEARCH_BACKEND == "trgm":
+        with get_conn() as cn:
+            # El ranking y el top-k los resuelve PostgreSQL con el índice GIN de pg_trgm
+            cn.execute(_TRGM_SET_LIMIT_QUERY, {"limit": settings.TRGM_SIMILARITY_THRESHOLD})
+            results = cn.execute(_TRGM_SEARCH_QUERY, {"q": qn, "k": k}).fetchall()
+            logger.debug(f"Búsqueda fuzzy (pg_trgm) para '{qn}' encontró {len(results)} candidatos.")
+            return results
     
     with get_conn() as cn:
-        where_clauses = " AND ".join(["nombre ILIKE :word{}".format(i) for i in range(len(words))])
-        params = {f'word{i}': f"%{word}%" for i, word in enumerate(words)}
-        params['k'] = k
-        
-        query = text(f"""
-            SELECT codigo, nombre, precio FROM medicamentos 
-            WHERE {where_clauses} 
-            ORDER BY LENGTH(nombre) 
-            LIMIT :k
-        """)
+        query, params = _ilike_query(words, k)
         
         logger.debug(f"Ejecutando búsqueda fuzzy PRECISA: {query} con {params}")
         results = cn.execute(query, params).fetchall()
@@ -77,18 +278,119 @@ def search_fuzzy(q: str, k: int = 10):
         if not results and len(words) > 1:
             logger.warning(f"Búsqueda precisa para '{qn}' sin resultados. Activando fallback.")
             fallback_params = {'word0': f"%{words[0]}%", 'k': k}
-            fallback_query = text("""
-                SELECT codigo, nombre, precio FROM medicamentos 
-                WHERE nombre ILIKE :word0 
-                ORDER BY LENGTH(nombre) 
-                LIMIT :k
-            """)
-            results = cn.execute(fallback_query, fallback_params).fetchall()
+            results = cn.execute(_ILIKE_FALLBACK_QUERY, fallback_params).fetchall()
 
         logger.debug(f"Búsqueda fuzzy para '{qn}' encontró {len(results)} candidatos.")
         return results
 
+# Términos por sentencia en search_fuzzy_many: una subconsulta top-k por término en cada sentencia
+_FUZZY_TERMS_PER_STATEMENT = 100
+
+_TRGM_SEARCH_MANY_QUERY = text("""
+    SELECT t.pos - 1 AS term, m.codigo, m.nombre, m.precio, m.sim, m.largo
+    FROM unnest(CAST(:qs AS text[])) WITH ORDINALITY AS t(q, pos)
+    CROSS JOIN LATERAL (
+        SELECT codigo, nombre, precio, similarity(nombre, t.q) AS sim, LENGTH(nombre) AS largo
+        FROM medicamentos
+        WHERE nombre % t.q
+        ORDER BY similarity(nombre, t.q) DESC, LENGTH(nombre)
+        LIMIT :k
+    ) m
+    ORDER BY term, m.sim DESC, m.largo
+""")
+
+def _ilike_many_query(terms: List[List[str]], k: int):
+    """UNION ALL con la misma consulta que _ilike_query para cada término; cada fila trae la posición del término."""
+    parts, params = [], {"k": k}
+    for t, words in enumerate(terms):
+        where_clauses = " AND ".join(f"nombre ILIKE :w{t}_{i}" for i in range(len(words)))
+        params.update({f"w{t}_{i}": f"%{word}%" for i, word in enumerate(words)})
+        parts.append(
+            f"SELECT * FROM (SELECT {t} AS term, codigo, nombre, precio, LENGTH(nombre) AS largo "
+            f"FROM medicamentos WHERE {where_clauses} ORDER BY LENGTH(nombre) LIMIT :k) AS q{t}"
+        )
+    return text(" UNION ALL ".join(parts) + " ORDER BY term, largo"), params
+
+def _plan_fuzzy_many(queries: Iterable[str], k: int):
+    """Normaliza y deduplica las consultas y resuelve las que están en caché o en el índice en memoria.
+
+    Devuelve (termino_por_query, resultados_por_termino, pendientes) donde `pendientes`
+    (termino -> palabras) son los términos que hay que buscar en la BD.
+    """
+    termino_por_query: Dict[str, str] = {}
+    resultados: Dict[str, list] = {}
+    pendientes: Dict[str, List[str]] = {}
+    for q in queries:
+        if q in termino_por_query: continue
+        qn = termino_por_query[q] = normalize_text(q) if q else ""
+        if not qn or qn in resultados: continue
+        cached = _cached_fuzzy(qn, k)
+        if cached is not MISSING:
+            resultados[qn] = cached
+            continue
+        rows = _search_in_memory(qn, qn.split(), k)
+        if rows is not None:
+            resultados[qn] = _store_fuzzy(qn, k, rows)
+            continue
+        resultados[qn] = []
+        pendientes[qn] = qn.split()
+    return termino_por_query, resultados, pendientes
+
+def _fuzzy_many_statements(pendientes: Dict[str, List[str]], k: int, fallback: bool = False):
+    """Sentencias (términos, consulta, parámetros) para buscar los términos pendientes por lotes."""
+    for chunk in _chunked(list(pendientes), _FUZZY_TERMS_PER_STATEMENT):
+        if settings.SEARCH_BACKEND == "trgm":
+            yield chunk, _TRGM_SEARCH_MANY_QUERY, {"qs": chunk, "k": k}
+        else:
+            # El fallback, igual que en search_fuzzy, busca solo por la primera palabra
+            query, params = _ilike_many_query([pendientes[t][:1] if fallback else pendientes[t] for t in chunk], k)
+            yield chunk, query, params
+
+def _fuzzy_fallback_terms(pendientes: Dict[str, List[str]], resultados: Dict[str, list]) -> Dict[str, List[str]]:
+    if settings.SEARCH_BACKEND == "trgm":
+        return {}
+    return {qn: words for qn, words in pendientes.items() if not resultados[qn] and len(words) > 1}
+
+def _collect_fuzzy_many(chunk: List[str], rows, resultados: Dict[str, list]):
+    for term, codigo, nombre, precio, *_ in rows:
+        resultados[chunk[term]].append((codigo, nombre, precio))
+
+def _finish_fuzzy_many(termino_por_query: Dict[str, str], resultados: Dict[str, list],
+                       pendientes: Dict[str, List[str]], k: int) -> Dict[str, list]:
+    for qn in pendientes:
+        _store_fuzzy(qn, k, resultados[qn])
+    logger.debug(f"Búsqueda fuzzy por lotes: {len(termino_por_query)} consultas, {len(pendientes)} resueltas en la BD.")
+    return {q: list(resultados.get(qn, [])) for q, qn in termino_por_query.items()}
+
+def _search_fuzzy_many_db(pendientes: Dict[str, List[str]], k: int, resultados: Dict[str, list]):
+    with get_conn() as cn:
+        if settings.SEARCH_BACKEND == "trgm":
+            cn.execute(_TRGM_SET_LIMIT_QUERY, {"limit": settings.TRGM_SIMILARITY_THRESHOLD})
+        for chunk, query, params in _fuzzy_many_statements(pendientes, k):
+            _collect_fuzzy_many(chunk, cn.execute(query, params), resultados)
+        fallback = _fuzzy_fallback_terms(pendientes, resultados)
+        for chunk, query, params in _fuzzy_many_statements(fallback, k, fallback=True):
+            _collect_fuzzy_many(chunk, cn.execute(query, params), resultados)
+
+def search_fuzzy_many(queries: Iterable[str], k: int = 10) -> Dict[str, list]:
+    """Versión por lotes de search_fuzzy: deduplica las consultas (ya normalizadas) y resuelve
+    las que no están en caché con una sentencia cada _FUZZY_TERMS_PER_STATEMENT términos.
+
+    Devuelve un diccionario consulta -> filas (codigo, nombre, precio), con una entrada por consulta.
+    """
+    termino_por_query, resultados, pendientes = _plan_fuzzy_many(queries, k)
+    if pendientes:
+        _search_fuzzy_many_db(pendientes, k, resultados)
+    return _finish_fuzzy_many(termino_por_query, resultados, pendientes, k)
+
 def get_by_exact_name(nombre: str):
+    catalog = _snapshot()
+    if catalog is not None:
+        return catalog.get_by_exact_name(nombre)
     with get_conn() as cn:
-        query = text("SELECT codigo, nombre, precio FROM medicamentos WHERE LOWER(nombre) = LOWER(:nombre)")
-        return cn.execute(query, {"nombre": nombre}).fetchone()
\ No newline at end of file
+        return cn.execute(_GET_BY_EXACT_NAME_QUERY, {"nombre": nombre}).fetchone()
+
+from src.db.aio import (
+    get_async_engine, get_by_codigo_async, get_by_exact_name_async, get_by_codigo_many_async,
+    get_by_exact_name_many_async, search_fuzzy_async, search_fuzzy_many_async, upsert_manual_correction_async
+)
@@ -0,0 +1,180 @@
+"""
+Versiones asíncronas de las consultas de src.db para no bloquear el event loop.
+
+Usan un engine de SQLAlchemy async (asyncpg en PostgreSQL, aiosqlite en pruebas
+locales). Si no hay driver async disponible, la consulta síncrona equivalente se
+ejecuta en el thread pool para que igualmente no bloquee el loop.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from src.config import settings
+from src.utils import normalize_description as normalize_text
+from src.utils.cache import MISSING
+from src.db import (
+    _GET_BY_CODIGO_MANY_QUERY, _GET_BY_CODIGO_QUERY, _GET_BY_EXACT_NAME_MANY_QUERY, _GET_BY_EXACT_NAME_QUERY,
+    _ILIKE_FALLBACK_QUERY, _TRGM_SEARCH_QUERY, _TRGM_SET_LIMIT_QUERY, _UPSERT_MANUAL_QUERY, _cached_fuzzy,
+    _chunked, _codigo_many_result, _collect_fuzzy_many, _exact_name_many_result, _finish_fuzzy_many,
+    _fuzzy_fallback_terms, _fuzzy_many_statements, _ilike_query, _plan_fuzzy_many, _pool_options,
+    _search_fuzzy_many_db, _search_in_memory, _snapshot, _store_fuzzy, get_by_codigo, get_by_codigo_many, get_by_exact_name, get_by_exact_name_many, search_fuzzy, upsert_manual_correction
+)
+
+logger = logging.getLogger(__name__)
+
+# Driver async equivalente a cada driver síncrono de DATABASE_URL
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mssql+pyodbc": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_async_engine: Optional[AsyncEngine] = None
+_async_engine_failed = False
+_lock = threading.Lock()
+
+def _async_database_url() -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = make_url(settings.DATABASE_URL)
+    drivername = _ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+def get_async_engine() -> Optional[AsyncEngine]:
+    """Engine async compartido por el worker; None si está deshabilitado o falta el driver."""
+    global _async_engine, _async_engine_failed
+    if not settings.ASYNC_DB_ENABLED or _async_engine_failed:
+        return None
+    if _async_engine is not None:
+        return _async_engine
+    with _lock:
+        if _async_engine is None and not _async_engine_failed:
+            url = _async_database_url()
+            try:
+                _async_engine = create_async_engine(url, **_pool_options(url))
+            except Exception as e:
+                # Típicamente el driver async no está instalado: usamos el thread pool
+                logger.warning(f"No se pudo crear el engine async ({e}). Se usará el engine síncrono en threads.")
+                _async_engine_failed = True
+    return _async_engine
+
+async def _run_sync(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+async def get_by_codigo_async(codigo: str):
+    catalog = _snapshot()
+    if catalog is not None:
+        return catalog.get_by_codigo(codigo)
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(get_by_codigo, codigo)
+    async with engine.connect() as cn:
+        result = await cn.execute(_GET_BY_CODIGO_QUERY, {"codigo": codigo})
+        return result.fetchone()
+
+async def get_by_exact_name_async(nombre: str):
+    catalog = _snapshot()
+    if catalog is not None:
+        return catalog.get_by_exact_name(nombre)
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(get_by_exact_name, nombre)
+    async with engine.connect() as cn:
+        result = await cn.execute(_GET_BY_EXACT_NAME_QUERY, {"nombre": nombre})
+        return result.fetchone()
+
+async def get_by_codigo_many_async(codigos: Iterable[str]) -> Dict[str, tuple]:
+    codigos = list(dict.fromkeys(c for c in codigos if c))
+    if not codigos: return {}
+    catalog = _snapshot()
+    if catalog is not None:
+        return {c: row for c in codigos if (row := catalog.get_by_codigo(c)) is not None}
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(get_by_codigo_many, codigos)
+    async with engine.connect() as cn:
+        rows = [r for chunk in _chunked(codigos) for r in await cn.execute(_GET_BY_CODIGO_MANY_QUERY, {"codigos": chunk})]
+    return _codigo_many_result(codigos, rows)
+
+async def get_by_exact_name_many_async(nombres: Iterable[str]) -> Dict[str, tuple]:
+    nombres = list(dict.fromkeys(n for n in nombres if n))
+    if not nombres: return {}
+    catalog = _snapshot()
+    if catalog is not None:
+        return {n: row for n in nombres if (row := catalog.get_by_exact_name(n)) is not None}
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(get_by_exact_name_many, nombres)
+    async with engine.connect() as cn:
+        rows = [r for chunk in _chunked(list(dict.fromkeys(n.lower() for n in nombres)))
+                for r in await cn.execute(_GET_BY_EXACT_NAME_MANY_QUERY, {"nombres": chunk})]
+    return _exact_name_many_result(nombres, rows)
+
+async def upsert_manual_correction_async(nombre_factura: str, codigo_medicamento: str):
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(upsert_manual_correction, nombre_factura, codigo_medicamento)
+    async with engine.begin() as conn:
+        await conn.execute(_UPSERT_MANUAL_QUERY, {"nombre_factura": nombre_factura, "codigo_medicamento": codigo_medicamento})
+
+async def search_fuzzy_async(q: str, k: int = 10):
+    qn = normalize_text(q)
+    if not qn: return []
+    words = qn.split()
+    if not words: return []
+
+    cached = _cached_fuzzy(qn, k)
+    if cached is not MISSING:
+        return cached
+
+    # El índice invertido recorre listas de postings en CPU: fuera del loop
+    results = await _run_sync(_search_in_memory, qn, words, k)
+    if results is not None:
+        return _store_fuzzy(qn, k, results)
+
+    engine = get_async_engine()
+    if engine is None:
+        return await _run_sync(search_fuzzy, q, k)
+
+    return _store_fuzzy(qn, k, await _search_fuzzy_db(engine, qn, words, k))
+
+async def _search_fuzzy_db(engine: AsyncEngine, qn: str, words, k: int):
+    async with engine.connect() as cn:
+        if settings.SEARCH_BACKEND == "trgm":
+            await cn.execute(_TRGM_SET_LIMIT_QUERY, {"limit": settings.TRGM_SIMILARITY_THRESHOLD})
+            results = (await cn.execute(_TRGM_SEARCH_QUERY, {"q": qn, "k": k})).fetchall()
+            logger.debug(f"Búsqueda fuzzy async (pg_trgm) para '{qn}' encontró {len(results)} candidatos.")
+            return results
+
+        query, params = _ilike_query(words, k)
+        results = (await cn.execute(query, params)).fetchall()
+        if not results and len(words) > 1:
+            logger.warning(f"Búsqueda precisa para '{qn}' sin resultados. Activando fallback.")
+            results = (await cn.execute(_ILIKE_FALLBACK_QUERY, {'word0': f"%{words[0]}%", 'k': k})).fetchall()
+
+        logger.debug(f"Búsqueda fuzzy async para '{qn}' encontró {len(results)} candidatos.")
+        return results
+
+async def search_fuzzy_many_async(queries: Iterable[str], k: int = 10) -> Dict[str, list]:
+    """Versión async de search_fuzzy_many: todas las sentencias del lote usan una única conexión."""
+    # El plan resuelve en el índice invertido (CPU) todo lo que puede: fuera del loop
+    termino_por_query, resultados, pendientes = await _run_sync(_plan_fuzzy_many, list(queries), k)
+    if pendientes:
+        engine = get_async_engine()
+        if engine is None:
+            await _run_sync(_search_fuzzy_many_db, pendientes, k, resultados)
+        else:
+            async with engine.connect() as cn:
+                if settings.SEARCH_BACKEND == "trgm":
+                    await cn.execute(_TRGM_SET_LIMIT_QUERY, {"limit": settings.TRGM_SIMILARITY_THRESHOLD})
+                for chunk, query, params in _fuzzy_many_statements(pendientes, k):
+                    _collect_fuzzy_many(chunk, await cn.execute(query, params), resultados)
+                fallback = _fuzzy_fallback_terms(pendientes, resultados)
+                for chunk, query, params in _fuzzy_many_statements(fallback, k, fallback=True):
+                    _collect_fuzzy_many(chunk, await cn.execute(query, params), resultados)
+    return _finish_fuzzy_many(termino_por_query, resultados, pendientes, k)
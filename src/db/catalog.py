@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text
+from thefuzz import utils as fuzz_utils
+from src.config import settings
+from src.utils import normalize_description as normalize_text
+
+logger = logging.getLogger(__name__)
+
+CatalogRow = Tuple[str, str, object]
+
+class CatalogSnapshot:
+    """Foto de solo lectura de la tabla medicamentos, indexada en memoria."""
+
+    def __init__(self, rows: List[Tuple[str, Optional[str], str, object]]):
+        # Cada fila conserva la forma (codigo, nombre, precio) que devuelven las consultas SQL
+        self.rows: List[CatalogRow] = []
+        self.by_codigo: Dict[str, CatalogRow] = {}
+        self.by_troquel: Dict[str, CatalogRow] = {}
+        self.by_name: Dict[str, CatalogRow] = {}
+
+        digest = hashlib.sha1()
+        for codigo, troquel, nombre, precio in rows:
+            row = (codigo, nombre, precio)
+            self.rows.append(row)
+            # setdefault: ante duplicados nos quedamos con la primera fila, igual que fetchone()
+            self.by_codigo.setdefault(codigo, row)
+            if troquel:
+                self.by_troquel.setdefault(troquel, row)
+            if nombre:
+                self.by_name.setdefault(nombre.lower(), row)
+            digest.update(f"{codigo}\x1f{troquel}\x1f{nombre}\x1f{precio}\x1e".encode("utf-8"))
+
+        self.version = digest.hexdigest()[:16]
+        self.loaded_at = time.time()
+        # Formas precalculadas de cada nombre, llenadas a demanda y válidas mientras dure la foto
+        self._normalized: Dict[str, str] = {}
+        self._processed: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_by_codigo(self, codigo: str) -> Optional[CatalogRow]:
+        """Busca por código y, si no existe, por troquel (mismo criterio que el UNION en SQL)."""
+        return self.by_codigo.get(codigo) or self.by_troquel.get(codigo)
+
+    def get_by_exact_name(self, nombre: str) -> Optional[CatalogRow]:
+        return self.by_name.get(nombre.lower())
+
+    def normalized_name(self, nombre: str) -> str:
+        """normalize_description(nombre), calculado una sola vez por nombre."""
+        value = self._normalized.get(nombre)
+        if value is None:
+            value = self._normalized[nombre] = normalize_text(nombre)
+        return value
+
+    def processed_name(self, nombre: str) -> str:
+        """Nombre preprocesado como lo hace thefuzz antes de puntuar (full_process)."""
+        value = self._processed.get(nombre)
+        if value is None:
+            value = self._processed[nombre] = fuzz_utils.full_process(nombre, force_ascii=True)
+        return value
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_lock = threading.Lock()
+# Momento del último intento fallido de carga (monotonic); None si no hubo o ya se cargó
+_failed_at: Optional[float] = None
+
+def _in_cooldown() -> bool:
+    return _failed_at is not None and time.monotonic() - _failed_at < settings.CATALOG_RETRY_SECONDS
+
+def _load_snapshot() -> CatalogSnapshot:
+    from src.db import get_conn
+
+    start_time = time.time()
+    query = text("SELECT codigo, troquel, nombre, precio FROM medicamentos")
+    with get_conn() as cn:
+        rows = [tuple(r) for r in cn.execute(query)]
+    snapshot = CatalogSnapshot(rows)
+    logger.info(
+        f"Catálogo en memoria cargado: {len(snapshot)} medicamentos "
+        f"(versión {snapshot.version}) en {(time.time() - start_time) * 1000:.2f}ms."
+    )
+    return snapshot
+
+def get_catalog() -> Optional[CatalogSnapshot]:
+    """Devuelve el catálogo en memoria, cargándolo una sola vez por worker.
+
+    Si la carga falla devuelve None y los llamadores vuelven a consultar la BD; no se
+    reintenta hasta pasados CATALOG_RETRY_SECONDS, para no repetir la carga completa
+    en cada búsqueda mientras la BD siga fallando.
+    """
+    global _snapshot, _failed_at
+    if _snapshot is not None:
+        return _snapshot
+    if _in_cooldown():
+        return None
+    with _lock:
+        if _snapshot is None:
+            # Quien esperaba el lock mientras otro fallaba no repite la carga
+            if _in_cooldown():
+                return None
+            try:
+                _snapshot = _load_snapshot()
+                _failed_at = None
+            except Exception as e:
+                _failed_at = time.monotonic()
+                logger.error(
+                    f"No se pudo cargar el catálogo en memoria (reintento en {settings.CATALOG_RETRY_SECONDS}s): {e}"
+                )
+                return None
+    return _snapshot
+
+def refresh_catalog() -> CatalogSnapshot:
+    """Recarga el catálogo desde la BD y reemplaza la foto actual de forma atómica."""
+    global _snapshot, _failed_at
+    snapshot = _load_snapshot()
+    with _lock:
+        _snapshot = snapshot
+        _failed_at = None
+    return snapshot
+
+def normalized_name(nombre: str) -> str:
+    """Nombre de catálogo normalizado, reutilizando el cálculo de la foto en memoria si existe."""
+    catalog = _snapshot
+    return catalog.normalized_name(nombre) if catalog is not None else normalize_text(nombre)
+
+def processed_name(nombre: str) -> str:
+    """Nombre de catálogo preprocesado para thefuzz/rapidfuzz, reutilizando la foto en memoria si existe."""
+    catalog = _snapshot
+    return catalog.processed_name(nombre) if catalog is not None else fuzz_utils.full_process(nombre, force_ascii=True)
@@ -0,0 +1,147 @@
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+from src.config import settings
+from src.db import specs as spec_store
+from src.db.catalog import CatalogSnapshot, get_catalog
+from src.utils import normalize_description as normalize_text
+
+logger = logging.getLogger(__name__)
+
+# (dosis en unidad base, forma, unidades por envase); None = no figura en el nombre
+SpecKey = Tuple[Optional[Tuple[float, str]], Optional[str], Optional[int]]
+
+def spec_key(spec: Dict) -> SpecKey:
+    dose = (spec["dose_value"], spec["dose_unit"]) if spec.get("dose_value") is not None else None
+    return dose, spec.get("form") or None, spec.get("pack_count")
+
+def compatible(a: SpecKey, b: SpecKey) -> bool:
+    """True si ninguna especificación presente en ambos lados se contradice."""
+    return all(x is None or y is None or x == y for x, y in zip(a, b))
+
+class SpecIndex:
+    """Índice del catálogo por principio activo y, dentro de cada uno, por dosis canónica.
+
+    Permite traer solo los medicamentos con especificaciones compatibles con la línea de
+    la factura (misma dosis, forma y envase cuando figuran) antes del scoring fuzzy.
+    """
+
+    def __init__(self, catalog: CatalogSnapshot):
+        self.version = catalog.version
+        self.generation = spec_store.generation
+        self.rows = catalog.rows
+        self.name_lengths = [len(row[1] or "") for row in self.rows]
+
+        specs = spec_store.get_medication_specs_many(self.rows)
+        self.row_keys: List[SpecKey] = []
+        by_active: Dict[str, List[int]] = defaultdict(list)
+        by_active_dose: Dict[tuple, List[int]] = defaultdict(list)
+        for row_id, row in enumerate(self.rows):
+            spec = specs[row[0]]
+            key = spec_key(spec)
+            self.row_keys.append(key)
+            active = normalize_text(spec["active"])
+            if active:
+                by_active[active].append(row_id)
+                if key[0] is not None:
+                    by_active_dose[(active, key[0])].append(row_id)
+        self.by_active = dict(by_active)
+        self.by_active_dose = dict(by_active_dose)
+
+    def candidates(self, active: str, key: SpecKey, k: int) -> List[tuple]:
+        """Hasta k filas (codigo, nombre, precio) del principio activo compatibles con `key`."""
+        active = normalize_text(active)
+        if not active:
+            return []
+        # Con dosis conocida se parte de la lista (más chica) de ese principio activo y dosis;
+        # las filas del catálogo sin dosis también son compatibles
+        if key[0] is not None:
+            ids = self.by_active_dose.get((active, key[0]), []) + [
+                i for i in self.by_active.get(active, []) if self.row_keys[i][0] is None
+            ]
+        else:
+            ids = self.by_active.get(active, [])
+        ids = [i for i in ids if compatible(self.row_keys[i], key)]
+        return [self.rows[i] for i in heapq.nsmallest(k, ids, key=lambda i: (self.name_lengths[i], i))]
+
+
+_index: Optional[SpecIndex] = None
+_lock = threading.Lock()
+_building = threading.Event()
+
+def _is_current(index: Optional[SpecIndex], catalog: CatalogSnapshot) -> bool:
+    return index is not None and index.version == catalog.version and index.generation == spec_store.generation
+
+def build_spec_index() -> Optional[SpecIndex]:
+    """Construye (si hace falta) el índice de especificaciones del catálogo actual.
+
+    Parsea o lee las especificaciones de todo el catálogo: se llama al iniciar el worker y
+    desde POST /db/catalog/refresh, nunca desde una búsqueda.
+    """
+    global _index
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    with _lock:
+        if not _is_current(_index, catalog):
+            start_time = time.time()
+            _index = SpecIndex(catalog)
+            logger.info(
+                f"Índice de especificaciones construido: {len(_index.by_active)} principios activos sobre "
+                f"{len(catalog)} medicamentos en {(time.time() - start_time) * 1000:.2f}ms."
+            )
+        return _index
+
+def _build_in_background():
+    try:
+        build_spec_index()
+    except Exception as e:
+        logger.error(f"Error al construir el índice de especificaciones: {e}", exc_info=True)
+    finally:
+        _building.clear()
+
+def get_spec_index() -> Optional[SpecIndex]:
+    """Índice de especificaciones del catálogo actual, sin construirlo en la request.
+
+    Si todavía no existe o quedó viejo (el catálogo o medicamentos_spec cambiaron), se
+    reconstruye en un hilo aparte y mientras tanto se devuelve None.
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    index = _index
+    if _is_current(index, catalog):
+        return index
+    if not _building.is_set():
+        _building.set()
+        threading.Thread(target=_build_in_background, name="spec-index", daemon=True).start()
+    return None
+
+def filter_candidates_by_specs(nombres: Sequence[str], filas_por_item: Sequence[Sequence[tuple]], k: int) -> List[List[tuple]]:
+    """Deja, para cada ítem, solo los candidatos con especificaciones compatibles con su descripción.
+
+    A los candidatos textuales compatibles se suman los del índice de especificaciones
+    (mismo principio activo, dosis, forma y envase) hasta completar k. Si el ítem no tiene
+    especificaciones o no queda ningún candidato compatible, se conservan los originales.
+    """
+    specs = spec_store.get_medication_specs_many(fila for filas in filas_por_item for fila in filas)
+    index = get_spec_index() if settings.CATALOG_SNAPSHOT_ENABLED else None
+
+    resultado = []
+    for nombre, filas in zip(nombres, filas_por_item):
+        spec_factura = spec_store.parse_medication_nombre(nombre)
+        key = spec_key(spec_factura)
+        if key == (None, None, None):
+            resultado.append(list(filas))
+            continue
+
+        compatibles = [fila for fila in filas if compatible(spec_key(specs[fila[0]]), key)]
+        if index is not None and len(compatibles) < k:
+            vistos = {fila[0] for fila in compatibles}
+            extra = [fila for fila in index.candidates(spec_factura["active"], key, k) if fila[0] not in vistos]
+            compatibles += extra[:k - len(compatibles)]
+        resultado.append(compatibles or list(filas))
+    return resultado
@@ -0,0 +1,241 @@
+"""
+Especificaciones estructuradas de cada medicamento del catálogo (marca, principio activo,
+forma, dosis y envase), parseadas una sola vez y guardadas en la tabla medicamentos_spec.
+
+La tabla se crea con `alembic upgrade head` y se llena/actualiza de forma incremental con
+refresh_medication_specs (ver build_medication_specs.py y POST /db/catalog/refresh): solo se
+reparsean las filas nuevas o cuyo nombre cambió. Las búsquedas adjuntan la especificación
+por código en lugar de volver a parsear el nombre de cada candidato.
+"""
+import logging
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple
+from sqlalchemy import bindparam, inspect, text
+from src.config import settings
+from src.db.catalog import get_catalog
+from src.services.medication_parser import MedicationParser
+
+logger = logging.getLogger(__name__)
+
+# Subir la versión cuando cambie el parseo: refresh_medication_specs reparsea las filas viejas
+PARSER_VERSION = 1
+SPEC_FIELDS = ("brand", "active", "form", "dose", "pack", "dose_value", "dose_unit", "pack_count")
+
+_parser = MedicationParser()
+
+# Dosis canónica: masa en mg, volumen en ml y unidades internacionales en ui
+_UNIT_TO_BASE = {
+    "MCG": (0.001, "mg"), "MG": (1.0, "mg"), "G": (1000.0, "mg"), "GR": (1000.0, "mg"), "GRS": (1000.0, "mg"),
+    "ML": (1.0, "ml"), "L": (1000.0, "ml"), "UI": (1.0, "ui"),
+}
+_DOSE_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*(MCG|MG|GRS|GR|G|ML|L|UI)\b', re.IGNORECASE)
+# Cantidad de unidades del envase: "x 20", "x20" (no "x 100 ML") o "16 COMPRIMIDOS"
+_PACK_PATTERN = re.compile(
+    r'\bX\s*(\d+)\b(?!\s*(?:MCG|MG|GRS|GR|G|ML|L|UI)\b)'
+    r'|\b(\d+)\s*(?:COMPRIMIDOS?|COMP|CAPSULAS?|CAPS|TABLETAS?|GRAGEAS?|SOBRES?|AMPOLLAS?|AMP|UNIDADES|UNDS?)\b',
+    re.IGNORECASE
+)
+
+def _strip_accents(value: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c))
+
+# Forma farmacéutica por palabra completa (por subcadena 'amp' coincidiría con AMPICILINA)
+_FORMS = {_strip_accents(k): v.strip() for k, v in _parser.medication_forms.items()}
+_FORM_PATTERN = re.compile(r'\b(' + '|'.join(sorted(_FORMS, key=len, reverse=True)) + r')\b', re.IGNORECASE)
+
+def canonical_dose(nombre: str) -> Tuple[Optional[float], Optional[str]]:
+    """Primera dosis del nombre convertida a unidad base: (valor, 'mg' | 'ml' | 'ui')."""
+    match = _DOSE_PATTERN.search(nombre)
+    if not match:
+        return None, None
+    factor, unit = _UNIT_TO_BASE[match.group(2).upper()]
+    return round(float(match.group(1).replace(",", ".")) * factor, 6), unit
+
+def pack_count(nombre: str) -> Optional[int]:
+    match = _PACK_PATTERN.search(nombre)
+    if not match:
+        return None
+    return int(match.group(1) or match.group(2))
+
+def canonical_form(nombre: str) -> Optional[str]:
+    match = _FORM_PATTERN.search(_strip_accents(nombre))
+    return _FORMS[match.group(1).lower()] if match else None
+
+# Restos que deja el parser al cortar antes del envase ("AGUA DESTILADA X 10 ML" -> "AGUA DESTILADA X")
+_TRAILING_NOISE = re.compile(r'(?:\s+X)?[\s\W]*$', re.IGNORECASE)
+
+def _clean(value: str) -> str:
+    value = _TRAILING_NOISE.sub('', value)
+    return value if re.search(r'[^\W\d_]', value) else ''
+
+@lru_cache(maxsize=65_536)
+def _parse(nombre: str) -> Tuple:
+    parsed = _parser.parse_medication_name(nombre)
+    dose_value, dose_unit = canonical_dose(nombre)
+    count = pack_count(nombre)
+    return (
+        _clean(parsed["brand"]),
+        _clean(parsed["active"]),
+        canonical_form(nombre) or _clean(parsed["form"]),
+        parsed["dose"],
+        parsed["pack"] or (str(count) if count is not None else ""),
+        dose_value,
+        dose_unit,
+        count,
+    )
+
+def parse_medication_nombre(nombre: str) -> Dict[str, Any]:
+    """Especificación de un nombre de medicamento (campos de SPEC_FIELDS), sin pasar por la tabla."""
+    return dict(zip(SPEC_FIELDS, _parse(nombre or "")))
+
+
+_SELECT_SPECS_QUERY = text(f"""
+    SELECT codigo, nombre, {", ".join(SPEC_FIELDS)} FROM medicamentos_spec WHERE parser_version = :version
+""")
+
+_UPSERT_SPEC_QUERY = text(f"""
+    INSERT INTO medicamentos_spec (codigo, nombre, {", ".join(SPEC_FIELDS)}, parser_version)
+    VALUES (:codigo, :nombre, {", ".join(":" + f for f in SPEC_FIELDS)}, :parser_version)
+    ON CONFLICT (codigo)
+    DO UPDATE SET nombre = EXCLUDED.nombre, {", ".join(f"{f} = EXCLUDED.{f}" for f in SPEC_FIELDS)},
+        parser_version = EXCLUDED.parser_version
+""")
+
+_DELETE_ORPHAN_SPECS_QUERY = text("DELETE FROM medicamentos_spec WHERE codigo NOT IN (SELECT codigo FROM medicamentos)")
+
+def refresh_medication_specs(full: bool = False) -> Dict[str, int]:
+    """Sincroniza medicamentos_spec con medicamentos.
+
+    Parsea solo las filas nuevas, las que cambiaron de nombre y las de una versión de parser
+    anterior (todas con full=True), y borra las especificaciones de códigos que ya no existen.
+    """
+    from src.db import _chunked, get_conn
+
+    query = text("""
+        SELECT m.codigo, m.nombre, s.nombre, s.parser_version
+        FROM medicamentos m LEFT JOIN medicamentos_spec s ON s.codigo = m.codigo
+    """)
+    with get_conn() as cn:
+        vistos, cambios = set(), []
+        for codigo, nombre, spec_nombre, version in cn.execute(query):
+            # Ante códigos duplicados vale la primera fila, igual que en el catálogo en memoria
+            if codigo in vistos:
+                continue
+            vistos.add(codigo)
+            nombre = nombre or ""
+            if full or spec_nombre != nombre or version != PARSER_VERSION:
+                cambios.append({"codigo": codigo, "nombre": nombre, **parse_medication_nombre(nombre), "parser_version": PARSER_VERSION})
+        for chunk in _chunked(cambios):
+            cn.execute(_UPSERT_SPEC_QUERY, chunk)
+        borrados = cn.execute(_DELETE_ORPHAN_SPECS_QUERY).rowcount
+        cn.commit()
+
+    reset_spec_cache()
+    stats = {"medicamentos": len(vistos), "actualizados": len(cambios), "borrados": max(borrados or 0, 0)}
+    logger.info(f"Especificaciones del catálogo sincronizadas: {stats}")
+    return stats
+
+
+# Copia en memoria de medicamentos_spec (codigo -> (nombre, *SPEC_FIELDS)), ligada a la versión del catálogo
+_spec_map: Optional[Dict[str, Tuple]] = None
+_spec_map_version: Optional[str] = None
+_spec_table_missing = False
+# Ya se comprobó que la tabla existe: no se vuelve a consultar el esquema en cada búsqueda
+_spec_table_present = False
+# Reentrante: _snapshot_spec_map carga la tabla con el lock tomado
+_spec_lock = threading.RLock()
+# Cambia en cada reset_spec_cache: los índices construidos sobre las especificaciones se rehacen
+generation = 0
+
+def reset_spec_cache():
+    """Descarta la copia en memoria de medicamentos_spec; se recarga en la próxima búsqueda."""
+    global _spec_map, _spec_table_missing, _spec_table_present, generation
+    with _spec_lock:
+        _spec_map = None
+        _spec_table_missing = False
+        _spec_table_present = False
+        generation += 1
+
+def _spec_table_exists(cn) -> bool:
+    return inspect(cn).has_table("medicamentos_spec")
+
+def _load_spec_map(codigos: Optional[list] = None) -> Optional[Dict[str, Tuple]]:
+    """Filas de medicamentos_spec por código; None si la tabla no se pudo leer."""
+    from src.db import _chunked, get_conn
+
+    global _spec_table_missing, _spec_table_present
+    with _spec_lock:
+        if _spec_table_missing:
+            return None
+        check_table = not _spec_table_present
+    try:
+        with get_conn() as cn:
+            if check_table and not _spec_table_exists(cn):
+                # Migración pendiente: se parsea cada nombre a demanda hasta el próximo refresh
+                with _spec_lock:
+                    if not _spec_table_missing:
+                        logger.warning("La tabla medicamentos_spec no existe: las especificaciones se parsean a demanda.")
+                    _spec_table_missing = True
+                return None
+            if codigos is None:
+                rows = cn.execute(_SELECT_SPECS_QUERY, {"version": PARSER_VERSION}).fetchall()
+            else:
+                query = text(_SELECT_SPECS_QUERY.text + " AND codigo IN :codigos").bindparams(bindparam("codigos", expanding=True))
+                rows = [r for chunk in _chunked(codigos) for r in cn.execute(query, {"version": PARSER_VERSION, "codigos": chunk})]
+    except Exception as e:
+        # Error transitorio (p. ej. conexión caída): no se recuerda, se reintenta en la próxima búsqueda
+        # (volviendo a comprobar la tabla, por si el error es que ya no existe)
+        logger.warning(f"No se pudieron leer las especificaciones de medicamentos_spec: {e}")
+        with _spec_lock:
+            _spec_table_present = False
+        return None
+    with _spec_lock:
+        _spec_table_present = True
+    specs: Dict[str, Tuple] = {}
+    for codigo, *values in rows:
+        specs.setdefault(codigo, tuple(values))
+    return specs
+
+def _snapshot_spec_map() -> Optional[Dict[str, Tuple]]:
+    """Todas las especificaciones en memoria si el catálogo en memoria está habilitado."""
+    global _spec_map, _spec_map_version
+    catalog = get_catalog() if settings.CATALOG_SNAPSHOT_ENABLED else None
+    if catalog is None:
+        return None
+    with _spec_lock:
+        if _spec_map is None or _spec_map_version != catalog.version:
+            specs = _load_spec_map()
+            if specs is None and not _spec_table_missing:
+                return {}  # Error transitorio: esta vez se parsea a demanda y se reintenta la carga
+            _spec_map = specs or {}
+            _spec_map_version = catalog.version
+            logger.info(f"Especificaciones de {len(_spec_map)} medicamentos cargadas en memoria.")
+        return _spec_map
+
+def get_medication_specs_many(rows: Iterable[tuple]) -> Dict[str, Dict[str, Any]]:
+    """Especificaciones de varias filas (codigo, nombre, ...) de medicamentos, por código.
+
+    Se toman de medicamentos_spec (en memoria o con una consulta por lote) y solo se parsea
+    el nombre de las filas que no están en la tabla o cuyo nombre cambió desde el último refresh.
+    """
+    nombres = {}
+    for row in rows:
+        nombres.setdefault(row[0], row[1] or "")
+    if not nombres:
+        return {}
+
+    specs = _snapshot_spec_map()
+    if specs is None:
+        specs = _load_spec_map(list(nombres)) or {}
+
+    result = {}
+    for codigo, nombre in nombres.items():
+        stored = specs.get(codigo)
+        if stored is not None and stored[0] == nombre:
+            result[codigo] = dict(zip(SPEC_FIELDS, stored[1:]))
+        else:
+            result[codigo] = parse_medication_nombre(nombre)
+    return result
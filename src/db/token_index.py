@@ -0,0 +1,132 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional
+from src.db.catalog import CatalogSnapshot, get_catalog
+
+logger = logging.getLogger(__name__)
+
+class TokenIndex:
+    """Índice invertido sobre los tokens normalizados de medicamentos.nombre.
+
+    Reemplaza los `nombre ILIKE '%palabra%'` de search_fuzzy: cada palabra de la
+    consulta se expande por prefijo sobre el vocabulario ordenado y las listas de
+    postings se intersectan empezando por la más corta.
+    """
+
+    def __init__(self, catalog: CatalogSnapshot):
+        self.version = catalog.version
+        self.rows = catalog.rows
+        self.name_lengths = [len(row[1] or "") for row in self.rows]
+
+        self.row_tokens: List[tuple] = []
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for row_id, row in enumerate(self.rows):
+            tokens = tuple(dict.fromkeys(catalog.normalized_name(row[1] or "").split()))
+            self.row_tokens.append(tokens)
+            for token in tokens:
+                postings[token].append(row_id)
+        self.postings = dict(postings)
+        self.vocabulary = sorted(self.postings)
+
+    def _expand_prefix(self, word: str) -> List[str]:
+        """Tokens del vocabulario que empiezan con `word`."""
+        start = pos = bisect_left(self.vocabulary, word)
+        while pos < len(self.vocabulary) and self.vocabulary[pos].startswith(word):
+            pos += 1
+        return self.vocabulary[start:pos]
+
+    def _postings_for(self, tokens: List[str]) -> set:
+        ids = set()
+        for token in tokens:
+            ids.update(self.postings[token])
+        return ids
+
+    def _top_by_length(self, ids, k: int) -> List[int]:
+        # Mismo orden que la consulta SQL original: ORDER BY LENGTH(nombre)
+        return heapq.nsmallest(k, ids, key=lambda i: (self.name_lengths[i], i))
+
+    def search(self, words: List[str], k: int = 10) -> List[tuple]:
+        """Devuelve hasta k filas (codigo, nombre, precio) que contienen todas las palabras."""
+        if not words: return []
+        expansions = {w: self._expand_prefix(w) for w in dict.fromkeys(words)}
+        # Empezamos por la palabra más selectiva; el resto se verifica fila a fila
+        # sobre el conjunto (ya chico) en lugar de materializar postings enormes.
+        ordered = sorted(expansions, key=lambda w: sum(len(self.postings[t]) for t in expansions[w]))
+
+        matched = self._postings_for(expansions[ordered[0]])
+        for word in ordered[1:]:
+            if not matched: break
+            matched = {i for i in matched if any(t.startswith(word) for t in self.row_tokens[i])}
+
+        if matched:
+            return [self.rows[i] for i in self._top_by_length(matched, k)]
+        if len(expansions) < 2:
+            return []
+
+        # Fallback: sin filas que contengan todas las palabras, rankeamos por las
+        # palabras que sí coinciden, pesando más las poco frecuentes (IDF).
+        total = len(self.rows)
+        scores: Dict[int, float] = defaultdict(float)
+        for tokens in expansions.values():
+            ids = self._postings_for(tokens)
+            if not ids: continue
+            idf = math.log(1 + total / len(ids))
+            for i in ids:
+                scores[i] += idf
+        best = heapq.nsmallest(k, scores, key=lambda i: (-scores[i], self.name_lengths[i], i))
+        return [self.rows[i] for i in best]
+
+
+_index: Optional[TokenIndex] = None
+_lock = threading.Lock()
+_building = threading.Event()
+
+def build_token_index() -> Optional[TokenIndex]:
+    """Construye (si hace falta) el índice invertido del catálogo actual.
+
+    Recorre todo el catálogo: se llama al iniciar el worker y desde POST /db/catalog/refresh,
+    nunca desde una búsqueda.
+    """
+    global _index
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    with _lock:
+        if _index is None or _index.version != catalog.version:
+            start_time = time.time()
+            _index = TokenIndex(catalog)
+            logger.info(
+                f"Índice invertido construido: {len(_index.vocabulary)} tokens sobre "
+                f"{len(catalog)} medicamentos en {(time.time() - start_time) * 1000:.2f}ms."
+            )
+        return _index
+
+def _build_in_background():
+    try:
+        build_token_index()
+    except Exception as e:
+        logger.error(f"Error al construir el índice invertido: {e}", exc_info=True)
+    finally:
+        _building.clear()
+
+def get_token_index() -> Optional[TokenIndex]:
+    """Índice invertido del catálogo actual, sin construirlo en la request.
+
+    Si todavía no existe o el catálogo cambió, se reconstruye en un hilo aparte y mientras
+    tanto se devuelve None (search_fuzzy consulta la BD).
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    index = _index
+    if index is not None and index.version == catalog.version:
+        return index
+    if not _building.is_set():
+        _building.set()
+        threading.Thread(target=_build_in_background, name="token-index", daemon=True).start()
+    return None
@@ -6,6 +6,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.routers import invoices, ai_assistant as ai_assistant_router, feedback as feedback_router, database as database_router
 from src.services.main_service import orchestrator
+from src.db import get_catalog
+from src.db.spec_index import build_spec_index
+from src.db.token_index import build_token_index
+from src.services.synonym_promoter import shutdown_synonym_promoter
+from src.config import settings
 
 logging.basicConfig(level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -38,10 +43,19 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Medicamentos API v2")
+    if settings.CATALOG_SNAPSHOT_ENABLED:
+        get_catalog()  # Precarga el catálogo en memoria de este worker
+        if settings.SEARCH_BACKEND == "index":
+            build_token_index()  # Fuera de la primera búsqueda fuzzy
+        if settings.SPEC_FILTER_ENABLED:
+            build_spec_index()  # Fuera de la primera request de la Fase 2
+    await invoices.job_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down Medicamentos API v2")
+    await invoices.job_queue.stop()
+    shutdown_synonym_promoter()  # Guarda los sinónimos aprendidos que sigan en cola
 
 app.include_router(invoices.router)
 app.include_router(ai_assistant_router.router)
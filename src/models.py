@@ -25,4 +25,16 @@ class Paciente(BaseModel):
     facturas: List[Factura]
 
 class InvoiceInput(BaseModel):
-    pacientes: List[Paciente]
\ No newline at end of file
+    pacientes: List[Paciente]
+
+class MedicationSpec(BaseModel):
+    """Especificación estructurada de un medicamento del catálogo (ver src/db/specs.py)."""
+    brand: str = ""
+    active: str = ""
+    form: str = ""
+    dose: str = ""
+    pack: str = ""
+    # Dosis en unidad base ('mg', 'ml' o 'ui') y cantidad de unidades del envase
+    dose_value: Optional[float] = None
+    dose_unit: Optional[str] = None
+    pack_count: Optional[int] = None
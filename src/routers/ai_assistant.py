@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, Any
 from src.services.ai_assistant import AIAssistant
 
@@ -13,4 +14,13 @@ async def conciliate_item_endpoint(item_to_conciliate: Dict[str, Any]):
     try:
         return await ai_assistant_service.conciliate_item(item_to_conciliate)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en la conciliación: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error en la conciliación: {e}")
+
+@router.get("/cache/stats")
+async def conciliation_cache_stats():
+    """
+    Estadísticas de la caché de conciliaciones (aciertos, fallos, desalojos y entradas).
+    """
+    if ai_assistant_service.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await run_in_threadpool(ai_assistant_service.cache.stats))}
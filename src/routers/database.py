@@ -1,7 +1,12 @@
 import logging
 from typing import List, Dict, Any
-from fastapi import APIRouter, Query
-from src.db import search_fuzzy
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from src.config import settings
+from src.db import search_fuzzy_async, refresh_catalog, refresh_medication_specs
+from src.db.spec_index import build_spec_index
+from src.db.token_index import build_token_index
+from src.services.monitoring import metrics_collector
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/db", tags=["Búsqueda en Base de Datos"])
@@ -12,7 +17,40 @@ async def search_medicamentos_endpoint(q: str = Query(..., min_length=3)):
     Endpoint de búsqueda en vivo para que el front-end encuentre candidatos
     en la base de datos de medicamentos.
     """
-    results = search_fuzzy(q, k=15)
+    results = await search_fuzzy_async(q, k=15)
     # Convertimos los resultados a un formato JSON amigable
     candidates = [{"codigo": r[0], "nombre": r[1], "precio": r[2]} for r in results]
-    return candidates
\ No newline at end of file
+    return candidates
+
+@router.post("/catalog/refresh")
+async def refresh_catalog_endpoint():
+    """
+    Recarga desde la base de datos el catálogo de medicamentos en memoria del worker
+    que atiende el pedido. Usar luego de actualizar la tabla medicamentos; con varios
+    workers, los demás conservan su catálogo hasta reiniciarse o recibir su propio refresh.
+    También sincroniza la tabla medicamentos_spec (solo reparsea las filas que cambiaron)
+    y reconstruye el índice invertido de search_fuzzy y el de especificaciones de la Fase 2.
+    """
+    try:
+        specs = await run_in_threadpool(refresh_medication_specs)
+    except Exception as e:
+        # La tabla puede no existir todavía (migración pendiente): las búsquedas parsean a demanda
+        logger.warning(f"No se pudieron sincronizar las especificaciones del catálogo: {e}")
+        specs = None
+    try:
+        catalog = await run_in_threadpool(refresh_catalog)
+        if settings.SEARCH_BACKEND == "index":
+            await run_in_threadpool(build_token_index)
+        if settings.SPEC_FILTER_ENABLED:
+            await run_in_threadpool(build_spec_index)
+    except Exception as e:
+        logger.error(f"Error al recargar el catálogo en memoria: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="No se pudo recargar el catálogo.")
+    return {"status": "success", "medicamentos": len(catalog), "version": catalog.version, "especificaciones": specs}
+
+@router.get("/cache/stats")
+async def cache_stats_endpoint():
+    """
+    Aciertos, fallos y desalojos de las cachés de búsqueda de este worker.
+    """
+    return metrics_collector.get_metrics()["caches"]
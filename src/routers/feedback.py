@@ -1,7 +1,7 @@
 import logging
 from fastapi import APIRouter, HTTPException, Body
 from pydantic import BaseModel
-from src.db import upsert_manual_correction
+from src.db import upsert_manual_correction_async
 from src.services.main_service import orchestrator # Importamos la instancia singleton
 from src.utils import normalize_description # Importamos la función de normalización
 
@@ -22,7 +22,7 @@ async def submit_manual_review(review: ManualReview = Body(...)):
         normalized_name = normalize_description(review.nombre_factura)
         
         logger.info(f"Guardando nuevo mapeo en la BD: '{normalized_name}' -> '{review.codigo_bd_correcto}'")
-        upsert_manual_correction(normalized_name, review.codigo_bd_correcto)
+        await upsert_manual_correction_async(normalized_name, review.codigo_bd_correcto)
         
         # Actualizamos el diccionario en memoria con la clave normalizada
         orchestrator.mappings[normalized_name] = {"codigo": review.codigo_bd_correcto, "metodo": "Manual"}
@@ -1,50 +1,317 @@
+import io
 import logging
 import json
+import zipfile
+from contextlib import ExitStack
+from functools import partial
+from typing import IO, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple, Union
 from fastapi import APIRouter, HTTPException, Query, Body, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import ValidationError
 from src.models import InvoiceInput
 from src.services.cleaning import InvoiceProcessor
+from src.services.invoice_stream import InvalidInvoiceJSON, iter_invoice_items, stream_invoice_items
+from src.config import settings
+from src.services.audit_jobs import AuditJobQueue, QueueFull, create_audit_job_store, COMPLETADO
 from src.services.main_service import orchestrator # Importamos la instancia singleton
+from src.utils import normalize_description
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/invoices", tags=["Auditoría de Facturas"])
 
+PhaseCallback = Callable[[str, dict], None]
+
 # --- LÓGICA CENTRAL REUTILIZABLE ---
-async def _run_audit_logic(invoice_data: dict, surcharge_threshold: float) -> dict:
+def _run_phase1(invoice_data: Union[InvoiceInput, dict]) -> List[dict]:
+    """FASE 1: valida la factura (si no llega ya validada) y agrega los ítems únicos para la Fase 2."""
+    if not isinstance(invoice_data, InvoiceInput):
+        invoice_data = InvoiceInput.model_validate(invoice_data)
+    return _aggregate_phase1(iter_invoice_items(invoice_data))
+
+def _run_phase1_file(fileobj: IO[bytes]) -> List[dict]:
+    """FASE 1 leyendo el archivo de a un ítem: el JSON nunca se carga completo en memoria."""
+    return _aggregate_phase1(stream_invoice_items(fileobj))
+
+def _aggregate_phase1(items) -> List[dict]:
+    unique_items, _ = InvoiceProcessor().process_items(items)
+    items_for_phase2 = [
+        {"nombre_factura": i['descripción'], "precio_unitario": i['precio_unitario'], 
+         "cantidad_total": i['cantidad'], "precio_total_agregado": i['precio_total']}
+        for i in unique_items
+    ]
+    logger.info(f"Fase 1 completada: {len(items_for_phase2)} ítems únicos agregados.")
+    return items_for_phase2
+
+def _no_phase(fase: str, detalle: dict):
+    pass
+
+async def _audit_invoice(invoice_data: Union[InvoiceInput, dict], surcharge_threshold: float, on_phase: PhaseCallback = _no_phase) -> dict:
+    """Corre las fases 1 a 5 e informa cada fase terminada a `on_phase` (usado por la cola de trabajos)."""
+    return await _audit_items(_run_phase1(invoice_data), surcharge_threshold, on_phase)
+
+async def _audit_items(items_for_phase2: List[dict], surcharge_threshold: float, on_phase: PhaseCallback = _no_phase) -> dict:
+    """Fases 2 a 5 sobre los ítems ya agregados en la Fase 1."""
+    on_phase("fase1", {"items_unicos": len(items_for_phase2)})
+
+    all_conciliated, fallidos = await _resolve_items(items_for_phase2, on_phase)
+    
+    summary = orchestrator.generate_final_summary(
+        total_items=items_for_phase2,
+        all_conciliated=all_conciliated,
+        fallidos=fallidos,
+        threshold=surcharge_threshold
+    )
+    on_phase("fase5", {"items_conciliados": len(all_conciliated)})
+    return summary
+
+async def _resolve_items(items_for_phase2: List[dict], on_phase: PhaseCallback = _no_phase) -> Tuple[List[dict], List[dict]]:
+    """FASES 2 y 3: concilia los ítems únicos. Devuelve (conciliados, fallidos)."""
+    phase2 = await orchestrator.process_items(items_for_phase2)
+    conciliados_exactos = phase2.get('conciliados_exactos', [])
+    pendientes = phase2.get('pendientes_para_agente', [])
+    on_phase("fase2", {"conciliados_exactos": len(conciliados_exactos), "pendientes": len(pendientes)})
+
+    # Los candidatos inequívocos se aceptan sin pasar por la IA
+    auto = orchestrator.run_auto_accept_phase(pendientes)
+    pendientes = auto['pendientes']
+    on_phase("auto_aceptacion", {"conciliados": len(auto['conciliados']), "pendientes": len(pendientes)})
+    
+    phase3 = {"conciliados": [], "fallidos": []}
+    if pendientes:
+        phase3 = await orchestrator.run_conciliation_phase(pendientes)
+    on_phase("fase3", {"conciliados": len(phase3['conciliados']), "fallidos": len(phase3['fallidos'])})
+    
+    all_conciliated = conciliados_exactos + auto['conciliados'] + phase3.get('conciliados', [])
+    return all_conciliated, phase3.get('fallidos', [])
+
+async def _run_audit_logic(audit: Awaitable[dict]) -> dict:
     try:
-        InvoiceInput.model_validate(invoice_data)
-        processor = InvoiceProcessor()
-        unique_items, _ = processor.process_invoice(invoice_data)
-        
-        items_for_phase2 = [
-            {"nombre_factura": i['descripción'], "precio_unitario": i['precio_unitario'], 
-             "cantidad_total": i['cantidad'], "precio_total_agregado": i['precio_total']}
-            for i in unique_items
-        ]
-        logger.info(f"Fase 1 completada: {len(items_for_phase2)} ítems únicos agregados.")
-        
-        phase2 = await orchestrator.process_items(items_for_phase2)
-        conciliados_exactos = phase2.get('conciliados_exactos', [])
-        pendientes = phase2.get('pendientes_para_agente', [])
-        
-        phase3 = {"conciliados": [], "fallidos": []}
-        if pendientes:
-            phase3 = await orchestrator.run_conciliation_phase(pendientes)
-        
-        all_conciliated = conciliados_exactos + phase3.get('conciliados', [])
-        fallidos = phase3.get('fallidos', [])
-        
-        return orchestrator.generate_final_summary(
-            total_items=items_for_phase2,
-            all_conciliated=all_conciliated,
-            fallidos=fallidos,
-            threshold=surcharge_threshold
-        )
+        return await audit
     except Exception as e:
         logger.error(f"Error en la lógica de auditoría: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error inesperado.")
 
+def _phase1_or_error(invoice_input: InvoiceInput) -> List[dict]:
+    try:
+        return _run_phase1(invoice_input)
+    except Exception as e:
+        logger.error(f"Error en la lógica de auditoría: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error inesperado.")
+
+async def _upload_phase1_or_error(file: UploadFile) -> List[dict]:
+    """FASE 1 de un archivo subido. Starlette ya lo dejó en un archivo temporal (en disco si es
+    grande); se lee en un hilo para no bloquear el event loop con el parseo."""
+    try:
+        return await run_in_threadpool(_run_phase1_file, file.file)
+    except InvalidInvoiceJSON:
+        raise HTTPException(status_code=400, detail="El archivo no es un JSON válido.")
+    except Exception as e:
+        logger.error(f"Error en la lógica de auditoría: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error inesperado.")
+
+# --- AUDITORÍA POR LOTES (VARIAS FACTURAS) ---
+_PHASE1_FIELDS = ("nombre_factura", "precio_unitario", "cantidad_total", "precio_total_agregado")
+
+# (archivo, ítems agregados en la Fase 1, error): cada factura del lote ya reducida a sus ítems únicos
+FacturaLote = Tuple[str, Optional[List[dict]], Optional[str]]
+
+# Lo que recibe una descripción que no volvió de las fases 2 y 3: se informa como no conciliada
+_SIN_RESOLUCION = (False, {"mejor_intento": None, "error_conciliacion": "sin_resolucion"})
+
+def _phase1_batch_entry(archivo: str, phase1: Callable[[], List[dict]]) -> FacturaLote:
+    """Corre la Fase 1 de una factura del lote; un error descarta solo esa factura."""
+    try:
+        return archivo, phase1(), None
+    except InvalidInvoiceJSON:
+        return archivo, None, "El archivo no es un JSON válido."
+    except zipfile.BadZipFile:
+        return archivo, None, "El archivo no es un ZIP válido."
+    except Exception as e:
+        logger.error(f"Factura '{archivo}' descartada del lote: {e}")
+        return archivo, None, "La factura no tiene el formato esperado."
+
+def _phase1_batch_invoices(invoices: List[InvoiceInput]) -> List[FacturaLote]:
+    return [_phase1_batch_entry(f"factura_{i}", partial(_run_phase1, invoice)) for i, invoice in enumerate(invoices)]
+
+async def _audit_invoice_batch(facturas: List[FacturaLote], surcharge_threshold: float) -> dict:
+    """Audita varias facturas resolviendo una sola vez cada descripción normalizada.
+
+    Cada factura llega ya agregada por separado (Fase 1) y las descripciones distintas de
+    todo el lote pasan juntas por las fases 2 y 3. La conciliación de cada descripción
+    se copia a los ítems de todas las facturas que la contienen y cada factura recibe su
+    propio resumen (Fase 5) con sus cantidades y precios.
+    """
+    resultados: List[dict] = []
+    por_factura: List[Tuple[dict, List[dict]]] = []
+    for archivo, items, error in facturas:
+        entrada = {"archivo": archivo}
+        resultados.append(entrada)
+        if error is None:
+            por_factura.append((entrada, items))
+        else:
+            entrada["error"] = error
+
+    # Un representante por descripción normalizada en todo el lote
+    distintos: Dict[str, dict] = {}
+    for _, items in por_factura:
+        for item in items:
+            distintos.setdefault(normalize_description(item["nombre_factura"]), item)
+    total_items = sum(len(items) for _, items in por_factura)
+    logger.info(f"Lote de {len(facturas)} facturas: {total_items} ítems, {len(distintos)} descripciones distintas.")
+
+    conciliados, fallidos = await _resolve_items(list(distintos.values()))
+    # Lo que aportaron las fases 2 y 3 (código, precio de referencia, método, candidatos...)
+    resolucion = {}
+    for es_conciliado, resueltos in ((True, conciliados), (False, fallidos)):
+        for item in resueltos:
+            extra = {k: v for k, v in item.items() if k not in _PHASE1_FIELDS}
+            resolucion[normalize_description(item["nombre_factura"])] = (es_conciliado, extra)
+
+    sin_resolucion = set(distintos) - set(resolucion)
+    if sin_resolucion:
+        logger.warning(f"{len(sin_resolucion)} descripciones del lote no volvieron de las fases 2 y 3; se informan como no conciliadas.")
+
+    for entrada, items in por_factura:
+        conciliados_factura, fallidos_factura = [], []
+        for item in items:
+            es_conciliado, extra = resolucion.get(normalize_description(item["nombre_factura"]), _SIN_RESOLUCION)
+            (conciliados_factura if es_conciliado else fallidos_factura).append({**item, **extra})
+        entrada["resumen"] = orchestrator.generate_final_summary(
+            total_items=items,
+            all_conciliated=conciliados_factura,
+            fallidos=fallidos_factura,
+            threshold=surcharge_threshold
+        )
+
+    return {
+        "metricas_lote": {
+            "facturas_recibidas": len(facturas),
+            "facturas_auditadas": len(por_factura),
+            "items_procesados": total_items,
+            "descripciones_distintas": len(distintos),
+        },
+        "facturas": resultados
+    }
+
+_ZIP_MAGIC = b"PK\x03\x04"
+
+def _is_zip(nombre: str, fileobj: IO[bytes]) -> bool:
+    cabecera = fileobj.read(len(_ZIP_MAGIC))
+    fileobj.seek(0)
+    return nombre.lower().endswith(".zip") or cabecera == _ZIP_MAGIC
+
+def _file_size(fileobj: IO[bytes]) -> int:
+    size = fileobj.seek(0, io.SEEK_END)
+    fileobj.seek(0)
+    return size
+
+def _run_phase1_zip_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> List[dict]:
+    with zf.open(info) as fileobj:
+        return _run_phase1_file(fileobj)
+
+def _phase1_batch_files(archivos: List[Tuple[str, IO[bytes]]]) -> List[FacturaLote]:
+    """Fase 1 de facturas JSON sueltas o dentro de archivos .zip.
+
+    Primero se listan las facturas del lote (las entradas .json de cada .zip, sin
+    descomprimirlas) y se rechaza el lote si supera BATCH_MAX_INVOICES; recién después se
+    lee cada una de a un ítem y se agrega. En memoria quedan solo los ítems únicos de las
+    facturas ya leídas, nunca el JSON completo. Se llama desde un hilo: hace I/O y parseo
+    bloqueantes.
+    """
+    with ExitStack() as stack:
+        # (archivo, Fase 1 del contenido, error)
+        entradas: List[Tuple[str, Optional[Callable[[], List[dict]]], Optional[str]]] = []
+        for nombre, fileobj in archivos:
+            if not _is_zip(nombre, fileobj):
+                if _file_size(fileobj) > settings.BATCH_MAX_FILE_BYTES:
+                    entradas.append((nombre, None, "El archivo supera el tamaño máximo permitido."))
+                else:
+                    entradas.append((nombre, partial(_run_phase1_file, fileobj), None))
+                continue
+            try:
+                zf = stack.enter_context(zipfile.ZipFile(fileobj))
+            except zipfile.BadZipFile:
+                entradas.append((nombre, None, "El archivo no es un ZIP válido."))
+                continue
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".json") or info.filename.startswith("__MACOSX/"):
+                    continue
+                archivo = f"{nombre}/{info.filename}"
+                if info.file_size > settings.BATCH_MAX_FILE_BYTES:
+                    entradas.append((archivo, None, "El archivo supera el tamaño máximo permitido."))
+                else:
+                    entradas.append((archivo, partial(_run_phase1_zip_entry, zf, info), None))
+
+        _check_batch_size(len(entradas))
+        return [(archivo, None, error) if error else _phase1_batch_entry(archivo, phase1) for archivo, phase1, error in entradas]
+
+def _check_batch_size(cantidad: int):
+    if cantidad == 0:
+        raise HTTPException(status_code=400, detail="El lote no contiene facturas.")
+    if cantidad > settings.BATCH_MAX_INVOICES:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {settings.BATCH_MAX_INVOICES} facturas.")
+
+# --- COLA DE AUDITORÍAS ASÍNCRONAS ---
+# Instancia única por worker; main.py la inicia y la detiene con la app
+job_queue = AuditJobQueue(
+    store=create_audit_job_store(),
+    runner=_audit_invoice,
+    max_workers=settings.AUDIT_JOBS_MAX_WORKERS,
+    max_queue=settings.AUDIT_JOBS_MAX_QUEUE,
+)
+
+# --- LÓGICA DE STREAMING ---
+StreamFormat = Literal["ndjson", "sse"]
+
+def _encode_event(event: dict, fmt: StreamFormat) -> str:
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    if fmt == "sse":
+        return f"event: {event['tipo']}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def _stream_audit_events(items_for_phase2: List[dict], surcharge_threshold: float) -> AsyncIterator[dict]:
+    """Emite cada ítem apenas se resuelve: primero los matches directos, luego los
+    aceptados sin IA, después los de la IA a medida que terminan y al final las métricas."""
+    summary = orchestrator.start_summary(items_for_phase2, surcharge_threshold)
+    yield {"tipo": "inicio", "items_procesados": len(items_for_phase2)}
+
+    conciliados_exactos, sin_match = await orchestrator.match_direct_items(items_for_phase2)
+    for item in conciliados_exactos:
+        yield {"tipo": "conciliado", "item": summary.add_conciliado(item)}
+    del conciliados_exactos
+
+    pendientes = await orchestrator.find_fuzzy_candidates(sin_match)
+    auto = orchestrator.run_auto_accept_phase(pendientes)
+    for item in auto['conciliados']:
+        yield {"tipo": "conciliado", "item": summary.add_conciliado(item)}
+    pendientes = auto['pendientes']
+    del auto
+
+    if pendientes:
+        async for _, conciliados, fallidos in orchestrator.iter_conciliation_phase(pendientes):
+            for item in conciliados:
+                yield {"tipo": "conciliado", "item": summary.add_conciliado(item)}
+            for item in fallidos:
+                yield {"tipo": "no_conciliado", "item": summary.add_fallido(item)}
+
+    yield {"tipo": "resumen", "metricas": summary.metricas}
+
+def _streaming_audit_response(items_for_phase2: List[dict], surcharge_threshold: float, fmt: StreamFormat) -> StreamingResponse:
+    # La Fase 1 corre antes de abrir el stream (ver llamadores) para poder responder un error HTTP normal
+    async def body():
+        try:
+            async for event in _stream_audit_events(items_for_phase2, surcharge_threshold):
+                yield _encode_event(event, fmt)
+        except Exception as e:
+            # Los encabezados ya se enviaron: el error viaja como último evento
+            logger.error(f"Error en la auditoría en streaming: {e}", exc_info=True)
+            yield _encode_event({"tipo": "error", "detalle": "Error inesperado."}, fmt)
+        logger.info("FIN DE AUDITORÍA (streaming).")
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- ENDPOINT PARA SUBIR ARCHIVOS ---
 @router.post("/audit/upload_invoice", response_class=JSONResponse)
 async def upload_and_audit_invoice(
@@ -53,12 +320,8 @@ async def upload_and_audit_invoice(
 ):
     logger.info("="*50)
     logger.info(f"INICIO DE AUDITORÍA (vía archivo). Umbral: {surcharge_threshold}%")
-    content = await file.read()
-    try:
-        data = json.loads(content)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="El archivo no es un JSON válido.")
-    summary = await _run_audit_logic(data, surcharge_threshold)
+    items_for_phase2 = await _upload_phase1_or_error(file)
+    summary = await _run_audit_logic(_audit_items(items_for_phase2, surcharge_threshold))
     logger.info("FIN DE AUDITORÍA.")
     logger.info("="*50)
     return summary
@@ -71,7 +334,110 @@ async def run_full_audit_process(
 ):
     logger.info("="*50)
     logger.info(f"INICIO DE AUDITORÍA (vía body). Umbral: {surcharge_threshold}%")
-    summary = await _run_audit_logic(invoice_input.model_dump(), surcharge_threshold)
+    summary = await _run_audit_logic(_audit_invoice(invoice_input, surcharge_threshold))
     logger.info("FIN DE AUDITORÍA.")
     logger.info("="*50)
-    return summary
\ No newline at end of file
+    return summary
+
+# --- ENDPOINTS DE AUDITORÍA POR LOTES ---
+@router.post("/audit/batch/upload", response_class=JSONResponse)
+async def upload_and_audit_batch(
+    surcharge_threshold: float = Query(5.0),
+    files: List[UploadFile] = File(...)
+):
+    logger.info("="*50)
+    logger.info(f"INICIO DE AUDITORÍA POR LOTES (vía archivos). Umbral: {surcharge_threshold}%")
+    # Starlette ya dejó cada archivo en un temporal (en disco si es grande): se leen en un hilo
+    archivos = [(f.filename or f"archivo_{i}", f.file) for i, f in enumerate(files)]
+    facturas = await run_in_threadpool(_phase1_batch_files, archivos)
+    try:
+        summary = await _audit_invoice_batch(facturas, surcharge_threshold)
+    except Exception as e:
+        logger.error(f"Error en la auditoría por lotes: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error inesperado.")
+    logger.info("FIN DE AUDITORÍA POR LOTES.")
+    logger.info("="*50)
+    return summary
+
+@router.post("/audit/batch", response_class=JSONResponse)
+async def run_batch_audit_process(
+    invoices: List[InvoiceInput] = Body(...),
+    surcharge_threshold: float = Query(5.0)
+):
+    logger.info("="*50)
+    logger.info(f"INICIO DE AUDITORÍA POR LOTES (vía body). Umbral: {surcharge_threshold}%")
+    _check_batch_size(len(invoices))
+    facturas = await run_in_threadpool(_phase1_batch_invoices, invoices)
+    try:
+        summary = await _audit_invoice_batch(facturas, surcharge_threshold)
+    except Exception as e:
+        logger.error(f"Error en la auditoría por lotes: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error inesperado.")
+    logger.info("FIN DE AUDITORÍA POR LOTES.")
+    logger.info("="*50)
+    return summary
+
+# --- ENDPOINTS EN STREAMING (NDJSON / SSE) ---
+@router.post("/audit/stream")
+async def stream_full_audit_process(
+    invoice_input: InvoiceInput = Body(...),
+    surcharge_threshold: float = Query(5.0),
+    format: StreamFormat = Query("ndjson")
+):
+    logger.info(f"INICIO DE AUDITORÍA (streaming vía body, {format}). Umbral: {surcharge_threshold}%")
+    return _streaming_audit_response(_phase1_or_error(invoice_input), surcharge_threshold, format)
+
+@router.post("/audit/upload_invoice/stream")
+async def stream_upload_and_audit_invoice(
+    surcharge_threshold: float = Query(5.0),
+    format: StreamFormat = Query("ndjson"),
+    file: UploadFile = File(...)
+):
+    logger.info(f"INICIO DE AUDITORÍA (streaming vía archivo, {format}). Umbral: {surcharge_threshold}%")
+    return _streaming_audit_response(await _upload_phase1_or_error(file), surcharge_threshold, format)
+
+# --- ENDPOINTS DE AUDITORÍA ASÍNCRONA (TRABAJOS EN COLA) ---
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"], "estado": job["estado"], "fase": job["fase"], "progreso": job["progreso"],
+        "intentos": job["intentos"], "error": job["error"], "creado": job["creado"], "actualizado": job["actualizado"],
+    }
+
+async def _get_job_or_404(job_id: str) -> dict:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No existe el trabajo de auditoría.")
+    return job
+
+@router.post("/audit/jobs", status_code=202)
+async def submit_audit_job(
+    invoice_input: InvoiceInput = Body(...),
+    surcharge_threshold: float = Query(5.0)
+):
+    try:
+        job = await job_queue.submit(invoice_input.model_dump(), surcharge_threshold)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Cola de auditorías llena: {e}")
+    logger.info(f"Auditoría encolada: {job['id']}. Umbral: {surcharge_threshold}%")
+    return _job_status(job)
+
+@router.get("/audit/jobs/{job_id}")
+async def get_audit_job_status(job_id: str):
+    return _job_status(await _get_job_or_404(job_id))
+
+@router.get("/audit/jobs/{job_id}/result", response_class=JSONResponse)
+async def get_audit_job_result(job_id: str):
+    job = await _get_job_or_404(job_id)
+    if job["estado"] != COMPLETADO:
+        raise HTTPException(status_code=409, detail=f"La auditoría no está completada (estado: {job['estado']}).")
+    return job["resultado"]
+
+@router.post("/audit/jobs/{job_id}/retry", status_code=202)
+async def retry_audit_job(job_id: str):
+    job = await _get_job_or_404(job_id)
+    try:
+        if not await job_queue.retry(job_id):
+            raise HTTPException(status_code=409, detail=f"La auditoría no se puede reintentar (estado: {job['estado']}).")
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Cola de auditorías llena: {e}")
+    return _job_status(await job_queue.get(job_id))
@@ -1,8 +1,14 @@
 import os
 import json
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+import openai
 from openai import AsyncOpenAI
+from src.config import settings
+from src.services.llm_cache import get_conciliation_cache
+from src.services.llm_scheduler import DeadlineExceeded, get_llm_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -60,14 +66,49 @@ Realiza la conciliación para la siguiente entrada:
   "lista_de_candidatos": {candidatos_json_str}
 }}
 ### Salida Esperada:
+"""
+
+    # --- 3. PROMPT POR LOTES: VARIOS ÍTEMS EN UNA SOLA LLAMADA ---
+    BATCH_PROMPT_TEMPLATE = """
+# ROL Y OBJETIVO
+Eres Agno, un asistente de IA experto en conciliar medicamentos. Recibirás VARIOS ítems de factura, cada uno con su "id", su "nombre_original_factura", su "cantidad_consumida" y su propia "lista_de_candidatos". Para CADA ítem elige el candidato más lógico de SU lista.
+
+# CONTEXTO Y REGLAS
+- Cada ítem se concilia de forma independiente: nunca elijas un código que no esté en la lista de candidatos de ese mismo ítem.
+- El "score" de cada candidato es la similitud de texto. Úsalo como una guía muy importante.
+- **REGLA CLAVE:** Compara la "cantidad_consumida" con la información de empaque en los nombres de los candidatos (ej. "x 7", "x 20"). Si se consumieron 8 unidades, no puede ser una caja de 7; debe ser una de 20.
+- Si NINGÚN candidato es una coincidencia clara y confiable, devuelve `null` en el código y confianza 0.
+- Tu respuesta DEBE SER ÚNICAMENTE un objeto JSON con la clave "resultados": una lista con exactamente un elemento por ítem, con su "id", el "codigo_bd_conciliado" y la "confianza".
+
+# EJEMPLO
+### Entrada:
+{{"items": [
+  {{"id": "0", "nombre_original_factura": "BAREX UNIPEG - SOBRES", "cantidad_consumida": 10, "lista_de_candidatos": [{{"codigo": "111", "nombre": "BAREX UNIPEG sobres x 7", "score": 100}}, {{"codigo": "222", "nombre": "BAREX UNIPEG sobres x 15", "score": 98}}]}},
+  {{"id": "1", "nombre_original_factura": "ANALGESICO FUERTE", "cantidad_consumida": 1, "lista_de_candidatos": [{{"codigo": "779", "nombre": "AGUA DESTILADA X 500 ML", "score": 30}}]}}
+]}}
+### Salida Esperada:
+{{"resultados": [
+  {{"id": "0", "codigo_bd_conciliado": "222", "confianza": 98}},
+  {{"id": "1", "codigo_bd_conciliado": null, "confianza": 0}}
+]}}
+
+# TAREA ACTUAL
+### Entrada:
+{items_json_str}
+### Salida Esperada:
 """
 
     def __init__(self, api_key: Optional[str] = None):
         api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("API key de OpenAI no encontrada.")
-        self.client = AsyncOpenAI(api_key=api_key)
+        # Los reintentos los maneja el planificador (backoff con jitter y deadline), no el cliente
+        self.client = AsyncOpenAI(api_key=api_key, base_url=settings.OPENAI_BASE_URL, max_retries=0)
         self.model = "gpt-4o"
+        self.scheduler = get_llm_scheduler()
+        # Las respuestas cacheadas solo valen para el mismo modelo y la misma versión de los prompts
+        prompt_version = hashlib.sha256((self.PROMPT_TEMPLATE + self.BATCH_PROMPT_TEMPLATE).encode("utf-8")).hexdigest()[:12]
+        self.cache = get_conciliation_cache(namespace=f"{self.model}:{prompt_version}")
 
     # --- 2. FUNCIÓN ACTUALIZADA PARA MANEJAR LA CANTIDAD ---
     async def conciliate_item(self, item_to_conciliate: Dict[str, Any]) -> Dict[str, Any]:
@@ -84,6 +125,10 @@ Realiza la conciliación para la siguiente entrada:
             logger.warning(f"No se recibieron candidatos para '{nombre_factura}', no se puede conciliar.")
             return {"nombre_original_factura": nombre_factura, "codigo_bd_conciliado": None, "confianza": 0}
 
+        cache_key, cached = await self._from_cache(item_to_conciliate)
+        if cached is not None:
+            return cached
+
         candidatos_json_str = json.dumps(candidatos_bd, ensure_ascii=False, indent=2)
         final_prompt = self.PROMPT_TEMPLATE.format(
             nombre_factura=nombre_factura,
@@ -93,22 +138,132 @@ Realiza la conciliación para la siguiente entrada:
         
         logger.debug(f"Enviando a OpenAI para '{nombre_factura}'.")
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": final_prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.0
-            )
-            ai_response_str = response.choices[0].message.content
-            if not ai_response_str:
-                raise ValueError("La respuesta de la API de OpenAI estaba vacía.")
-            
-            logger.debug(f"Respuesta de OpenAI para '{nombre_factura}': {ai_response_str}")
-            
-            response_data = json.loads(ai_response_str)
+            response_data = await self._request_json(final_prompt)
+            logger.debug(f"Respuesta de OpenAI para '{nombre_factura}': {response_data}")
+
+            # Solo se cachean respuestas con un código de la lista de candidatos (o null):
+            # un código inventado por el modelo no debe servirse de nuevo desde la caché
+            codigos = {c.get('codigo') for c in candidatos_bd}
+            if cache_key is not None and "codigo_bd_conciliado" in response_data and \
+                    (response_data["codigo_bd_conciliado"] is None or response_data["codigo_bd_conciliado"] in codigos):
+                await self.cache.set_async(cache_key, response_data)
             response_data["nombre_original_factura"] = nombre_factura
             return response_data
 
         except Exception as e:
-            logger.error(f"La conciliación con IA falló para '{nombre_factura}': {e}")
-            return {"nombre_original_factura": nombre_factura, "codigo_bd_conciliado": None, "confianza": 0}
\ No newline at end of file
+            logger.error(f"La conciliación con IA falló para '{nombre_factura}': {e!r}")
+            return {"nombre_original_factura": nombre_factura, "codigo_bd_conciliado": None, "confianza": 0,
+                    "error": self._describe_error(e)}
+
+    async def conciliate_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Concilia varios ítems con una sola llamada al modelo.
+
+        Cada ítem viaja con su propia lista de candidatos y un id; las respuestas se
+        mapean de vuelta por id. Los ítems cuya respuesta falta, no se puede interpretar
+        o elige un código ajeno a sus candidatos se reintentan con `conciliate_item`.
+        Devuelve los resultados en el mismo orden que `items`.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        cache_keys: Dict[int, Optional[str]] = {}
+        to_send = []
+        for idx, item in enumerate(items):
+            nombre_factura = item.get('nombre_factura')
+            if not nombre_factura or not item.get('candidatos_bd'):
+                # Mismo manejo de ítems inválidos que la conciliación individual
+                results[idx] = await self.conciliate_item(item)
+                continue
+            cache_keys[idx], results[idx] = await self._from_cache(item)
+            if results[idx] is None:
+                to_send.append(idx)
+
+        if to_send:
+            payload = {"items": [{
+                "id": str(idx),
+                "nombre_original_factura": items[idx]['nombre_factura'],
+                "cantidad_consumida": items[idx].get('cantidad_total', 1),
+                "lista_de_candidatos": [
+                    {"codigo": c.get('codigo'), "nombre": c.get('nombre'), "score": c.get('score')}
+                    for c in items[idx]['candidatos_bd']
+                ],
+            } for idx in to_send]}
+            final_prompt = self.BATCH_PROMPT_TEMPLATE.format(items_json_str=json.dumps(payload, ensure_ascii=False))
+
+            logger.debug(f"Enviando a OpenAI un lote de {len(to_send)} ítems.")
+            answers: Dict[str, Dict[str, Any]] = {}
+            try:
+                response_data = await self._request_json(final_prompt)
+                answers = {str(r.get("id")): r for r in response_data.get("resultados", []) if isinstance(r, dict)}
+            except DeadlineExceeded as e:
+                # Sin tiempo para reintentos individuales: el lote completo queda como fallido
+                logger.error(f"La conciliación por lote se quedó sin tiempo ({len(to_send)} ítems): {e}")
+                for idx in to_send:
+                    results[idx] = {"nombre_original_factura": items[idx]['nombre_factura'], "codigo_bd_conciliado": None,
+                                    "confianza": 0, "error": self._describe_error(e)}
+                return results
+            except Exception as e:
+                logger.error(f"La conciliación por lote falló ({len(to_send)} ítems), se reintenta ítem por ítem: {e!r}")
+
+            retry = []
+            for idx in to_send:
+                answer = answers.get(str(idx))
+                codigos = {c.get('codigo') for c in items[idx]['candidatos_bd']}
+                if answer is None or "codigo_bd_conciliado" not in answer or \
+                        (answer["codigo_bd_conciliado"] is not None and answer["codigo_bd_conciliado"] not in codigos):
+                    retry.append(idx)
+                    continue
+                result = {"codigo_bd_conciliado": answer["codigo_bd_conciliado"], "confianza": answer.get("confianza", 0)}
+                if cache_keys.get(idx) is not None:
+                    await self.cache.set_async(cache_keys[idx], result)
+                results[idx] = {**result, "nombre_original_factura": items[idx]['nombre_factura']}
+
+            if retry:
+                logger.warning(f"{len(retry)} ítems del lote sin respuesta válida; se concilian individualmente.")
+                retried = await asyncio.gather(*(self.conciliate_item(items[idx]) for idx in retry))
+                for idx, result in zip(retry, retried):
+                    results[idx] = result
+
+        return results
+
+    async def _from_cache(self, item: Dict[str, Any]):
+        """Devuelve (clave, respuesta cacheada o None) para un ítem; (None, None) sin caché."""
+        if self.cache is None:
+            return None, None
+        nombre_factura = item['nombre_factura']
+        cache_key = self.cache.build_key(nombre_factura, (c.get('codigo') for c in item['candidatos_bd']), item.get('cantidad_total', 1))
+        cached = await self.cache.get_async(cache_key)
+        if cached is None:
+            return cache_key, None
+        logger.debug(f"Conciliación de '{nombre_factura}' servida desde la caché.")
+        return cache_key, {**cached, "nombre_original_factura": nombre_factura}
+
+    async def _request_json(self, prompt: str) -> Dict[str, Any]:
+        """Envía un prompt al modelo en modo JSON y devuelve la respuesta ya parseada."""
+        response = await self.scheduler.run(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"},
+                temperature=0.0
+            ),
+            # Estimación gruesa para el presupuesto por minuto: ~3 caracteres por token más la salida
+            estimated_tokens=len(prompt) // 3 + 200
+        )
+        ai_response_str = response.choices[0].message.content
+        if not ai_response_str:
+            raise ValueError("La respuesta de la API de OpenAI estaba vacía.")
+        return json.loads(ai_response_str)
+
+    @staticmethod
+    def _describe_error(error: Exception) -> str:
+        """Motivo legible del fallo para reportarlo junto al ítem no conciliado."""
+        if isinstance(error, DeadlineExceeded):
+            return "deadline"
+        if isinstance(error, asyncio.TimeoutError):
+            return "timeout"
+        if isinstance(error, openai.RateLimitError):
+            return "rate_limit"
+        if isinstance(error, openai.APIStatusError):
+            return f"http_{error.status_code}"
+        if isinstance(error, (json.JSONDecodeError, ValueError)):
+            return "respuesta_invalida"
+        return type(error).__name__
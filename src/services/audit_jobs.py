@@ -0,0 +1,362 @@
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo de auditoría
+EN_COLA, EN_PROCESO, COMPLETADO, FALLIDO = "en_cola", "en_proceso", "completado", "fallido"
+
+# Cada cuánto se borran los trabajos terminados más viejos que AUDIT_JOBS_RETENTION_SECONDS
+_PURGE_INTERVAL_SECONDS = 3600.0
+
+# runner(invoice_data, surcharge_threshold, on_phase) -> resumen final
+AuditRunner = Callable[[dict, float, Callable[[str, Dict[str, Any]], None]], Awaitable[dict]]
+
+class AuditJobStore(ABC):
+    """Almacén de trabajos de auditoría. Cada trabajo es un dict con las claves de `_new_job`."""
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any]): ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def update(self, job_id: str, **campos): ...
+
+    @abstractmethod
+    def claim(self, job_id: str) -> bool:
+        """Pasa el trabajo de en_cola a en_proceso de forma atómica; False si otro ya lo tomó."""
+
+    @abstractmethod
+    def requeue(self, job_id: str) -> bool:
+        """Devuelve a en_cola un trabajo en_proceso (interrumpido); False si ya no estaba en proceso."""
+
+    @abstractmethod
+    def requeue_stale(self, stale_before: float) -> List[str]:
+        """Devuelve a en_cola los trabajos en_proceso sin avances desde `stale_before`."""
+
+    @abstractmethod
+    def purge(self, finished_before: float) -> int:
+        """Borra los trabajos completados o fallidos sin cambios desde `finished_before`."""
+
+    @abstractmethod
+    def queued_ids(self) -> List[str]: ...
+
+class InMemoryJobStore(AuditJobStore):
+    """Trabajos en memoria del proceso: se pierden al reiniciar (útil para pruebas locales)."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict[str, Any]):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id: str, **campos):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(campos, actualizado=time.time())
+
+    def claim(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["estado"] != EN_COLA:
+                return False
+            job.update(estado=EN_PROCESO, actualizado=time.time())
+            return True
+
+    def requeue(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["estado"] != EN_PROCESO:
+                return False
+            job.update(estado=EN_COLA, fase=None, progreso={}, actualizado=time.time())
+            return True
+
+    def requeue_stale(self, stale_before: float) -> List[str]:
+        with self._lock:
+            stale = [j for j in self._jobs.values() if j["estado"] == EN_PROCESO and j["actualizado"] < stale_before]
+            for job in stale:
+                job.update(estado=EN_COLA, fase=None, progreso={}, actualizado=time.time())
+            return [j["id"] for j in stale]
+
+    def purge(self, finished_before: float) -> int:
+        with self._lock:
+            viejos = [j["id"] for j in self._jobs.values()
+                      if j["estado"] in (COMPLETADO, FALLIDO) and j["actualizado"] < finished_before]
+            for job_id in viejos:
+                del self._jobs[job_id]
+            return len(viejos)
+
+    def queued_ids(self) -> List[str]:
+        with self._lock:
+            return [j["id"] for j in sorted(self._jobs.values(), key=lambda j: j["creado"]) if j["estado"] == EN_COLA]
+
+class SQLiteJobStore(AuditJobStore):
+    """Trabajos persistidos en SQLite: sobreviven a reinicios y se comparten entre workers de uvicorn."""
+
+    _JSON_FIELDS = ("progreso", "payload", "resultado")
+    _COLUMNS = ("id", "estado", "fase", "progreso", "surcharge_threshold", "payload",
+                "resultado", "error", "intentos", "creado", "actualizado")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS audit_jobs (
+                    id TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    fase TEXT,
+                    progreso TEXT,
+                    surcharge_threshold REAL NOT NULL,
+                    payload TEXT,
+                    resultado TEXT,
+                    error TEXT,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    creado REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_audit_jobs_estado ON audit_jobs (estado, creado)")
+            self._conn.commit()
+
+    def _encode(self, campo: str, valor: Any) -> Any:
+        if campo in self._JSON_FIELDS and valor is not None:
+            return json.dumps(valor, ensure_ascii=False, default=str)
+        return valor
+
+    def create(self, job: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO audit_jobs ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' for _ in self._COLUMNS)})",
+                [self._encode(c, job.get(c)) for c in self._COLUMNS]
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(self._COLUMNS)} FROM audit_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self._COLUMNS, row))
+        for campo in self._JSON_FIELDS:
+            if job[campo] is not None:
+                job[campo] = json.loads(job[campo])
+        return job
+
+    def update(self, job_id: str, **campos):
+        campos["actualizado"] = time.time()
+        asignaciones = ", ".join(f"{c} = ?" for c in campos)
+        with self._lock:
+            self._conn.execute(f"UPDATE audit_jobs SET {asignaciones} WHERE id = ?",
+                               [self._encode(c, v) for c, v in campos.items()] + [job_id])
+            self._conn.commit()
+
+    def claim(self, job_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE audit_jobs SET estado = ?, actualizado = ? WHERE id = ? AND estado = ?",
+                (EN_PROCESO, time.time(), job_id, EN_COLA)
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def requeue(self, job_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE audit_jobs SET estado = ?, fase = NULL, progreso = '{}', actualizado = ? WHERE id = ? AND estado = ?",
+                (EN_COLA, time.time(), job_id, EN_PROCESO)
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def requeue_stale(self, stale_before: float) -> List[str]:
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM audit_jobs WHERE estado = ? AND actualizado < ?", (EN_PROCESO, stale_before))]
+            self._conn.executemany(
+                "UPDATE audit_jobs SET estado = ?, fase = NULL, progreso = '{}', actualizado = ? WHERE id = ? AND estado = ?",
+                [(EN_COLA, time.time(), job_id, EN_PROCESO) for job_id in ids]
+            )
+            self._conn.commit()
+            return ids
+
+    def purge(self, finished_before: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM audit_jobs WHERE estado IN (?, ?) AND actualizado < ?", (COMPLETADO, FALLIDO, finished_before)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def queued_ids(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id FROM audit_jobs WHERE estado = ? ORDER BY creado", (EN_COLA,))]
+
+def create_audit_job_store() -> AuditJobStore:
+    """Backend configurado en AUDIT_JOBS_BACKEND ("sqlite" o "memory")."""
+    if settings.AUDIT_JOBS_BACKEND == "memory":
+        return InMemoryJobStore()
+    return SQLiteJobStore(settings.AUDIT_JOBS_DB_PATH)
+
+class QueueFull(Exception):
+    """La cola de trabajos alcanzó AUDIT_JOBS_MAX_QUEUE."""
+
+class AuditJobQueue:
+    """Cola de auditorías con un pool acotado de workers dentro del event loop de la app.
+
+    Cada worker toma un trabajo, lo reclama en el almacén (para que dos procesos no
+    corran el mismo) y ejecuta el runner, que informa la fase en curso vía `on_phase`.
+
+    El almacén es bloqueante (SQLite): todas sus operaciones corren en un único hilo
+    propio, fuera del event loop y en el orden en que se piden.
+    """
+
+    def __init__(self, store: AuditJobStore, runner: AuditRunner, max_workers: int, max_queue: int):
+        self.store = store
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Set[str] = set()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-jobs")
+
+    def _call_store(self, metodo: str, *args, **kwargs) -> "asyncio.Future":
+        """Encola una operación del almacén en su hilo; se puede esperar o no."""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._io, functools.partial(getattr(self.store, metodo), *args, **kwargs))
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+        # Los que quedaron en proceso sin avances (p. ej. un worker que se cayó) vuelven a la cola;
+        # los recientes pueden estar corriendo en otro proceso y no se tocan
+        colgados = await self._call_store("requeue_stale", time.time() - settings.AUDIT_JOBS_STALE_SECONDS)
+        if colgados:
+            logger.warning(f"{len(colgados)} auditorías en proceso sin avances vuelven a la cola: {colgados}")
+        # Los trabajos que quedaron en cola antes de un reinicio se retoman
+        for job_id in await self._call_store("queued_ids"):
+            self._queue.put_nowait(job_id)
+        if settings.AUDIT_JOBS_RETENTION_SECONDS > 0:
+            self._workers.append(asyncio.create_task(self._purge_loop()))
+        logger.info(f"Cola de auditorías iniciada con {self.max_workers} workers ({self._queue.qsize()} trabajos retomados).")
+
+    async def stop(self):
+        interrumpidos = list(self._running)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Los trabajos cortados por el apagado quedan en cola para el próximo arranque
+        for job_id in interrumpidos:
+            if await self._call_store("requeue", job_id):
+                logger.info(f"Auditoría {job_id} interrumpida por el apagado: vuelve a la cola.")
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call_store("get", job_id)
+
+    async def purge(self) -> int:
+        """Borra los trabajos terminados hace más de AUDIT_JOBS_RETENTION_SECONDS."""
+        borrados = await self._call_store("purge", time.time() - settings.AUDIT_JOBS_RETENTION_SECONDS)
+        if borrados:
+            logger.info(f"{borrados} auditorías terminadas borradas por antigüedad.")
+        return borrados
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error(f"No se pudieron borrar las auditorías viejas: {e}", exc_info=True)
+            await asyncio.sleep(_PURGE_INTERVAL_SECONDS)
+
+    async def submit(self, invoice_data: dict, surcharge_threshold: float) -> Dict[str, Any]:
+        self._check_capacity()
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex, "estado": EN_COLA, "fase": None, "progreso": {},
+            "surcharge_threshold": surcharge_threshold, "payload": invoice_data,
+            "resultado": None, "error": None, "intentos": 0, "creado": now, "actualizado": now,
+        }
+        await self._call_store("create", job)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def retry(self, job_id: str) -> bool:
+        """Vuelve a encolar un trabajo fallido (o uno en proceso que dejó de reportar avances)."""
+        job = await self.get(job_id)
+        if job is None or not self.is_retryable(job):
+            return False
+        self._check_capacity()
+        await self._call_store("update", job_id, estado=EN_COLA, fase=None, progreso={}, error=None)
+        self._queue.put_nowait(job_id)
+        return True
+
+    @staticmethod
+    def is_retryable(job: Dict[str, Any]) -> bool:
+        if job["estado"] == FALLIDO:
+            return True
+        return job["estado"] == EN_PROCESO and time.time() - job["actualizado"] > settings.AUDIT_JOBS_STALE_SECONDS
+
+    def _check_capacity(self):
+        if self._queue is None:
+            raise RuntimeError("La cola de auditorías no fue iniciada.")
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFull(f"Hay {self._queue.qsize()} auditorías en cola.")
+
+    async def _worker(self, numero: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                if await self._call_store("claim", job_id):
+                    self._running.add(job_id)
+                    await self._run(job_id)
+            except Exception as e:
+                logger.error(f"Worker de auditorías {numero}: error inesperado con el trabajo {job_id}: {e}", exc_info=True)
+            finally:
+                self._running.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self.get(job_id)
+        intentos = job["intentos"] + 1
+        await self._call_store("update", job_id, intentos=intentos)
+        progreso: Dict[str, Any] = {}
+        start_time = time.time()
+
+        def on_phase(fase: str, detalle: Dict[str, Any]):
+            progreso[fase] = {**detalle, "segundos": round(time.time() - start_time, 3)}
+            # Sin esperar: el hilo del almacén las escribe en orden, antes que el resultado final
+            self._call_store("update", job_id, fase=fase, progreso=dict(progreso))
+
+        logger.info(f"Auditoría {job_id} en proceso (intento {intentos}).")
+        try:
+            resultado = await self.runner(job["payload"], job["surcharge_threshold"], on_phase)
+        except Exception as e:
+            logger.error(f"Auditoría {job_id} fallida: {e}", exc_info=True)
+            await self._call_store("update", job_id, estado=FALLIDO, error=f"{type(e).__name__}: {e}")
+            return
+        # El payload ya no hace falta: solo se conserva para reintentar los fallidos
+        await self._call_store("update", job_id, estado=COMPLETADO, fase="completado", resultado=resultado, payload=None)
+        logger.info(f"Auditoría {job_id} completada en {time.time() - start_time:.2f}s.")
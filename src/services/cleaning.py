@@ -1,30 +1,54 @@
 import logging
 import time
-from typing import List, Dict, Any, Tuple
-from src.utils import clean_and_deduplicate
+from typing import Iterable, List, Dict, Any, Tuple
+from src.models import Item
+from src.utils import normalize_description
 
 logger = logging.getLogger(__name__)
 
+class ItemAggregator:
+    """Phase 1 aggregation of validated items, one item at a time.
+
+    Items are grouped by normalized description as they arrive: cantidad and precio_total
+    are summed and the other fields keep their first value, so memory grows with the number
+    of distinct descriptions instead of the number of invoice lines.
+    """
+
+    def __init__(self):
+        self.total_items = 0
+        self._groups: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, item: Item):
+        self.total_items += 1
+        key = normalize_description(item.descripción)
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = {
+                'normalized_desc': key, 'cantidad': item.cantidad, 'precio_total': item.precio_total,
+                'descripción': item.descripción, 'precio_unitario': item.precio_unitario,
+                'fecha': item.fecha, 'notas': item.notas,
+            }
+            return
+        group['cantidad'] += item.cantidad
+        group['precio_total'] += item.precio_total
+        # Like pandas' 'first', keep the first non-null note
+        if group['notas'] is None:
+            group['notas'] = item.notas
+
+    def unique_items(self) -> List[Dict[str, Any]]:
+        # Sorted by normalized description, like the pandas groupby this replaced
+        return [self._groups[key] for key in sorted(self._groups)]
+
 class InvoiceProcessor:
-    def process_invoice(self, invoice_data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], float]:
+    def process_items(self, items: Iterable[Item]) -> Tuple[List[Dict[str, Any]], float]:
+        """Aggregates validated items one by one (e.g. streamed from an uploaded file)."""
         start_time = time.time()
-        logger.info("Starting invoice processing...")
-        try:
-            items = []
-            if "pacientes" in invoice_data:
-                for paciente in invoice_data["pacientes"]:
-                    if "facturas" in paciente:
-                        for factura in paciente["facturas"]:
-                            if "items" in factura:
-                                items.extend(factura["items"])
-            
-            logger.info(f"Extracted {len(items)} total items from invoice.")
-            aggregated_df = clean_and_deduplicate(items)
-            processed_items = aggregated_df.to_dict('records')
-            processing_time = (time.time() - start_time) * 1000
-            
-            logger.info(f"Aggregated into {len(processed_items)} unique items in {processing_time:.2f}ms.")
-            return processed_items, processing_time
-        except Exception as e:
-            logger.error(f"Error processing invoice: {e}", exc_info=True)
-            raise ValueError(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        logger.info("Starting incremental invoice processing...")
+        aggregator = ItemAggregator()
+        for item in items:
+            aggregator.add(item)
+        processed_items = aggregator.unique_items()
+        processing_time = (time.time() - start_time) * 1000
+
+        logger.info(f"Aggregated {aggregator.total_items} items into {len(processed_items)} unique items in {processing_time:.2f}ms.")
+        return processed_items, processing_time
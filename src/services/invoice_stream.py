@@ -0,0 +1,78 @@
+"""
+Lectura incremental de facturas: recorre pacientes -> facturas -> items del archivo subido
+sin cargar el JSON completo en memoria (ver upload_and_audit_invoice).
+
+Cada ítem se valida con `Item` apenas termina de leerse y se entrega para agregarlo en la
+Fase 1; el resto de cada paciente (información del paciente y resumen de cada factura) se
+valida con `Paciente` sin sus ítems. En memoria queda, como máximo, un paciente sin ítems,
+un ítem y lo ya agregado (una fila por descripción normalizada).
+
+ijson es opcional: sin él el archivo se lee completo con json.load, como antes.
+"""
+import json
+import logging
+from typing import IO, Iterator
+from src.models import InvoiceInput, Item, Paciente
+
+logger = logging.getLogger(__name__)
+
+_PACIENTE_PREFIX = "pacientes.item"
+_ITEM_PREFIX = "pacientes.item.facturas.item.items.item"
+
+class InvalidInvoiceJSON(ValueError):
+    """El archivo no es un JSON válido (o está truncado)."""
+
+def iter_invoice_items(invoice: InvoiceInput) -> Iterator[Item]:
+    """Ítems de una factura ya validada, en el orden del documento."""
+    for paciente in invoice.pacientes:
+        for factura in paciente.facturas:
+            yield from factura.items
+
+_OPEN = {"start_map": 1, "start_array": 1, "end_map": -1, "end_array": -1}
+
+def stream_invoice_items(fileobj: IO[bytes]) -> Iterator[Item]:
+    """Ítems validados del archivo de factura, leídos de a uno.
+
+    Lanza InvalidInvoiceJSON si el archivo no es JSON y pydantic.ValidationError si no
+    tiene la estructura de `InvoiceInput` (los ítems anteriores al error ya se entregaron).
+    """
+    try:
+        import ijson
+    except ImportError:
+        logger.warning("ijson no está instalado: el archivo de factura se lee completo en memoria.")
+        try:
+            data = json.load(fileobj)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise InvalidInvoiceJSON(str(e)) from e
+        yield from iter_invoice_items(InvoiceInput.model_validate(data))
+        return
+
+    # Cada valor que empieza en el prefijo de un ítem (o de un paciente) se arma aparte hasta que se
+    # cierra; la raíz queda con "pacientes": [] y cada paciente con "items": [] en sus facturas
+    root = ijson.ObjectBuilder()
+    paciente = item = None
+    paciente_depth = item_depth = 0
+    try:
+        for prefix, event, value in ijson.parse(fileobj, use_float=True):
+            if item is None and prefix == _ITEM_PREFIX:
+                item = ijson.ObjectBuilder()
+            if item is not None:
+                item.event(event, value)
+                item_depth += _OPEN.get(event, 0)
+                if item_depth == 0:
+                    yield Item.model_validate(item.value)
+                    item = None
+                continue
+            if paciente is None and prefix == _PACIENTE_PREFIX:
+                paciente = ijson.ObjectBuilder()
+            if paciente is not None:
+                paciente.event(event, value)
+                paciente_depth += _OPEN.get(event, 0)
+                if paciente_depth == 0:
+                    Paciente.model_validate(paciente.value)
+                    paciente = None
+                continue
+            root.event(event, value)
+    except ijson.JSONError as e:
+        raise InvalidInvoiceJSON(str(e)) from e
+    InvoiceInput.model_validate(getattr(root, "value", None))
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+from src.config import settings
+from src.utils import normalize_description
+
+logger = logging.getLogger(__name__)
+
+# Los usos de entradas (ultimo_uso, para el LRU) se acumulan en memoria y se escriben juntos
+_TOUCH_FLUSH_EVERY = 100
+_TOUCH_FLUSH_SECONDS = 5.0
+
+def quantity_bucket(cantidad: Any) -> int:
+    """Agrupa la cantidad consumida para la clave de caché.
+
+    La IA compara la cantidad contra el tamaño del envase (x 7, x 20, ...): hasta 30
+    unidades la cantidad se usa tal cual y por encima se agrupa por potencias de 2.
+    """
+    try:
+        cantidad = int(float(cantidad))
+    except (TypeError, ValueError):
+        return 1
+    if cantidad <= 30:
+        return cantidad
+    return 1 << (cantidad.bit_length() - 1)
+
+class ConciliationCache:
+    """Caché persistente en SQLite de las respuestas de conciliación de la IA.
+
+    La clave combina la descripción normalizada de la factura, el conjunto de códigos
+    candidatos y el bucket de cantidad. Las entradas vencen por TTL y, al superar
+    `max_entries`, se descartan las menos usadas recientemente.
+
+    Los métodos son bloqueantes (SQLite); desde código async usar `get_async` y
+    `set_async`, que los corren en un hilo.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int, namespace: str = ""):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # clave -> último uso todavía no escrito en la tabla
+        self._touched: Dict[str, float] = {}
+        self._touched_since = time.time()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            # WAL permite que varios workers de uvicorn compartan el archivo
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS conciliaciones (
+                    clave TEXT PRIMARY KEY,
+                    respuesta TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_uso REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_conciliaciones_ultimo_uso ON conciliaciones (ultimo_uso)")
+            self._conn.commit()
+            # Conteo aproximado (cuenta también los reemplazos y lo que escriben otros workers no):
+            # solo decide cuándo vale la pena contar de verdad y desalojar
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM conciliaciones").fetchone()[0]
+
+    def build_key(self, nombre_factura: str, codigos: Iterable[str], cantidad: Any) -> str:
+        payload = json.dumps(
+            [self.namespace, normalize_description(nombre_factura), sorted(str(c) for c in codigos), quantity_bucket(cantidad)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, clave: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT respuesta, creado FROM conciliaciones WHERE clave = ?", (clave,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM conciliaciones WHERE clave = ?", (clave,))
+                    self._conn.commit()
+                    self._touched.pop(clave, None)
+                    self._entries -= 1
+                self.misses += 1
+                return None
+            self._touched[clave] = now
+            if len(self._touched) >= _TOUCH_FLUSH_EVERY or now - self._touched_since >= _TOUCH_FLUSH_SECONDS:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, clave: str, respuesta: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conciliaciones (clave, respuesta, creado, ultimo_uso) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(respuesta, ensure_ascii=False), now, now)
+            )
+            self._touched.pop(clave, None)
+            self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    async def get_async(self, clave: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, clave)
+
+    async def set_async(self, clave: str, respuesta: Dict[str, Any]):
+        await asyncio.to_thread(self.set, clave, respuesta)
+
+    def _flush_touched(self):
+        """Escribe los últimos usos pendientes (sin commit; lo hace quien llama)."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE conciliaciones SET ultimo_uso = ? WHERE clave = ?",
+                [(usado, clave) for clave, usado in self._touched.items()]
+            )
+            self._touched.clear()
+        self._touched_since = time.time()
+
+    def _evict(self):
+        """Cuenta de verdad y descarta las entradas menos usadas que sobran."""
+        self._flush_touched()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM conciliaciones").fetchone()[0]
+        exceso = self._entries - self.max_entries
+        if exceso > 0:
+            self._conn.execute(
+                "DELETE FROM conciliaciones WHERE clave IN "
+                "(SELECT clave FROM conciliaciones ORDER BY ultimo_uso LIMIT ?)", (exceso,)
+            )
+            self.evictions += exceso
+            self._entries = self.max_entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM conciliaciones").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total * 100 if total else 0.0,
+            "entries": entries,
+        }
+
+
+_cache_instance: Optional[ConciliationCache] = None
+_cache_lock = threading.Lock()
+
+def get_conciliation_cache(namespace: str = "") -> Optional[ConciliationCache]:
+    """Instancia única de la caché por proceso; None si está deshabilitada o no se pudo abrir."""
+    global _cache_instance
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache_instance is None:
+            try:
+                _cache_instance = ConciliationCache(
+                    settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL_SECONDS,
+                    settings.LLM_CACHE_MAX_ENTRIES, namespace=namespace
+                )
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo abrir la caché de conciliaciones en '{settings.LLM_CACHE_PATH}': {e}")
+                return None
+    return _cache_instance
@@ -0,0 +1,161 @@
+"""
+Planificador de llamadas a la API de OpenAI.
+
+Acota las llamadas simultáneas, respeta un presupuesto de requests y tokens por
+minuto, aplica timeout por llamada, reintenta con backoff exponencial con jitter
+ante 429/5xx y corta todo al vencer el deadline de la request HTTP en curso.
+"""
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+import openai
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Instante (loop.time()) en que vence la request actual; lo fija run_conciliation_phase
+current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """Se agotó el tiempo total disponible para la request antes de completar la llamada."""
+
+class _TokenBucket:
+    """Balde de tokens que se rellena de forma continua hasta `capacity` por minuto."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = None
+
+    async def acquire(self, amount: float, deadline: Optional[float]):
+        if self.capacity <= 0:
+            return  # Sin límite configurado
+        loop = asyncio.get_running_loop()
+        amount = min(amount, self.capacity)
+        while True:
+            now = loop.time()
+            if self.updated is not None:
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.available >= amount:
+                self.available -= amount
+                return
+            wait = (amount - self.available) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("Presupuesto de rate limit insuficiente antes del deadline.")
+            await asyncio.sleep(wait)
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class LLMScheduler:
+    def __init__(self, max_in_flight: int, requests_per_minute: int, tokens_per_minute: int,
+                 call_timeout: float, max_retries: int, retry_base_delay: float, retry_max_delay: float):
+        self.max_in_flight = max_in_flight
+        self.call_timeout = call_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._requests_per_minute = requests_per_minute
+        self._tokens_per_minute = tokens_per_minute
+        self._loop = None
+
+    def _bind_loop(self):
+        # Las primitivas de asyncio quedan atadas a un loop: se recrean si cambia
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            # max_in_flight <= 0: sin límite de llamadas simultáneas (igual que los baldes)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight > 0 else None
+            self._budget_lock = asyncio.Lock()
+            self._requests = _TokenBucket(self._requests_per_minute)
+            self._tokens = _TokenBucket(self._tokens_per_minute)
+        return loop
+
+    def _remaining(self, loop, deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise DeadlineExceeded("Se agotó el tiempo de la request.")
+        return remaining
+
+    async def _acquire_slot(self, loop, deadline: Optional[float]):
+        """Espera un lugar entre las llamadas simultáneas, como mucho hasta el deadline."""
+        if self._semaphore is None:
+            return
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._remaining(loop, deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Sin lugar para la llamada antes del deadline.")
+
+    def _release_slot(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        """Ejecuta `call` respetando concurrencia, presupuesto, timeout, reintentos y deadline."""
+        loop = self._bind_loop()
+        deadline = current_deadline.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_slot(loop, deadline)
+            try:
+                self._remaining(loop, deadline)
+                async with self._budget_lock:
+                    await self._requests.acquire(1, deadline)
+                    await self._tokens.acquire(estimated_tokens, deadline)
+                remaining = self._remaining(loop, deadline)
+                timeout = self.call_timeout if remaining is None else min(self.call_timeout, remaining)
+                try:
+                    return await asyncio.wait_for(call(), timeout=timeout)
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    error = e
+            finally:
+                self._release_slot()
+
+            delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+            delay = max(delay, _retry_after(error) or 0.0)
+            remaining = self._remaining(loop, deadline)
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(f"Sin tiempo para reintentar tras: {error!r}")
+            logger.warning(f"Llamada a OpenAI falló ({type(error).__name__}); reintento {attempt + 1}/{self.max_retries} en {delay:.2f}s.")
+            await asyncio.sleep(delay)
+
+
+_scheduler_instance: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Planificador único por proceso: los límites de la cuenta de OpenAI son compartidos."""
+    global _scheduler_instance
+    with _scheduler_lock:
+        if _scheduler_instance is None:
+            _scheduler_instance = LLMScheduler(
+                max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+                requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+                tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+                call_timeout=settings.LLM_CALL_TIMEOUT_SECONDS,
+                max_retries=settings.LLM_MAX_RETRIES,
+                retry_base_delay=settings.LLM_RETRY_BASE_DELAY,
+                retry_max_delay=settings.LLM_RETRY_MAX_DELAY,
+            )
+    return _scheduler_instance
@@ -1,5 +1,6 @@
+import logging
 import re
-from typing import Dict
+from typing import Any, Dict, Optional
 
 def extract_specifications(description: str) -> Dict[str, str]:
     specs = {}
@@ -4,6 +4,7 @@ from typing import Dict, Any, List
 from dataclasses import dataclass, field
 from collections import defaultdict
 import logging
+from src.utils.cache import cache_stats
 
 logger = logging.getLogger(__name__)
 
@@ -98,7 +99,9 @@ class MetricsCollector:
             "total_no_matches": self.metrics.total_no_matches,
             "search_methods_distribution": self.metrics.search_methods_used,
             "error_distribution": self.metrics.error_types,
-            "requests_per_second": self.metrics.total_requests / uptime_seconds if uptime_seconds > 0 else 0
+            "requests_per_second": self.metrics.total_requests / uptime_seconds if uptime_seconds > 0 else 0,
+            # Hit/miss/eviction counters of the in-memory search caches
+            "caches": cache_stats()
         }
 
     def reset_metrics(self):
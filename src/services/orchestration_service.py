@@ -1,9 +1,18 @@
 import asyncio
 import logging
-from typing import List, Dict, Any
-from thefuzz import fuzz
-from src.db import get_by_exact_name, search_fuzzy, get_by_codigo, load_all_synonyms_from_db
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from rapidfuzz import fuzz
+from thefuzz import utils as fuzz_utils
+from src.config import settings
+from src.db import get_by_exact_name_many_async, search_fuzzy_many_async, get_by_codigo_many_async, load_all_synonyms_from_db, fuzzy_candidate_limit
+from src.db.spec_index import filter_candidates_by_specs
 from src.services.ai_assistant import AIAssistant
+from src.services.llm_scheduler import current_deadline
+from src.services.medication_parser import MedicationParser
+from src.services.synonym_promoter import get_synonym_promoter
+from src.utils import normalize_description
+from src.services.scoring import score_invoice_candidates
 
 logger = logging.getLogger(__name__)
 
@@ -13,77 +22,248 @@ class OrchestrationService:
         self.ai_agent = AIAssistant()
         # Cargamos todos los mapeos (sinónimos y correcciones) desde la BD
         self.mappings = load_all_synonyms_from_db()
+        # Pool para el filtrado y el scoring fuzzy (CPU) de la Fase 2, compartido entre auditorías;
+        # rapidfuzz ya paraleliza cada lote
+        self._executor = ThreadPoolExecutor(max_workers=max(1, settings.PHASE2_SCORING_THREADS), thread_name_prefix="fase2")
+        self._parser = MedicationParser()
 
     async def process_items(self, items: List[Dict[str, Any]]) -> Dict[str, List]:
-        """FASE 2: Procesa ítems para encontrar matches directos o preparar para la IA."""
-        conciliados_exactos, pendientes_para_agente = [], []
+        """FASE 2: Procesa ítems para encontrar matches directos o preparar para la IA.
+
+        Los matches por mapeo y exactos se resuelven por lotes para toda la factura,
+        con un número constante de consultas sin importar la cantidad de ítems. Los
+        candidatos fuzzy de los ítems restantes también se buscan por lotes y se
+        devuelven en el mismo orden de entrada.
+        """
+        conciliados_exactos, sin_match = await self.match_direct_items(items)
+        pendientes_para_agente = await self.find_fuzzy_candidates(sin_match)
+        return {"conciliados_exactos": conciliados_exactos, "pendientes_para_agente": pendientes_para_agente}
+
+    async def match_direct_items(self, items: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """FASE 2 (a): matches por mapeo de BD y exactos. Devuelve (conciliados, sin_match)."""
+        conciliados_exactos, sin_match = [], []
+
+        # 1. Match por Mapeo de BD (Sinónimos / Manual): todos los códigos en una consulta
+        mapeos = {item["nombre_factura"]: mapping for item in items
+                  if (mapping := self._lookup_mapping(item["nombre_factura"])) is not None}
+        por_codigo = await get_by_codigo_many_async(m["codigo"] for m in mapeos.values())
+
+        # 2. Match Exacto (solo para los que no se encontraron por sinónimo)
+        sin_mapeo = [item["nombre_factura"] for item in items
+                     if item["nombre_factura"] not in mapeos or mapeos[item["nombre_factura"]]["codigo"] not in por_codigo]
+        por_nombre = await get_by_exact_name_many_async(sin_mapeo)
 
         for item in items:
             nombre_factura = item["nombre_factura"]
-            
+
             match_info = None
-            # 1. Match por Mapeo de BD (Sinónimos / Manual)
-            if nombre_factura in self.mappings:
-                mapping = self.mappings[nombre_factura]
-                codigo = mapping["codigo"]
-                metodo = mapping["metodo"]
-                
-                logger.info(f"Match por Mapeo de BD ('{metodo}') para '{nombre_factura}' -> '{codigo}'")
-                
-                match = get_by_codigo(codigo)
-                if match:
-                    match_info = {
-                        "codigo_bd": match[0],
-                        "nombre_bd": match[1],
-                        "precio_referencia": float(match[2]) if match[2] else 0.0,
-                        "confianza": 100,
-                        "score_coincidencia": 100.0,
-                        "metodo_conciliacion": metodo # Asignamos el método desde la BD
-                    }
-            
-            # 2. Match Exacto (solo si no se encontró por sinónimo)
-            if not match_info:
-                exact_match = get_by_exact_name(nombre_factura)
+            mapping = mapeos.get(nombre_factura)
+            match = por_codigo.get(mapping["codigo"]) if mapping else None
+            if match:
+                logger.info(f"Match por Mapeo de BD ('{mapping['metodo']}') para '{nombre_factura}' -> '{mapping['codigo']}'")
+                match_info = self._build_match_info(match, mapping["metodo"]) # Asignamos el método desde la BD
+            else:
+                exact_match = por_nombre.get(nombre_factura)
                 if exact_match:
                     logger.info(f"Match por Exacto para '{nombre_factura}' -> '{exact_match[0]}'")
-                    # Asignación de Score 100.0 y Método
-                    match_info = {
-                        "codigo_bd": exact_match[0], 
-                        "nombre_bd": exact_match[1], 
-                        "precio_referencia": float(exact_match[2]) if exact_match[2] else 0.0, 
-                        "confianza": 100,
-                        "score_coincidencia": 100.0, 
-                        "metodo_conciliacion": "Exacto" # <-- BASE DE DATOS
-                    }
+                    match_info = self._build_match_info(exact_match, "Exacto") # <-- BASE DE DATOS
 
             if match_info:
                 conciliados_exactos.append({**item, **match_info})
             else:
-                # 3. Fallback a Fuzzing/IA (Pendientes para el agente)
-                fuzzy_rows = search_fuzzy(nombre_factura, k=50)
-                candidatos_puntuados = []
-                if fuzzy_rows:
-                    for code, name, price in fuzzy_rows:
-                        cand_dict = {"codigo": code, "nombre": name, "precio": float(price) if price is not None else 0.0}
-                        score = fuzz.token_set_ratio(nombre_factura, cand_dict["nombre"])
-                        if score > 45: candidatos_puntuados.append((score, cand_dict))
-                
-                candidatos_puntuados.sort(key=lambda x: x[0], reverse=True)
-                
-                top_10 = [{**cand, "score": score} for score, cand in candidatos_puntuados[:10]]
-                mejor_intento = {"nombre_bd": candidatos_puntuados[0][1]['nombre'], "score": candidatos_puntuados[0][0]} if candidatos_puntuados else None
-                
-                pendientes_para_agente.append({**item, "candidatos_bd": top_10, "mejor_intento": mejor_intento})
+                sin_match.append(item)
 
-        return {"conciliados_exactos": conciliados_exactos, "pendientes_para_agente": pendientes_para_agente}
+        return conciliados_exactos, sin_match
+
+    async def find_fuzzy_candidates(self, sin_match: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """FASE 2 (b): candidatos fuzzy puntuados para los ítems sin match directo."""
+        # 3. Fallback a Fuzzing/IA (Pendientes para el agente): candidatos de toda la factura
+        # en una búsqueda por lotes y luego un único scoring vectorizado
+        nombres = [item["nombre_factura"] for item in sin_match]
+        filas_por_nombre = await search_fuzzy_many_async(nombres, k=fuzzy_candidate_limit())
+        filas_por_item = [filas_por_nombre[nombre] for nombre in nombres]
+        loop = asyncio.get_running_loop()
+        if settings.SPEC_FILTER_ENABLED:
+            # Solo candidatos con especificaciones compatibles: listas (y prompts) más chicos
+            filas_por_item = await loop.run_in_executor(
+                self._executor, filter_candidates_by_specs, nombres, filas_por_item, fuzzy_candidate_limit()
+            )
+        puntuados_por_item = await loop.run_in_executor(self._executor, score_invoice_candidates, nombres, filas_por_item)
+        return [self._build_pending_item(item, candidatos_puntuados)
+                for item, candidatos_puntuados in zip(sin_match, puntuados_por_item)]
+
+    def _lookup_mapping(self, nombre_factura: str) -> Optional[Dict[str, str]]:
+        """Mapeo para la descripción tal cual o, si no hay, para su forma normalizada
+        (las revisiones manuales y los sinónimos aprendidos se guardan normalizados)."""
+        mapping = self.mappings.get(nombre_factura)
+        if mapping is None:
+            mapping = self.mappings.get(normalize_description(nombre_factura))
+        return mapping
+
+    @staticmethod
+    def _build_match_info(row, metodo: str) -> Dict[str, Any]:
+        """Arma el resultado de un match directo (Score 100.0) a partir de una fila (codigo, nombre, precio)."""
+        return {
+            "codigo_bd": row[0],
+            "nombre_bd": row[1],
+            "precio_referencia": float(row[2]) if row[2] else 0.0,
+            "confianza": 100,
+            "score_coincidencia": 100.0,
+            "metodo_conciliacion": metodo
+        }
+
+    @staticmethod
+    def _build_pending_item(item: Dict[str, Any], candidatos_puntuados: List[tuple]) -> Dict[str, Any]:
+        """Arma el ítem pendiente para el agente con sus 10 mejores candidatos puntuados."""
+        top_10 = [{**cand, "score": score} for score, cand in candidatos_puntuados[:10]]
+        mejor_intento = {"nombre_bd": candidatos_puntuados[0][1]['nombre'], "score": candidatos_puntuados[0][0]} if candidatos_puntuados else None
+
+        return {**item, "candidatos_bd": top_10, "mejor_intento": mejor_intento}
+
+    def run_auto_accept_phase(self, pendientes: List[Dict[str, Any]]) -> Dict[str, List]:
+        """Acepta sin IA los candidatos fuzzy inequívocos (entre la Fase 2 y la Fase 3).
+
+        El mejor candidato se acepta si su score llega a AUTO_ACCEPT_MIN_SCORE, supera al
+        segundo por al menos AUTO_ACCEPT_MIN_MARGIN puntos, la factura trae la dosis y, con la
+        forma y el envase que traiga, coinciden con los del candidato, y el token_sort_ratio
+        entre ambos nombres llega a AUTO_ACCEPT_MIN_SORT_SCORE. El resto sigue hacia la IA.
+        """
+        if not settings.AUTO_ACCEPT_ENABLED:
+            return {"conciliados": [], "pendientes": pendientes}
+
+        conciliados, restantes = [], []
+        for item in pendientes:
+            candidatos = item.get("candidatos_bd") or []
+            if candidatos and self._is_unambiguous(item["nombre_factura"], candidatos):
+                mejor = candidatos[0]
+                logger.info(f"Match por Auto-Fuzzy para '{item['nombre_factura']}' -> '{mejor['codigo']}' (score {mejor['score']})")
+                conciliados.append({
+                    **item,
+                    "codigo_bd": mejor["codigo"],
+                    "nombre_bd": mejor.get("nombre"),
+                    "precio_referencia": mejor.get("precio", 0.0),
+                    "confianza": mejor["score"],
+                    "score_coincidencia": mejor["score"],
+                    "metodo_conciliacion": "Auto-Fuzzy"
+                })
+            else:
+                restantes.append(item)
+
+        logger.info(f"Aceptación automática: {len(conciliados)} ítems conciliados sin IA, {len(restantes)} pendientes para la IA.")
+        return {"conciliados": conciliados, "pendientes": restantes}
+
+    def _is_unambiguous(self, nombre_factura: str, candidatos: List[Dict[str, Any]]) -> bool:
+        """True si el primer candidato (ya ordenados por score) supera los umbrales de aceptación automática."""
+        mejor = candidatos[0]["score"]
+        segundo = candidatos[1]["score"] if len(candidatos) > 1 else 0
+        if mejor < settings.AUTO_ACCEPT_MIN_SCORE or mejor - segundo < settings.AUTO_ACCEPT_MIN_MARGIN:
+            return False
+        # token_set_ratio da 100 si un nombre contiene al otro: la factura tiene que traer al
+        # menos la dosis y cada especificación suya tiene que estar también en el candidato
+        nombre_candidato = candidatos[0].get("nombre") or ""
+        specs_factura = self._comparable_specs(nombre_factura)
+        if "dosis" not in specs_factura:
+            return False
+        specs_candidato = self._comparable_specs(nombre_candidato)
+        if any(specs_candidato.get(clave) != valor for clave, valor in specs_factura.items()):
+            return False
+        # token_sort_ratio, a diferencia de token_set_ratio, penaliza las palabras que sobran
+        orden = fuzz.token_sort_ratio(fuzz_utils.full_process(nombre_factura, force_ascii=True),
+                                      fuzz_utils.full_process(nombre_candidato, force_ascii=True))
+        return orden >= settings.AUTO_ACCEPT_MIN_SORT_SCORE
+
+    def _comparable_specs(self, nombre: str) -> Dict[str, str]:
+        """Dosis, forma y envase del nombre según MedicationParser, normalizados para comparar."""
+        specs = {
+            "dosis": self._parser._extract_dosage(nombre),
+            "forma": self._parser._extract_form(nombre),
+            "envase": self._parser._extract_pack_size(nombre),
+        }
+        return {clave: valor.lower().replace(" ", "") for clave, valor in specs.items() if valor}
 
-    async def run_conciliation_phase(self, pendientes: List[Dict[str, Any]]) -> Dict[str, List]:
-        """FASE 3: Ejecuta la conciliación con IA en paralelo."""
-        tasks = [self.ai_agent.conciliate_item(item) for item in pendientes]
-        results = await asyncio.gather(*tasks)
+    async def run_conciliation_phase(self, pendientes: List[Dict[str, Any]], deadline_seconds: Optional[float] = None) -> Dict[str, List]:
+        """FASE 3: Ejecuta la conciliación con IA en paralelo.
+
+        Con LLM_BATCH_SIZE > 1 los ítems viajan en lotes de ese tamaño (una llamada por lote).
+        Las llamadas pasan por el planificador de la IA (concurrencia, rate limit, reintentos);
+        al vencer el deadline se devuelven los resultados parciales y el resto queda como fallido.
+        """
+        por_lote = {}
+        async for indice, conciliados, fallidos in self.iter_conciliation_phase(pendientes, deadline_seconds):
+            por_lote[indice] = (conciliados, fallidos)
+
+        # Se conserva el orden de entrada aunque los lotes terminen en cualquier orden
         conciliados_por_ia, fallidos = [], []
+        for indice in sorted(por_lote):
+            conciliados_por_ia.extend(por_lote[indice][0])
+            fallidos.extend(por_lote[indice][1])
+        return {"conciliados": conciliados_por_ia, "fallidos": fallidos}
+
+    async def iter_conciliation_phase(
+        self, pendientes: List[Dict[str, Any]], deadline_seconds: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, List[Dict[str, Any]], List[Dict[str, Any]]]]:
+        """FASE 3 incremental: emite (índice_lote, conciliados, fallidos) a medida que cada lote resuelve.
+
+        Si quien consume deja de iterar (p. ej. el cliente del streaming se desconecta),
+        las llamadas a la IA que sigan en curso se cancelan.
+        """
+        loop = asyncio.get_running_loop()
+        if deadline_seconds is None:
+            deadline_seconds = settings.LLM_REQUEST_DEADLINE_SECONDS
+        deadline = loop.time() + deadline_seconds
+
+        batch_size = max(settings.LLM_BATCH_SIZE, 1)
+        lotes = [pendientes[i:i + batch_size] for i in range(0, len(pendientes), batch_size)]
+        # Las tareas heredan el deadline a través del contexto en el que se crean
+        token = current_deadline.set(deadline)
+        try:
+            tasks = {asyncio.ensure_future(self._conciliate_lote(lote)): indice for indice, lote in enumerate(lotes)}
+        finally:
+            current_deadline.reset(token)
+
+        total_conciliados = total_fallidos = errores = 0
+        pending = set(tasks)
+        try:
+            while pending:
+                # Margen de 1s: el planificador corta primero y cada ítem informa su propio error
+                restante = deadline + 1.0 - loop.time()
+                if restante <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=restante, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    indice = tasks[task]
+                    if task.exception() is None:
+                        results = task.result()
+                    else:
+                        error = type(task.exception()).__name__
+                        results = [{"codigo_bd_conciliado": None, "confianza": 0, "error": error} for _ in lotes[indice]]
+                    conciliados, fallidos = self._resolve_lote(lotes[indice], results)
+                    total_conciliados += len(conciliados)
+                    total_fallidos += len(fallidos)
+                    errores += sum(1 for f in fallidos if f.get("error_conciliacion"))
+                    yield indice, conciliados, fallidos
 
-        for result, item in zip(results, pendientes):
+            for task in pending:
+                task.cancel()
+            for task in sorted(pending, key=tasks.get):
+                indice = tasks[task]
+                results = [{"codigo_bd_conciliado": None, "confianza": 0, "error": "deadline"} for _ in lotes[indice]]
+                _, fallidos = self._resolve_lote(lotes[indice], results)
+                total_fallidos += len(fallidos)
+                errores += len(fallidos)
+                yield indice, [], fallidos
+            pending = set()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        logger.info(f"Fase 3 completada: {total_conciliados} conciliados por IA, {total_fallidos} fallidos ({errores} por error).")
+
+    def _resolve_lote(self, lote: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Cruza las respuestas de la IA con los candidatos de cada ítem del lote."""
+        conciliados_por_ia, fallidos = [], []
+
+        for result, item in zip(results, lote):
             codigo = result.get("codigo_bd_conciliado")
             if codigo:
                 candidato = next((c for c in item['candidatos_bd'] if c['codigo'] == codigo), None)
@@ -99,26 +279,55 @@ class OrchestrationService:
                         "score_coincidencia": score, 
                         "metodo_conciliacion": "IA/Fuzzy" # <-- BASE DE DATOS
                     })
-            else:
-                fallidos.append({**item, "mejor_intento": item.get("mejor_intento")})
+                    continue
+                logger.warning(f"La IA eligió '{codigo}' para '{item['nombre_factura']}', que no está entre sus candidatos.")
+            fallido = {**item, "mejor_intento": item.get("mejor_intento")}
+            if result.get("error"):
+                fallido["error_conciliacion"] = result["error"]
+            fallidos.append(fallido)
         
-        logger.info(f"Fase 3 completada: {len(conciliados_por_ia)} conciliados por IA.")
-        return {"conciliados": conciliados_por_ia, "fallidos": fallidos}
+        self._promote_synonyms(conciliados_por_ia)
+        return conciliados_por_ia, fallidos
+
+    def _promote_synonyms(self, conciliados: List[Dict[str, Any]]):
+        """Aprende como sinónimos 'IA-Auto' los matches de la IA con confianza alta.
+
+        El mapeo en memoria se actualiza en el acto; la escritura en la BD queda en la
+        cola del promotor, fuera del camino crítico de la request.
+        """
+        promoter = get_synonym_promoter()
+        if promoter is None:
+            return
+        for item in conciliados:
+            if item.get("confianza", 0) < settings.SYNONYM_PROMOTION_MIN_CONFIDENCE:
+                continue
+            clave = normalize_description(item["nombre_factura"])
+            actual = self.mappings.get(clave)
+            if not clave or (actual and actual["metodo"] == "Manual"):
+                continue
+            self.mappings[clave] = {"codigo": item["codigo_bd"], "metodo": "IA-Auto"}
+            promoter.enqueue(clave, item["codigo_bd"])
+
+    async def _conciliate_lote(self, lote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if len(lote) == 1:
+            return [await self.ai_agent.conciliate_item(lote[0])]
+        return await self.ai_agent.conciliate_batch(lote)
 
     def _annotate_with_surcharges(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """FASE 4: Calcula y anota la información de sobreprecio."""
-        annotated = []
-        for item in items:
-            report = item.copy()
-            total_facturado, ref_unitario, cantidad = item.get("precio_total_agregado"), item.get("precio_referencia"), item.get("cantidad_total")
-            report["monto_sobreprecio"], report["porcentaje_sobreprecio"] = 0.0, 0.0
-            if all(v is not None for v in [total_facturado, ref_unitario, cantidad]) and ref_unitario > 0 and cantidad > 0:
-                ref_total = ref_unitario * cantidad
-                diferencia = total_facturado - ref_total
-                report["monto_sobreprecio"] = round(diferencia, 2)
-                report["porcentaje_sobreprecio"] = round((diferencia / ref_total) * 100, 2)
-            annotated.append(report)
-        return annotated
+        return [self._annotate_item(item) for item in items]
+
+    @staticmethod
+    def _annotate_item(item: Dict[str, Any]) -> Dict[str, Any]:
+        report = item.copy()
+        total_facturado, ref_unitario, cantidad = item.get("precio_total_agregado"), item.get("precio_referencia"), item.get("cantidad_total")
+        report["monto_sobreprecio"], report["porcentaje_sobreprecio"] = 0.0, 0.0
+        if all(v is not None for v in [total_facturado, ref_unitario, cantidad]) and ref_unitario > 0 and cantidad > 0:
+            ref_total = ref_unitario * cantidad
+            diferencia = total_facturado - ref_total
+            report["monto_sobreprecio"] = round(diferencia, 2)
+            report["porcentaje_sobreprecio"] = round((diferencia / ref_total) * 100, 2)
+        return report
 
     def generate_final_summary(self, total_items: List[Dict[str, Any]], all_conciliated: List[Dict[str, Any]], fallidos: List[Dict[str, Any]], threshold: float) -> Dict[str, Any]:
         """FASE 5: Construye el objeto de datos final para la respuesta de la API."""
@@ -143,4 +352,40 @@ class OrchestrationService:
             "items_conciliados": annotated,
             "items_con_sobreprecio": sobreprecio,
             "items_no_conciliados": fallidos
-        }
\ No newline at end of file
+        }
+
+    def start_summary(self, total_items: List[Dict[str, Any]], threshold: float) -> "SummaryAccumulator":
+        """FASE 5 incremental: acumulador de métricas para la respuesta en streaming."""
+        return SummaryAccumulator(total_items, threshold)
+
+
+class SummaryAccumulator:
+    """Calcula las métricas de `generate_final_summary` ítem a ítem, sin retener las listas."""
+
+    def __init__(self, total_items: List[Dict[str, Any]], threshold: float):
+        self.threshold = threshold
+        self.metricas = {
+            "ahorro_potencial": 0,
+            "monto_total_facturado": sum(i.get("precio_total_agregado", 0) for i in total_items),
+            "items_procesados": len(total_items),
+            "items_conciliados": 0,
+            "items_con_sobreprecio": 0,
+            "items_no_conciliados": 0
+        }
+
+    def add_conciliado(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Anota el ítem conciliado (sobreprecio, precio_factura) y lo suma a las métricas."""
+        report = OrchestrationService._annotate_item(item)
+        if 'precio_unitario' in report:
+            report['precio_factura'] = report.pop('precio_unitario')
+        report["con_sobreprecio"] = report["porcentaje_sobreprecio"] > self.threshold
+
+        self.metricas["items_conciliados"] += 1
+        if report["con_sobreprecio"]:
+            self.metricas["items_con_sobreprecio"] += 1
+            self.metricas["ahorro_potencial"] += report.get("monto_sobreprecio", 0)
+        return report
+
+    def add_fallido(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        self.metricas["items_no_conciliados"] += 1
+        return item
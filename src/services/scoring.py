@@ -0,0 +1,49 @@
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
+from thefuzz import utils as fuzz_utils
+from src.db.catalog import processed_name
+
+logger = logging.getLogger(__name__)
+
+# Score mínimo (token_set_ratio) para que una fila fuzzy cuente como candidato
+MIN_CANDIDATE_SCORE = 45
+
+ScoredCandidate = Tuple[int, Dict[str, Any]]
+
+def score_invoice_candidates(nombres: Sequence[str], filas_por_item: Sequence[Sequence[tuple]]) -> List[List[ScoredCandidate]]:
+    """Puntúa los candidatos de todos los ítems pendientes de una factura en una sola llamada.
+
+    Todos los pares (nombre_factura, nombre_candidato) se aplanan y se puntúan con
+    rapidfuzz `process.cpdist` (token_set_ratio, workers=-1), que devuelve un vector
+    NumPy de scores. Los nombres del catálogo ya vienen preprocesados desde el
+    catálogo en memoria, así que solo se procesan las descripciones de la factura.
+    Los scores son los mismos que `thefuzz.fuzz.token_set_ratio`.
+
+    Devuelve, por cada ítem, la lista [(score, candidato)] ordenada de mayor a menor.
+    """
+    puntuados: List[List[ScoredCandidate]] = [[] for _ in nombres]
+    pares = [(idx, fila) for idx, filas in enumerate(filas_por_item) if filas for fila in filas]
+    if not pares:
+        return puntuados
+
+    queries_por_item = {idx: fuzz_utils.full_process(nombres[idx], force_ascii=True) for idx, _ in pares}
+    queries = [queries_por_item[idx] for idx, _ in pares]
+    choices = [processed_name(fila[1] or "") for _, fila in pares]
+
+    scores = process.cpdist(queries, choices, scorer=fuzz.token_set_ratio, workers=-1)
+    # thefuzz redondea con round() (mitad al par), igual que np.rint
+    scores = np.rint(scores).astype(int)
+    owners = np.fromiter((idx for idx, _ in pares), dtype=np.int64, count=len(pares))
+
+    # Solo se arman diccionarios para los pares que superan el umbral, ya ordenados por
+    # ítem y score descendente (lexsort es estable: respeta el orden original en empates)
+    keep = np.nonzero(scores > MIN_CANDIDATE_SCORE)[0]
+    keep = keep[np.lexsort((-scores[keep], owners[keep]))]
+    for pos, score in zip(keep.tolist(), scores[keep].tolist()):
+        idx, (code, name, price) = pares[pos]
+        puntuados[idx].append((score, {"codigo": code, "nombre": name, "precio": float(price) if price is not None else 0.0}))
+
+    logger.debug(f"Scoring vectorizado: {len(pares)} pares para {len(nombres)} ítems.")
+    return puntuados
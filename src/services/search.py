@@ -1,8 +1,9 @@
 """
 Búsqueda multi-método para ~100% efectividad.
 """
-from src.db import search_fuzzy, get_by_codigo, parse_medication_nombre
-from src.utils import normalize_description, extract_specifications
+from typing import List, Tuple
+from src.db import search_fuzzy, get_by_codigo, get_medication_specs_many
+from src.utils import normalize_description
 import re
 
 def search_medication(query: str, k: int = 5, threshold: float = 0.5) -> List[dict]:
@@ -10,81 +11,60 @@ def search_medication(query: str, k: int = 5, threshold: float = 0.5) -> List[di
     Búsqueda multi-método usando las funciones existentes de DB.
     Prioriza búsqueda por código, luego fuzzy, luego componentes.
     """
-    results = []
-    original_query = query
+    # Filas encontradas con su score; las especificaciones se piden todas juntas al final
+    found: List[Tuple[tuple, float]] = []
 
     # 1. Primero intentar buscar por código exacto
     codigo_result = get_by_codigo(query.strip())
     if codigo_result:
-        parsed = parse_medication_nombre(codigo_result[1])  # nombre es el segundo elemento
-        results.append({
-            "codigo": codigo_result[0],
-            "nombre": codigo_result[1],
-            "precio": float(codigo_result[2]) if codigo_result[2] else None,
-            "score": 100.0,  # Match exacto
-            "specifications": {
-                "brand": parsed.get('brand', ''),
-                "active": parsed.get('active', ''),
-                "form": parsed.get('form', ''),
-                "dose": parsed.get('dose', ''),
-                "pack": parsed.get('pack', '')
-            }
-        })
+        found.append((codigo_result, 100.0))  # Match exacto
 
     # 2. Si no hay match exacto, buscar fuzzy
-    if not results:
+    if not found:
         fuzzy_results = search_fuzzy(query, k=k*2)  # Buscar más para filtrar después
         for row in fuzzy_results:
-            if len(results) >= k:
+            if len(found) >= k:
                 break
 
             # Calcular score basado en la similitud
             score = _calculate_similarity_score(query, row[1])  # nombre es row[1]
 
             if score >= threshold:
-                parsed = parse_medication_nombre(row[1])
-                results.append({
-                    "codigo": row[0],
-                    "nombre": row[1],
-                    "precio": float(row[2]) if row[2] else None,
-                    "score": score,
-                    "specifications": {
-                        "brand": parsed.get('brand', ''),
-                        "active": parsed.get('active', ''),
-                        "form": parsed.get('form', ''),
-                        "dose": parsed.get('dose', ''),
-                        "pack": parsed.get('pack', '')
-                    }
-                })
+                found.append((row, score))
 
     # 3. Fallback: buscar por componentes individuales
-    if not results:
+    if not found:
         components = _extract_search_components(query)
         for component in components:
-            if len(results) >= k:
+            if len(found) >= k:
                 break
 
             fuzzy_results = search_fuzzy(component, k=3)
             for row in fuzzy_results:
-                if len(results) >= k:
+                if len(found) >= k:
                     break
 
                 # Evitar duplicados
-                if not any(r["codigo"] == row[0] for r in results):
-                    parsed = parse_medication_nombre(row[1])
-                    results.append({
-                        "codigo": row[0],
-                        "nombre": row[1],
-                        "precio": float(row[2]) if row[2] else None,
-                        "score": 60.0,  # Score menor para matches parciales
-                        "specifications": {
-                            "brand": parsed.get('brand', ''),
-                            "active": parsed.get('active', ''),
-                            "form": parsed.get('form', ''),
-                            "dose": parsed.get('dose', ''),
-                            "pack": parsed.get('pack', '')
-                        }
-                    })
+                if not any(r[0] == row[0] for r, _ in found):
+                    found.append((row, 60.0))  # Score menor para matches parciales
+
+    specs = get_medication_specs_many(row for row, _ in found)
+    results = []
+    for row, score in found:
+        parsed = specs[row[0]]
+        results.append({
+            "codigo": row[0],
+            "nombre": row[1],
+            "precio": float(row[2]) if row[2] else None,
+            "score": score,
+            "specifications": {
+                "brand": parsed.get('brand', ''),
+                "active": parsed.get('active', ''),
+                "form": parsed.get('form', ''),
+                "dose": parsed.get('dose', ''),
+                "pack": parsed.get('pack', '')
+            }
+        })
 
     return results
 
@@ -3,27 +3,53 @@ High-effectiveness medication search engine with multiple methods
 """
 import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from typing import List, Dict, Any, Optional, Tuple
-from src.db import search_fuzzy, get_by_codigo, parse_medication_nombre
-from src.utils import normalize_description, extract_specifications
-from src.models import SearchResult, MedicationSpec
+from src.config import settings
+from src.db import search_fuzzy_many_async, get_by_codigo_many_async, catalog_version, get_medication_specs_many
+from src.db.catalog import normalized_name
+from src.utils import normalize_description
+from src.models import MedicationSpec
+from src.utils.cache import MISSING, TTLCache
 import re
 
 logger = logging.getLogger(__name__)
 
+def _semantic_search_many(queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+    # faiss and sentence-transformers are optional: without them semantic search is skipped
+    try:
+        from src.services.semantic_search import get_semantic_search_service
+    except ImportError as e:
+        logger.warning(f"Semantic search unavailable: {e}")
+        return [[] for _ in queries]
+    return get_semantic_search_service().search_many(queries, k)
+
+# Dedicated, bounded pool: a semantic search cancelled by the hybrid latency budget keeps
+# its thread until the encode finishes, and must not tie up the default executor
+_semantic_executor = ThreadPoolExecutor(max_workers=max(1, settings.SEMANTIC_SEARCH_MAX_THREADS), thread_name_prefix="semantic")
+
+def _top_k(results: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Best k results by score; ties keep their retrieval order"""
+    return sorted(results, key=lambda r: r["score"], reverse=True)[:k]
+
 class SearchEngine:
     """High-effectiveness medication search engine with multiple methods"""
 
     def __init__(self):
-        self.search_cache = {}
+        # Bounded LRU + TTL cache keyed on (normalized query, k, threshold, mode);
+        # entries are dropped when the catalog version changes
+        self.search_cache = TTLCache(
+            "search_medication", settings.SEARCH_CACHE_MAX_ENTRIES, settings.SEARCH_CACHE_TTL_SECONDS
+        )
         self.start_time = None
 
     async def search_medication(
         self,
         query: str,
         k: int = 5,
-        threshold: float = 0.5
+        threshold: float = 0.5,
+        mode: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Multi-method search for high effectiveness (~100% accuracy)
@@ -33,158 +59,241 @@ class SearchEngine:
         2. SQL DIFFERENCE fuzzy search (85-95% confidence)
         3. Component-based search (70-85% confidence)
         4. Semantic similarity (60-80% confidence)
-        """
-        self.start_time = time.time()
-        results = []
 
-        try:
-            # Method 1: Exact code matching
-            exact_results = self._search_exact_code(query)
-            results.extend(exact_results)
-
-            # Method 2: Fuzzy search (if no exact match or need more results)
-            if len(results) < k:
-                fuzzy_results = await self._search_fuzzy(query, k - len(results))
-                results.extend(fuzzy_results)
+        With mode "hybrid" (default: settings.SEARCH_MODE) the lexical and semantic
+        retrievers run concurrently and are merged with reciprocal-rank fusion.
+        """
+        return (await self.search_many([query], k, threshold, mode))[0]
 
-            # Method 3: Component-based search (if still need more results)
-            if len(results) < k:
-                component_results = await self._search_components(query, k - len(results))
-                results.extend(component_results)
+    async def search_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        threshold: float = 0.5,
+        mode: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Batch version of search_medication: one result list per query, in input order.
 
-            # Method 4: Semantic search (if still need more results)
-            if len(results) < k:
-                semantic_results = await self._search_semantic(query, k - len(results))
-                results.extend(semantic_results)
+        Queries that normalize to the same text are searched once, and each method
+        runs as one bulk lookup over the whole batch (components are also deduplicated
+        across queries), so an invoice costs a handful of lookups instead of several
+        per item. In hybrid mode the latency budget applies to the whole batch.
+        """
+        self.start_time = time.time()
+        mode = mode or settings.SEARCH_MODE
+        version = catalog_version()
+        # Without a catalog version nothing would ever invalidate the entries, so skip the cache
+        use_cache = settings.SEARCH_CACHE_ENABLED and version is not None
+
+        keys = [(normalize_description(query), k, threshold, mode) for query in queries]
+        by_key: Dict[Tuple, List[Dict[str, Any]]] = {}
+        pending: Dict[Tuple, str] = {}
+        for key, query in zip(keys, queries):
+            if key in by_key or key in pending:
+                continue
+            cached = self.search_cache.get(key, version) if use_cache else MISSING
+            if cached is not MISSING:
+                by_key[key] = cached
+            else:
+                pending[key] = query
 
-            # Filter by threshold and limit results
-            filtered_results = [r for r in results if r['score'] >= threshold]
-            limited_results = filtered_results[:k]
+        try:
+            if pending:
+                if mode == "hybrid":
+                    found = await self._search_hybrid_many(list(pending.values()), k)
+                else:
+                    found = await self._search_sequential_many(list(pending.values()), k)
 
-            # Sort by score (highest first)
-            limited_results.sort(key=lambda x: x['score'], reverse=True)
+                for key, results in zip(pending, found):
+                    by_key[key] = self._filter_results(results, k, threshold, mode)
+                    if use_cache:
+                        self.search_cache.set(key, [dict(r) for r in by_key[key]], version)
 
             search_time = (time.time() - self.start_time) * 1000
-            logger.info(f"Search completed in {search_time:.2f}ms: {len(limited_results)} results")
-
-            return limited_results
+            logger.info(
+                f"Search ({mode}) completed in {search_time:.2f}ms: {len(queries)} queries, "
+                f"{len(pending)} searched, {len(by_key) - len(pending)} from cache"
+            )
+            return [[dict(r) for r in by_key[key]] for key in keys]
 
         except Exception as e:
             search_time = (time.time() - self.start_time) * 1000
             logger.error(f"Search failed after {search_time:.2f}ms: {str(e)}")
             raise
 
-    def _search_exact_code(self, query: str) -> List[Dict[str, Any]]:
-        """Search for exact code matches"""
-        results = []
-        codigo_result = get_by_codigo(query.strip())
-
-        if codigo_result:
-            parsed = parse_medication_nombre(codigo_result[1])
-            results.append({
-                "codigo": codigo_result[0],
-                "nombre": codigo_result[1],
-                "precio": float(codigo_result[2]) if codigo_result[2] else None,
-                "score": 100.0,  # Exact match
-                "specifications": MedicationSpec(
-                    brand=parsed.get('brand', ''),
-                    active=parsed.get('active', ''),
-                    form=parsed.get('form', ''),
-                    dose=parsed.get('dose', ''),
-                    pack=parsed.get('pack', '')
-                ),
-                "search_method": "exact_code"
-            })
+    def _filter_results(self, results: List[Dict[str, Any]], k: int, threshold: float, mode: str) -> List[Dict[str, Any]]:
+        """Filter by threshold, sort by score (highest first), then limit results;
+        hybrid results are already in fused order"""
+        filtered_results = [r for r in results if r['score'] >= threshold]
+        if mode != "hybrid":
+            filtered_results.sort(key=lambda x: x['score'], reverse=True)
+        return filtered_results[:k]
+
+    async def _search_sequential_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Run the methods one after another, each only for the queries that need more results"""
+        # Method 1: Exact code matching
+        results = await self._search_exact_code_many(queries)
+
+        # Methods 2-4: fuzzy, component-based and semantic search, each as one bulk
+        # lookup over the queries that still have fewer than k results. Every method's
+        # top k is kept (without repeating codes) so _filter_results sorts the full
+        # list before cutting it to k
+        for method in (self._search_fuzzy_many, self._search_components_many, self._search_semantic_many):
+            needed = [i for i, query_results in enumerate(results) if len(query_results) < k]
+            if not needed:
+                break
+            found = await method([queries[i] for i in needed], k)
+            for i, method_results in zip(needed, found):
+                seen = {r["codigo"] for r in results[i]}
+                results[i].extend(r for r in method_results if r["codigo"] not in seen)
 
         return results
 
-    async def _search_fuzzy(self, query: str, k: int) -> List[Dict[str, Any]]:
-        """Fuzzy search using SQL DIFFERENCE function"""
-        results = []
+    async def _search_hybrid_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Run lexical and semantic retrievers concurrently and fuse their rankings per query.
 
-        try:
-            fuzzy_db_results = search_fuzzy(query, k=k*2)  # Get more for filtering
+        Retrievers that miss the latency budget are cancelled and the fusion uses
+        whatever finished in time. Exact code matches always come first. A cancelled
+        semantic search cannot stop its worker thread mid-encode: it finishes in the
+        background on the dedicated semantic executor (SEMANTIC_SEARCH_MAX_THREADS), so
+        late calls queue there instead of piling up in the default executor.
+        """
+        exact_results = await self._search_exact_code_many(queries)
+
+        # Each retriever fetches a deeper list than k so fusion has room to re-rank
+        depth = max(k * 2, 10)
+        retrievers = {
+            "fuzzy": self._search_fuzzy_many(queries, depth),
+            "component": self._search_components_many(queries, depth),
+            "semantic": self._search_semantic_many(queries, depth),
+        }
+        tasks = {asyncio.ensure_future(coro): name for name, coro in retrievers.items()}
+        done, pending = await asyncio.wait(tasks, timeout=settings.SEARCH_LATENCY_BUDGET_MS / 1000)
+        for task in pending:
+            task.cancel()
+            logger.info(f"Retriever '{tasks[task]}' exceeded the {settings.SEARCH_LATENCY_BUDGET_MS}ms budget")
+
+        rankings = {}
+        for task in done:
+            if task.exception() is not None:
+                logger.warning(f"Retriever '{tasks[task]}' failed: {task.exception()}")
+                continue
+            rankings[tasks[task]] = task.result()
 
-            for row in fuzzy_db_results:
-                if len(results) >= k:
-                    break
+        results = []
+        for i, exact in enumerate(exact_results):
+            fused = self._fuse_rankings({name: ranking[i] for name, ranking in rankings.items()})
+            seen = {r["codigo"] for r in exact}
+            results.append(exact + [r for r in fused if r["codigo"] not in seen])
+        return results
 
-                score = self._calculate_fuzzy_score(query, row[1])
-                if score >= 60.0:  # Minimum threshold for fuzzy matches
-                    parsed = parse_medication_nombre(row[1])
-                    results.append({
-                        "codigo": row[0],
-                        "nombre": row[1],
-                        "precio": float(row[2]) if row[2] else None,
-                        "score": score,
-                        "specifications": MedicationSpec(
-                            brand=parsed.get('brand', ''),
-                            active=parsed.get('active', ''),
-                            form=parsed.get('form', ''),
-                            dose=parsed.get('dose', ''),
-                            pack=parsed.get('pack', '')
-                        ),
-                        "search_method": "fuzzy"
-                    })
+    def _fuse_rankings(self, rankings: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Reciprocal-rank fusion: sum of weight / (RRF_K + rank) over the retrievers that found each item.
 
+        The item keeps its best per-retriever score (so score thresholds mean the same
+        as in sequential mode) and gets the fused value in 'fusion_score'.
+        """
+        weights = {
+            "fuzzy": settings.SEARCH_LEXICAL_WEIGHT,
+            "component": settings.SEARCH_LEXICAL_WEIGHT,
+            "semantic": settings.SEARCH_SEMANTIC_WEIGHT,
+        }
+        fused: Dict[str, Dict[str, Any]] = {}
+        for name, results in rankings.items():
+            for rank, result in enumerate(results, start=1):
+                contribution = weights.get(name, 1.0) / (settings.SEARCH_RRF_K + rank)
+                entry = fused.get(result["codigo"])
+                if entry is None:
+                    fused[result["codigo"]] = {**result, "fusion_score": contribution, "search_method": f"hybrid:{name}"}
+                    continue
+                entry["fusion_score"] += contribution
+                entry["search_method"] += f"+{name}"
+                if result["score"] > entry["score"]:
+                    entry["score"] = result["score"]
+
+        return sorted(fused.values(), key=lambda r: (r["fusion_score"], r["score"]), reverse=True)
+
+    def _build_result(self, row, score: float, search_method: str, specs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Result dict for a (codigo, nombre, precio) row; specs come from get_medication_specs_many"""
+        return {
+            "codigo": row[0],
+            "nombre": row[1],
+            "precio": float(row[2]) if row[2] else None,
+            "score": score,
+            "specifications": MedicationSpec(**specs[row[0]]),
+            "search_method": search_method
+        }
+
+    async def _search_exact_code_many(self, queries: List[str]) -> List[List[Dict[str, Any]]]:
+        """Search for exact code matches, all codes in one lookup"""
+        by_codigo = await get_by_codigo_many_async(query.strip() for query in queries)
+        specs = get_medication_specs_many(by_codigo.values())
+        return [
+            [self._build_result(row, 100.0, "exact_code", specs)] if (row := by_codigo.get(query.strip())) else []
+            for query in queries
+        ]
+
+    async def _search_fuzzy_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Fuzzy search for every query with one bulk search_fuzzy lookup"""
+        try:
+            rows_by_query = await search_fuzzy_many_async(queries, k=k*2)  # Get more for filtering
         except Exception as e:
             logger.warning(f"Fuzzy search failed: {str(e)}")
+            return [[] for _ in queries]
 
-        return results
-
-    async def _search_components(self, query: str, k: int) -> List[Dict[str, Any]]:
-        """Search by breaking query into components"""
-        results = []
-        components = self._extract_search_components(query)
-
-        for component in components:
-            if len(results) >= k:
-                break
+        specs = get_medication_specs_many(row for rows in rows_by_query.values() for row in rows)
+        all_results = []
+        for query in queries:
+            results = []
+            for row in rows_by_query[query]:
+                score = self._calculate_fuzzy_score(query, row[1])
+                if score >= 60.0:  # Minimum threshold for fuzzy matches
+                    results.append(self._build_result(row, score, "fuzzy", specs))
+            all_results.append(_top_k(results, k))
 
-            try:
-                component_results = search_fuzzy(component, k=3)
-                for row in component_results:
-                    if len(results) >= k:
-                        break
+        return all_results
 
+    async def _search_components_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Search by breaking queries into components; each distinct component is looked up once for the batch"""
+        components_by_query = [self._extract_search_components(query) for query in queries]
+        try:
+            rows_by_component = await search_fuzzy_many_async(
+                [component for components in components_by_query for component in components], k=3
+            )
+        except Exception as e:
+            logger.warning(f"Component search failed: {str(e)}")
+            return [[] for _ in queries]
+
+        specs = get_medication_specs_many(row for rows in rows_by_component.values() for row in rows)
+        all_results = []
+        for query, components in zip(queries, components_by_query):
+            results = []
+            for component in components:
+                for row in rows_by_component[component]:
                     # Avoid duplicates
                     if not any(r["codigo"] == row[0] for r in results):
-                        parsed = parse_medication_nombre(row[1])
                         score = self._calculate_component_score(query, component, row[1])
 
                         if score >= 50.0:  # Lower threshold for component matches
-                            results.append({
-                                "codigo": row[0],
-                                "nombre": row[1],
-                                "precio": float(row[2]) if row[2] else None,
-                                "score": score,
-                                "specifications": MedicationSpec(
-                                    brand=parsed.get('brand', ''),
-                                    active=parsed.get('active', ''),
-                                    form=parsed.get('form', ''),
-                                    dose=parsed.get('dose', ''),
-                                    pack=parsed.get('pack', '')
-                                ),
-                                "search_method": f"component_{component[:20]}..."
-                            })
-
-            except Exception as e:
-                logger.warning(f"Component search failed for '{component}': {str(e)}")
-                continue
+                            results.append(self._build_result(row, score, f"component_{component[:20]}...", specs))
+            all_results.append(_top_k(results, k))
 
-        return results
+        return all_results
 
-    async def _search_semantic(self, query: str, k: int) -> List[Dict[str, Any]]:
-        """Semantic search using sentence transformers (placeholder for future implementation)"""
-        # TODO: Implement semantic search with pre-computed embeddings and FAISS
-        # For now, return empty results to avoid errors
-        logger.info("Semantic search not yet implemented - returning empty results")
-        return []
+    async def _search_semantic_many(self, queries: List[str], k: int) -> List[List[Dict[str, Any]]]:
+        """Semantic search over the prebuilt FAISS index (see build_semantic_index.py)
+        for many queries with one batched encode and one index search.
+
+        Runs in a worker thread: encoding is CPU-bound and the first call loads the model.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_semantic_executor, _semantic_search_many, queries, k)
 
     def _calculate_fuzzy_score(self, query: str, db_name: str) -> float:
         """Calculate fuzzy match score"""
         query_norm = normalize_description(query.lower())
-        db_norm = normalize_description(db_name.lower())
+        db_norm = normalized_name(db_name)  # Precomputed once per catalog name
 
         # Word overlap bonus
         query_words = set(query_norm.split())
@@ -213,7 +322,7 @@ class SearchEngine:
 
         # Bonus if original query words appear in DB name
         query_norm = normalize_description(original_query.lower())
-        db_norm = normalize_description(db_name.lower())
+        db_norm = normalized_name(db_name)
         query_words = set(query_norm.split())
         db_words = set(db_norm.split())
         common_words = query_words.intersection(db_words)
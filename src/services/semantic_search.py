@@ -1,77 +1,247 @@
+import json
 import logging
+import os
+import time
 import numpy as np
 import faiss
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from sentence_transformers import SentenceTransformer
-from src.db import get_conn, parse_medication_nombre
+from src.config import settings
+from src.db import get_catalog, get_medication_specs_many
 from src.models import MedicationSpec
 
 logger = logging.getLogger(__name__)
 
+# Archivos del índice en SEMANTIC_INDEX_DIR; meta.json se escribe último y marca el índice como completo
+INDEX_FILE = "index.faiss"
+MAPPING_FILE = "mapping.json"
+META_FILE = "meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
 # --- Singleton Pattern para el Servicio de Búsqueda Semántica ---
 _semantic_search_instance = None
 
+def _write_atomic(path: str, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """Embeddings en float32 con norma L2 = 1: el producto interno pasa a ser la similitud coseno."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+def _ivf_nlist(n: int) -> int:
+    # ~4·sqrt(n) listas, con al menos 39 vectores de entrenamiento por lista
+    if settings.SEMANTIC_IVF_NLIST > 0:
+        return settings.SEMANTIC_IVF_NLIST
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def _pq_m(dimension: int) -> int:
+    """Sub-cuantizadores de PQ: el mayor divisor de la dimensión que no supere SEMANTIC_PQ_M."""
+    return next(m for m in range(min(settings.SEMANTIC_PQ_M, dimension), 0, -1) if dimension % m == 0)
+
+def create_index(index_type: str, dimension: int, n: int) -> faiss.Index:
+    """Índice FAISS vacío por producto interno (coseno sobre embeddings normalizados).
+
+    - flat: búsqueda exacta (referencia de recall).
+    - hnsw: grafo navegable; rápido y sin entrenamiento, usa más RAM que flat.
+    - ivf_flat: particiona en `nlist` listas y recorre `nprobe` por consulta.
+    - ivf_pq: como ivf_flat pero comprime los vectores con PQ (mucha menos RAM, menos recall).
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.SEMANTIC_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.SEMANTIC_HNSW_EF_CONSTRUCTION
+        return index
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dimension, _ivf_nlist(n), faiss.METRIC_INNER_PRODUCT)
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dimension, _ivf_nlist(n), _pq_m(dimension), 8, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Tipo de índice semántico desconocido: '{index_type}' (opciones: {', '.join(INDEX_TYPES)}).")
+
+def fill_index(index: faiss.Index, embeddings: np.ndarray):
+    """Entrena el índice si hace falta (IVF) y agrega los embeddings ya normalizados."""
+    if not index.is_trained:
+        sample = embeddings
+        if len(embeddings) > settings.SEMANTIC_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = embeddings[rng.choice(len(embeddings), settings.SEMANTIC_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    index.add(embeddings)
+
+def apply_search_params(index: faiss.Index):
+    """Parámetros de búsqueda (no se guardan en el archivo): efSearch para HNSW, nprobe para IVF."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = settings.SEMANTIC_HNSW_EF_SEARCH
+    try:
+        faiss.extract_index_ivf(index).nprobe = settings.SEMANTIC_IVF_NPROBE
+    except RuntimeError:
+        pass  # No es un índice IVF
+
+def build_semantic_index(index_dir: str, model_name: str, batch_size: int, index_type: str = settings.SEMANTIC_INDEX_TYPE) -> Dict[str, Any]:
+    """Codifica el catálogo por lotes y guarda en disco el índice FAISS, el mapeo id→medicamento y la metadata.
+
+    Pensado para correr offline (ver build_semantic_index.py): los workers solo cargan el resultado.
+    """
+    catalog = get_catalog()
+    if catalog is None or not len(catalog):
+        raise RuntimeError("No se pudo cargar el catálogo de medicamentos para construir el índice.")
+
+    start_time = time.time()
+    model = SentenceTransformer(model_name)
+    names = [row[1] or "" for row in catalog.rows]
+    embeddings = None
+    for start in range(0, len(names), batch_size):
+        batch = normalize_embeddings(model.encode(names[start:start + batch_size], batch_size=batch_size, convert_to_numpy=True))
+        if embeddings is None:
+            embeddings = np.empty((len(names), batch.shape[1]), dtype=np.float32)
+        embeddings[start:start + len(batch)] = batch
+        logger.info(f"Codificados {min(start + batch_size, len(names))}/{len(names)} medicamentos.")
+
+    # IVF necesita entrenar con todos los vectores antes de agregarlos
+    index = create_index(index_type, embeddings.shape[1], len(embeddings))
+    fill_index(index, embeddings)
+
+    os.makedirs(index_dir, exist_ok=True)
+    # La posición en el índice FAISS es el id: mapping[id] = [codigo, nombre, precio]
+    mapping = [[codigo, nombre, float(precio) if precio is not None else None] for codigo, nombre, precio in catalog.rows]
+    meta = {
+        "catalog_version": catalog.version,
+        "model_name": model_name,
+        "index_type": index_type,
+        "normalized": True,
+        "dimension": index.d,
+        "count": index.ntotal,
+        "built_at": time.time(),
+    }
+    _write_atomic(os.path.join(index_dir, INDEX_FILE), lambda p: faiss.write_index(index, p))
+    _write_atomic(os.path.join(index_dir, MAPPING_FILE), lambda p: _dump_json(mapping, p))
+    _write_atomic(os.path.join(index_dir, META_FILE), lambda p: _dump_json(meta, p))
+    logger.info(f"Índice semántico '{index_type}' con {index.ntotal} medicamentos guardado en '{index_dir}' en {time.time() - start_time:.1f}s.")
+    return meta
+
+def _dump_json(data, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
 class SemanticSearchService:
     """Servicio dedicado para búsquedas semánticas usando embeddings."""
 
-    def __init__(self, model_name: str = 'paraphrase-MiniLM-L3-v2'):
+    def __init__(self, model_name: str = settings.SEMANTIC_MODEL_NAME):
         """La inicialización ahora es rápida, no construye el índice."""
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
         self.index = None
         self.medication_data = []
+        self.meta: Dict[str, Any] = {}
+        self.is_stale = False
 
-    def _build_index(self):
-        """Construye el índice FAISS con los embeddings de los medicamentos."""
-        logger.info("Construyendo índice de búsqueda semántica... (esto puede tardar la primera vez)")
+    def load_index(self, index_dir: str = settings.SEMANTIC_INDEX_DIR) -> bool:
+        """Carga el índice generado por build_semantic_index.py con mmap (sin re-codificar el catálogo).
+
+        Con mmap los vectores quedan en el page cache del SO y se comparten entre workers:
+        las listas invertidas de IVF con cualquier faiss, y los vectores de `flat` y de `hnsw`
+        solo con faiss >= 1.11 (IO_FLAG_MMAP_IFC). El grafo de HNSW se lee siempre a memoria.
+        """
+        meta_path = os.path.join(index_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            logger.error(f"No hay índice semántico en '{index_dir}'. Generarlo con: python build_semantic_index.py")
+            return False
         try:
-            with get_conn() as cn:
-                cur = cn.cursor()
-                cur.execute("SELECT codigo, nombre, precio FROM dbo.medicamentos")
-                self.medication_data = cur.fetchall()
-
-            if not self.medication_data:
-                logger.warning("No se encontraron medicamentos para el índice.")
-                return
-
-            med_names = [med[1] for med in self.medication_data]
-            med_embeddings = self.model.encode(med_names)
-
-            dimension = med_embeddings.shape[1]
-            self.index = faiss.IndexFlatIP(dimension)
-            self.index.add(np.array(med_embeddings))
-            logger.info(f"Índice construido con {len(self.medication_data)} medicamentos.")
+            start_time = time.time()
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(index_dir, MAPPING_FILE), encoding="utf-8") as f:
+                medication_data = [tuple(row) for row in json.load(f)]
+            # IO_FLAG_MMAP_IFC (faiss >= 1.11) mapea también los vectores de los índices planos;
+            # con un faiss anterior esos índices se copian a la memoria de cada worker. Los IVF
+            # no lo admiten (sus listas ya se mapean con IO_FLAG_MMAP y fallan si se combinan)
+            io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            if meta.get("index_type", "flat") in ("flat", "hnsw"):
+                mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+                if not mmap_ifc:
+                    logger.warning(f"faiss {faiss.__version__} no mapea índices '{meta.get('index_type', 'flat')}': cada worker guarda su copia (usar faiss >= 1.11 o un índice IVF).")
+                io_flags |= mmap_ifc
+            index = faiss.read_index(os.path.join(index_dir, INDEX_FILE), io_flags)
         except Exception as e:
-            logger.error(f"Fallo al construir el índice de búsqueda semántica: {e}")
+            logger.error(f"Fallo al cargar el índice de búsqueda semántica desde '{index_dir}': {e}")
+            return False
+
+        if index.ntotal != len(medication_data):
+            logger.error(f"Índice semántico inconsistente: {index.ntotal} vectores y {len(medication_data)} medicamentos.")
+            return False
+        if not meta.get("normalized"):
+            logger.error("El índice semántico se generó sin normalizar los embeddings; regenerarlo con build_semantic_index.py.")
+            return False
+        if meta.get("model_name") != self.model_name:
+            logger.error(f"El índice semántico fue generado con '{meta.get('model_name')}' y el servicio usa '{self.model_name}'.")
+            return False
+
+        apply_search_params(index)
+        self.index, self.medication_data, self.meta = index, medication_data, meta
+        self.is_stale = self._check_stale()
+        logger.info(f"Índice semántico '{meta.get('index_type')}' cargado: {index.ntotal} medicamentos en {(time.time() - start_time) * 1000:.2f}ms.")
+        return True
+
+    def _check_stale(self) -> bool:
+        """True si el catálogo en la BD cambió desde que se generó el índice."""
+        catalog = get_catalog() if settings.CATALOG_SNAPSHOT_ENABLED else None
+        if catalog is None:
+            return False
+        if catalog.version != self.meta.get("catalog_version"):
+            logger.warning(
+                f"Índice semántico desactualizado (catálogo {self.meta.get('catalog_version')}, actual {catalog.version}). "
+                "Regenerarlo con: python build_semantic_index.py"
+            )
+            return True
+        return False
 
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Realiza una búsqueda semántica."""
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Búsqueda semántica de varias consultas con un único `encode` y un único `index.search`.
+
+        Devuelve una lista de resultados por consulta, en el mismo orden.
+        """
+        if not queries:
+            return []
         if not self.index:
             logger.warning("El índice de búsqueda semántica no está disponible.")
-            return []
-        # (El resto del método search se mantiene igual)
+            return [[] for _ in queries]
         try:
-            query_embedding = self.model.encode([query])
-            scores, indices = self.index.search(query_embedding, min(k, len(self.medication_data)))
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx != -1 and score > 0.5:
-                    med = self.medication_data[idx]
-                    parsed = parse_medication_nombre(med[1])
-                    results.append({
-                        "codigo": med[0], "nombre": med[1], "precio": float(med[2]) if med[2] else None,
-                        "score": float(score) * 100,
-                        "specifications": MedicationSpec(**parsed),
-                        "search_method": "semantic"
-                    })
-            return results
+            query_embeddings = normalize_embeddings(
+                self.model.encode(list(queries), batch_size=settings.SEMANTIC_ENCODE_BATCH_SIZE, convert_to_numpy=True)
+            )
+            scores, indices = self.index.search(query_embeddings, min(k, len(self.medication_data)))
+            # Con embeddings normalizados el score es la similitud coseno
+            hits = [[(float(score), self.medication_data[idx]) for score, idx in zip(row_scores, row_indices)
+                     if idx != -1 and score > settings.SEMANTIC_MIN_SIMILARITY]
+                    for row_scores, row_indices in zip(scores, indices)]
+            specs = get_medication_specs_many(med for row_hits in hits for _, med in row_hits)
+            all_results = [
+                [{
+                    "codigo": med[0], "nombre": med[1], "precio": float(med[2]) if med[2] else None,
+                    "score": score * 100,
+                    "specifications": MedicationSpec(**specs[med[0]]),
+                    "search_method": "semantic"
+                } for score, med in row_hits]
+                for row_hits in hits
+            ]
+            return all_results
         except Exception as e:
             logger.error(f"Error en la búsqueda semántica: {e}")
-            return []
+            return [[] for _ in queries]
 
 def get_semantic_search_service():
     """Función para obtener la instancia única del servicio (Singleton)."""
     global _semantic_search_instance
     if _semantic_search_instance is None:
         _semantic_search_instance = SemanticSearchService()
-        _semantic_search_instance._build_index()
-    return _semantic_search_instance
\ No newline at end of file
+        _semantic_search_instance.load_index()
+    return _semantic_search_instance
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from src.config import settings
+from src.db import upsert_auto_synonyms
+
+logger = logging.getLogger(__name__)
+
+class SynonymPromoter:
+    """Escritura diferida (write-behind) de los sinónimos que aprende la IA.
+
+    Los matches se encolan sin bloquear la request y un hilo en segundo plano los
+    guarda en sinonimos_factura por lotes, cada `flush_seconds` o al juntar `batch_size`.
+    """
+
+    def __init__(self, batch_size: int, flush_seconds: float):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.promoted = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="synonym-promoter", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, nombre_factura: str, codigo: str):
+        self._queue.put((nombre_factura, codigo))
+
+    def stop(self, timeout: float = 10.0):
+        """Vacía la cola pendiente y detiene el hilo (se llama al apagar la app)."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _worker(self):
+        pendientes: Dict[str, str] = {}
+        ultimo_flush = time.monotonic()
+        while True:
+            espera = max(self.flush_seconds - (time.monotonic() - ultimo_flush), 0.0)
+            try:
+                entrada = self._queue.get(timeout=espera)
+            except queue.Empty:
+                entrada = ()
+            if entrada is None:
+                self._flush(pendientes)
+                return
+            if entrada:
+                # Si el mismo nombre llega dos veces antes del flush, gana el último código
+                pendientes[entrada[0]] = entrada[1]
+            if len(pendientes) >= self.batch_size or time.monotonic() - ultimo_flush >= self.flush_seconds:
+                self._flush(pendientes)
+                ultimo_flush = time.monotonic()
+
+    def _flush(self, pendientes: Dict[str, str]):
+        if not pendientes:
+            return
+        lote: List[Tuple[str, str]] = list(pendientes.items())
+        pendientes.clear()
+        try:
+            upsert_auto_synonyms(lote)
+            self.promoted += len(lote)
+            logger.info(f"Promovidos {len(lote)} sinónimos aprendidos de la IA a sinonimos_factura.")
+        except Exception as e:
+            self.failed += len(lote)
+            logger.error(f"No se pudieron guardar {len(lote)} sinónimos aprendidos de la IA: {e}")
+
+
+_promoter_instance: Optional[SynonymPromoter] = None
+_promoter_lock = threading.Lock()
+
+def get_synonym_promoter() -> Optional[SynonymPromoter]:
+    """Instancia única por proceso; None si la promoción automática está deshabilitada."""
+    global _promoter_instance
+    if not settings.SYNONYM_PROMOTION_ENABLED:
+        return None
+    with _promoter_lock:
+        if _promoter_instance is None:
+            _promoter_instance = SynonymPromoter(settings.SYNONYM_PROMOTION_BATCH_SIZE, settings.SYNONYM_PROMOTION_FLUSH_SECONDS)
+    return _promoter_instance
+
+def shutdown_synonym_promoter():
+    """Guarda lo que quede en la cola si el promotor llegó a crearse."""
+    if _promoter_instance is not None:
+        _promoter_instance.stop()
@@ -1,6 +1,5 @@
 import re
-import pandas as pd
-from typing import List
+from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,24 +11,29 @@ REPLACEMENTS = {
     r'\bDEST\b': 'DESTILADA', r'\bSOL[\.\s]FISIOL\b': 'SOLUCION FISIOLOGICA',
 }
 
+# Las reglas de REPLACEMENTS reemplazan palabras completas por palabras completas, así que
+# una sola alternativa compilada da el mismo resultado que aplicarlas de a una. La regla de
+# 'SOL.FISIOL' nunca llega a aplicarse (antes '\bSOL\b' ya convirtió 'SOL' en 'SOLUCION'),
+# por eso no está en el patrón combinado.
+_WORD_REPLACEMENTS = {
+    'COMP': 'COMPRIMIDO', 'GTS': 'GOTAS', 'SOL': 'SOLUCION', 'INY': 'INYECTABLE', 'AMP': 'AMPOLLA',
+    'FCO': 'FRASCO', 'CAPS': 'CAPSULA', 'PDA': 'POMADA', 'AG': 'AGUA', 'DEST': 'DESTILADA',
+}
+_WORD_PATTERN = re.compile(r'\b(' + '|'.join(_WORD_REPLACEMENTS) + r')\b')
+_DOSE_PATTERN = re.compile(r'(\d+)\s*(MG|G|ML|UI|MCG|GRS|GR)')
+# Todo tramo de caracteres que no sea A-Z0-9 termina como un único espacio
+_SEPARATOR_PATTERN = re.compile(r'[^A-Z0-9]+')
+_NORMALIZE_CACHE_SIZE = 65_536
+
+def _replace_word(match: re.Match) -> str:
+    return _WORD_REPLACEMENTS[match.group(1)]
+
+@lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def _normalize(desc: str) -> str:
+    normalized_desc = _WORD_PATTERN.sub(_replace_word, desc.upper().strip())
+    normalized_desc = _DOSE_PATTERN.sub(r'\1 \2', normalized_desc)
+    return _SEPARATOR_PATTERN.sub(' ', normalized_desc).strip()
+
 def normalize_description(desc: str) -> str:
     if not isinstance(desc, str): return ""
-    normalized_desc = desc.upper().strip()
-    for pattern, replacement in REPLACEMENTS.items():
-        normalized_desc = re.sub(pattern, replacement, normalized_desc)
-    normalized_desc = re.sub(r'(\d+)\s*(MG|G|ML|UI|MCG|GRS|GR)', r'\1 \2', normalized_desc)
-    normalized_desc = re.sub(r'[^A-Z0-9\s]', ' ', normalized_desc)
-    normalized_desc = re.sub(r'\s+', ' ', normalized_desc).strip()
-    return normalized_desc
-
-def clean_and_deduplicate(items: List[dict]) -> pd.DataFrame:
-    if not items: return pd.DataFrame()
-    df = pd.DataFrame(items)
-    for col in ['cantidad', 'precio_total', 'precio_unitario']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-    df['normalized_desc'] = df['descripción'].apply(normalize_description)
-    agg_rules = {
-        'cantidad': 'sum', 'precio_total': 'sum', 'descripción': 'first',
-        'precio_unitario': 'first', 'fecha': 'first', 'notas': 'first'
-    }
-    return df.groupby('normalized_desc').agg(agg_rules).reset_index()
\ No newline at end of file
+    return _normalize(desc)
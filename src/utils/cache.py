@@ -0,0 +1,105 @@
+import itertools
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Valor centinela para distinguir "no está en caché" de un resultado vacío o None
+MISSING = object()
+
+class TTLCache:
+    """Caché en memoria acotada, con desalojo LRU y vencimiento por TTL.
+
+    Además de la clave, cada caché sigue una `version` (p. ej. la del catálogo en
+    memoria): cuando cambia, todas las entradas se descartan de una vez.
+
+    Cada instancia se registra para cache_stats() con un nombre único: si `name` ya
+    está en uso por otra caché viva, se le agrega un sufijo (#2, #3, ...).
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = _register(name, self)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._version: Optional[Hashable] = None
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync_version(self, version: Optional[Hashable]):
+        if version != self._version:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._version = version
+
+    def get(self, key: Hashable, version: Optional[Hashable] = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            self._sync_version(version)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, version: Optional[Hashable] = None):
+        with self._lock:
+            self._sync_version(version)
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total * 100 if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+# Débil: una caché que ya nadie usa (p. ej. de un SearchEngine descartado) sale del registro
+_registry: "weakref.WeakValueDictionary[str, TTLCache]" = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+def _register(name: str, cache: TTLCache) -> str:
+    with _registry_lock:
+        unique = name
+        for n in itertools.count(2):
+            if unique not in _registry:
+                break
+            unique = f"{name}#{n}"
+        _registry[unique] = cache
+    return unique
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Estadísticas de todas las cachés creadas en el proceso, por nombre."""
+    with _registry_lock:
+        caches = list(_registry.items())
+    return {name: cache.stats() for name, cache in caches}
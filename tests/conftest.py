@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# Settings exige estas variables al importar src.config; los tests no tocan la BD real
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
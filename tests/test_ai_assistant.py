@@ -0,0 +1,69 @@
+import pytest
+from src.services.ai_assistant import AIAssistant
+from src.services.llm_cache import ConciliationCache
+
+ITEM = {"nombre_factura": "IBUPROFENO 400 MG", "cantidad_total": 2,
+        "candidatos_bd": [{"codigo": "1", "nombre": "IBUPROFENO 400 MG X 20", "score": 90},
+                          {"codigo": "2", "nombre": "IBUPROFENO 600 MG X 20", "score": 80}]}
+
+@pytest.fixture
+def assistant(tmp_path):
+    """AIAssistant sin cliente de OpenAI: cada test fija las respuestas del modelo."""
+    assistant = AIAssistant.__new__(AIAssistant)
+    assistant.cache = ConciliationCache(str(tmp_path / "cache.sqlite3"), 3600, 100)
+    assistant.prompts = []
+    return assistant
+
+def _responde(assistant, monkeypatch, *respuestas):
+    pendientes = list(respuestas)
+
+    async def request_json(prompt):
+        assistant.prompts.append(prompt)
+        return pendientes.pop(0)
+
+    monkeypatch.setattr(assistant, "_request_json", request_json)
+
+@pytest.mark.parametrize("codigo, cacheado", [("1", True), (None, True), ("999", False)])
+async def test_conciliate_item_caches_only_candidate_codes(assistant, monkeypatch, codigo, cacheado):
+    _responde(assistant, monkeypatch, {"codigo_bd_conciliado": codigo, "confianza": 90})
+
+    result = await assistant.conciliate_item(dict(ITEM))
+
+    assert result["codigo_bd_conciliado"] == codigo
+    assert (assistant.cache.stats()["entries"] == 1) is cacheado
+
+async def test_cached_answer_skips_the_model(assistant, monkeypatch):
+    _responde(assistant, monkeypatch, {"codigo_bd_conciliado": "1", "confianza": 90})
+    await assistant.conciliate_item(dict(ITEM))
+    result = await assistant.conciliate_item(dict(ITEM))
+
+    assert result == {"codigo_bd_conciliado": "1", "confianza": 90, "nombre_original_factura": "IBUPROFENO 400 MG"}
+    assert len(assistant.prompts) == 1
+
+async def test_batch_retries_invalid_answers_individually(assistant, monkeypatch):
+    otro = {**ITEM, "nombre_factura": "AMOXICILINA 500 MG"}
+    _responde(assistant, monkeypatch,
+              {"resultados": [{"id": "0", "codigo_bd_conciliado": "2", "confianza": 95},
+                              {"id": "1", "codigo_bd_conciliado": "999", "confianza": 95}]},
+              {"codigo_bd_conciliado": None, "confianza": 0})
+
+    results = await assistant.conciliate_batch([dict(ITEM), otro])
+
+    assert [r["codigo_bd_conciliado"] for r in results] == ["2", None]
+    assert [r["nombre_original_factura"] for r in results] == ["IBUPROFENO 400 MG", "AMOXICILINA 500 MG"]
+    assert len(assistant.prompts) == 2  # el lote y el reintento del código ajeno
+
+async def test_batch_falls_back_to_items_when_the_call_fails(assistant, monkeypatch):
+    llamadas = []
+
+    async def request_json(prompt):
+        llamadas.append(prompt)
+        if len(llamadas) == 1:
+            raise ValueError("respuesta inválida")
+        return {"codigo_bd_conciliado": "1", "confianza": 80}
+
+    monkeypatch.setattr(assistant, "_request_json", request_json)
+    results = await assistant.conciliate_batch([dict(ITEM), {**ITEM, "nombre_factura": "OTRO"}])
+
+    assert [r["codigo_bd_conciliado"] for r in results] == ["1", "1"]
+    assert len(llamadas) == 3
@@ -0,0 +1,126 @@
+import asyncio
+import time
+import pytest
+from src.config import settings
+from src.services.audit_jobs import (
+    COMPLETADO, EN_COLA, EN_PROCESO, FALLIDO, AuditJobQueue, InMemoryJobStore, QueueFull, SQLiteJobStore
+)
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+async def _esperar(queue, job_id, estado, timeout=5.0):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        job = await queue.get(job_id)
+        if job["estado"] == estado:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"El trabajo {job_id} no llegó a {estado}: {job['estado']}")
+
+async def test_enqueue_run_and_result(store):
+    async def runner(factura, umbral, on_phase):
+        on_phase("fase1", {"items": len(factura["items"])})
+        on_phase("fase2", {"conciliados": 1})
+        return {"resumen": factura["items"], "umbral": umbral}
+
+    queue = AuditJobQueue(store, runner, max_workers=1, max_queue=10)
+    await queue.start()
+    try:
+        job = await queue.submit({"items": ["a", "b"]}, 5.0)
+        assert job["estado"] == EN_COLA
+        terminado = await _esperar(queue, job["id"], COMPLETADO)
+    finally:
+        await queue.stop()
+
+    assert terminado["resultado"] == {"resumen": ["a", "b"], "umbral": 5.0}
+    assert terminado["fase"] == "completado"  # el progreso no pisa el estado final
+    assert set(terminado["progreso"]) == {"fase1", "fase2"}
+    assert terminado["payload"] is None and terminado["intentos"] == 1
+
+async def test_failure_keeps_payload_and_can_be_retried(store):
+    intentos = []
+
+    async def runner(factura, umbral, on_phase):
+        intentos.append(1)
+        if len(intentos) == 1:
+            raise ValueError("factura rota")
+        return {"ok": True}
+
+    queue = AuditJobQueue(store, runner, max_workers=1, max_queue=10)
+    await queue.start()
+    try:
+        job = await queue.submit({"items": []}, 5.0)
+        fallido = await _esperar(queue, job["id"], FALLIDO)
+        assert fallido["error"] == "ValueError: factura rota"
+        assert fallido["payload"] == {"items": []}
+
+        assert await queue.retry(job["id"])
+        completado = await _esperar(queue, job["id"], COMPLETADO)
+        assert not await queue.retry(job["id"])  # ya no se reintenta
+    finally:
+        await queue.stop()
+    assert completado["intentos"] == 2 and completado["error"] is None
+
+async def test_start_requeues_stale_jobs_only(store, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_JOBS_STALE_SECONDS", 60.0)
+    ahora = time.time()
+    for job_id, actualizado in (("viejo", ahora - 120), ("reciente", ahora)):
+        store.create({"id": job_id, "estado": EN_PROCESO, "fase": "fase2", "progreso": {}, "surcharge_threshold": 5.0,
+                      "payload": {}, "resultado": None, "error": None, "intentos": 1,
+                      "creado": actualizado, "actualizado": actualizado})
+
+    async def runner(factura, umbral, on_phase):
+        return {"ok": True}
+
+    queue = AuditJobQueue(store, runner, max_workers=1, max_queue=10)
+    await queue.start()
+    try:
+        retomado = await _esperar(queue, "viejo", COMPLETADO)
+    finally:
+        await queue.stop()
+    assert retomado["intentos"] == 2
+    assert store.get("reciente")["estado"] == EN_PROCESO  # puede estar corriendo en otro proceso
+
+async def test_stop_requeues_running_jobs(store):
+    empezo = asyncio.Event()
+
+    async def runner(factura, umbral, on_phase):
+        empezo.set()
+        await asyncio.sleep(10)
+
+    queue = AuditJobQueue(store, runner, max_workers=1, max_queue=10)
+    await queue.start()
+    job = await queue.submit({}, 5.0)
+    await asyncio.wait_for(empezo.wait(), 5)
+    await queue.stop()
+    assert store.get(job["id"])["estado"] == EN_COLA
+
+async def test_purge_deletes_only_old_finished_jobs(store, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_JOBS_RETENTION_SECONDS", 3600.0)
+    ahora = time.time()
+    for job_id, estado, actualizado in (("completado", COMPLETADO, ahora - 7200), ("fallido", FALLIDO, ahora - 7200),
+                                        ("en_cola", EN_COLA, ahora - 7200), ("nuevo", COMPLETADO, ahora)):
+        store.create({"id": job_id, "estado": estado, "fase": None, "progreso": {}, "surcharge_threshold": 5.0,
+                      "payload": None, "resultado": None, "error": None, "intentos": 0,
+                      "creado": actualizado, "actualizado": actualizado})
+
+    queue = AuditJobQueue(store, None, max_workers=1, max_queue=10)
+    assert await queue.purge() == 2
+    assert [store.get(j) is not None for j in ("completado", "fallido", "en_cola", "nuevo")] == [False, False, True, True]
+
+async def test_submit_rejects_when_queue_is_full(store):
+    async def runner(factura, umbral, on_phase):
+        await asyncio.sleep(10)
+
+    queue = AuditJobQueue(store, runner, max_workers=0, max_queue=1)
+    await queue.start()
+    try:
+        await queue.submit({}, 5.0)
+        with pytest.raises(QueueFull):
+            await queue.submit({}, 5.0)
+    finally:
+        await queue.stop()
@@ -0,0 +1,87 @@
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src.config import settings
+from src.services import orchestration_service
+
+FACTURA = {"pacientes": [{
+    "informacion_paciente": {"nombre": "Paciente", "numero_afiliado": "1"},
+    "facturas": [{"items": [
+        {"fecha": "2024-01-01", "descripción": d, "cantidad": 1, "precio_unitario": p, "precio_total": p}
+        for d, p in (("IBUPROFENO 400", 20.0), ("AMOXICILINA 500", 5.0), ("GASA", 1.0))
+    ], "resumen": {"monto_total": 26.0}}],
+}]}
+
+@pytest.fixture
+def orchestrator(monkeypatch):
+    """Orquestador del router sin BD ni IA: un match directo, uno aceptado sin IA y uno para la IA."""
+    monkeypatch.setattr(settings, "AUDIT_JOBS_BACKEND", "memory")
+    monkeypatch.setattr(orchestration_service, "load_all_synonyms_from_db", dict)
+    from src.routers import invoices
+    orchestrator = invoices.orchestrator
+
+    async def match_direct_items(items):
+        directos = [{**i, "codigo_bd": "1", "precio_referencia": 10.0} for i in items if i["nombre_factura"].startswith("IBUPROFENO")]
+        return directos, [i for i in items if not i["nombre_factura"].startswith("IBUPROFENO")]
+
+    async def find_fuzzy_candidates(items):
+        return items
+
+    def run_auto_accept_phase(pendientes):
+        return {"conciliados": [{**i, "codigo_bd": "2", "precio_referencia": 5.0} for i in pendientes if i["nombre_factura"].startswith("AMOXICILINA")],
+                "pendientes": [i for i in pendientes if not i["nombre_factura"].startswith("AMOXICILINA")]}
+
+    async def iter_conciliation_phase(pendientes):
+        yield 0, [], pendientes
+
+    monkeypatch.setattr(orchestrator, "match_direct_items", match_direct_items)
+    monkeypatch.setattr(orchestrator, "find_fuzzy_candidates", find_fuzzy_candidates)
+    monkeypatch.setattr(orchestrator, "run_auto_accept_phase", run_auto_accept_phase)
+    monkeypatch.setattr(orchestrator, "iter_conciliation_phase", iter_conciliation_phase)
+
+    return orchestrator
+
+@pytest.fixture
+def client(orchestrator):
+    from src.routers import invoices
+    app = FastAPI()
+    app.include_router(invoices.router)
+    return TestClient(app)
+
+def test_ndjson_emits_each_item_as_it_resolves(client):
+    r = client.post("/invoices/audit/stream", json=FACTURA)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    eventos = [json.loads(linea) for linea in r.text.splitlines()]
+
+    assert [(e["tipo"], e.get("item", {}).get("nombre_factura")) for e in eventos] == [
+        ("inicio", None), ("conciliado", "IBUPROFENO 400"), ("conciliado", "AMOXICILINA 500"),
+        ("no_conciliado", "GASA"), ("resumen", None)]
+    assert eventos[1]["item"]["con_sobreprecio"] is True
+    assert eventos[-1]["metricas"] == {"ahorro_potencial": 10.0, "monto_total_facturado": 26.0, "items_procesados": 3,
+                                       "items_conciliados": 2, "items_con_sobreprecio": 1, "items_no_conciliados": 1}
+
+def test_sse_names_each_event(client):
+    r = client.post("/invoices/audit/stream?format=sse", json=FACTURA)
+    assert r.headers["content-type"].startswith("text/event-stream")
+    bloques = [b for b in r.text.split("\n\n") if b]
+    assert [b.splitlines()[0] for b in bloques] == [
+        "event: inicio", "event: conciliado", "event: conciliado", "event: no_conciliado", "event: resumen"]
+    assert json.loads(bloques[-1].splitlines()[1].removeprefix("data: "))["tipo"] == "resumen"
+
+def test_error_after_headers_is_the_last_event(orchestrator, client, monkeypatch):
+    async def falla(pendientes):
+        raise RuntimeError("IA caída")
+        yield
+
+    monkeypatch.setattr(orchestrator, "iter_conciliation_phase", falla)
+    r = client.post("/invoices/audit/stream", json=FACTURA)
+    assert r.status_code == 200
+    eventos = [json.loads(linea) for linea in r.text.splitlines()]
+    assert [e["tipo"] for e in eventos] == ["inicio", "conciliado", "conciliado", "error"]
+    assert eventos[-1] == {"tipo": "error", "detalle": "Error inesperado."}
+
+def test_invalid_upload_fails_before_the_stream_opens(client):
+    r = client.post("/invoices/audit/upload_invoice/stream", files={"file": ("f.json", b"{roto", "application/json")})
+    assert r.status_code == 400
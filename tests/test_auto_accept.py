@@ -0,0 +1,52 @@
+import pytest
+from src.config import settings
+from src.services.orchestration_service import OrchestrationService
+
+def _service() -> OrchestrationService:
+    # Solo se usa el parser: sin IA ni mapeos de la BD
+    from src.services.medication_parser import MedicationParser
+    service = OrchestrationService.__new__(OrchestrationService)
+    service._parser = MedicationParser()
+    return service
+
+def _candidatos(*filas):
+    return [{"codigo": str(i), "nombre": nombre, "score": score} for i, (nombre, score) in enumerate(filas)]
+
+@pytest.fixture(autouse=True)
+def umbrales(monkeypatch):
+    monkeypatch.setattr(settings, "AUTO_ACCEPT_MIN_SCORE", 95)
+    monkeypatch.setattr(settings, "AUTO_ACCEPT_MIN_MARGIN", 5)
+    monkeypatch.setattr(settings, "AUTO_ACCEPT_MIN_SORT_SCORE", 60)
+
+@pytest.mark.parametrize("nombre_factura, candidatos, esperado", [
+    # Inequívoco: score, margen, dosis/envase iguales y nombres parecidos
+    ("IBUPROFENO 400 MG COMP X 20", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 98), ("IBUPROFENO 600 MG COMPRIMIDOS X 20", 80)), True),
+    ("AMOXICILINA 500 MG", _candidatos(("AMOXICILINA 500 MG CAPSULAS X 16", 100)), True),
+    # Score por debajo del mínimo
+    ("IBUPROFENO 400 MG COMP X 20", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 94)), False),
+    # Margen insuficiente sobre el segundo candidato
+    ("IBUPROFENO 400 MG COMP X 20", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 98), ("IBUPROFENO 400 MG COMPRIMIDOS X 10", 94)), False),
+    # Margen justo en el límite
+    ("IBUPROFENO 400 MG COMP X 20", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 98), ("IBUPROFENO 400 MG COMPRIMIDOS X 10", 93)), True),
+    # Línea sin especificaciones: token_set_ratio da 100 porque el candidato la contiene
+    ("100", _candidatos(("IBUPROFENO JARABE 100 MG/5 ML X 100 ML", 100)), False),
+    ("IBUPROFENO", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 100)), False),
+    # Dosis o envase distintos
+    ("IBUPROFENO 400 MG", _candidatos(("IBUPROFENO 600 MG COMPRIMIDOS X 20", 96)), False),
+    ("IBUPROFENO 400 MG X 10", _candidatos(("IBUPROFENO 400 MG COMPRIMIDOS X 20", 96)), False),
+    # Dosis igual pero el candidato agrega demasiado (marca, forma, envase)
+    ("PARACETAMOL 500 MG", _candidatos(("TAFIROL PARACETAMOL 500 MG COMPRIMIDOS X 20", 100)), False),
+])
+def test_is_unambiguous(nombre_factura, candidatos, esperado):
+    assert _service()._is_unambiguous(nombre_factura, candidatos) is esperado
+
+def test_run_auto_accept_phase_sends_bare_lines_to_the_ai(monkeypatch):
+    monkeypatch.setattr(settings, "AUTO_ACCEPT_ENABLED", True)
+    pendientes = [
+        {"nombre_factura": "100", "candidatos_bd": _candidatos(("IBUPROFENO JARABE 100 MG/5 ML X 100 ML", 100))},
+        {"nombre_factura": "AMOXICILINA 500 MG", "candidatos_bd": _candidatos(("AMOXICILINA 500 MG CAPSULAS X 16", 100))},
+    ]
+    resultado = _service().run_auto_accept_phase(pendientes)
+    assert [c["nombre_factura"] for c in resultado["conciliados"]] == ["AMOXICILINA 500 MG"]
+    assert resultado["conciliados"][0]["metodo_conciliacion"] == "Auto-Fuzzy"
+    assert [p["nombre_factura"] for p in resultado["pendientes"]] == ["100"]
@@ -0,0 +1,26 @@
+import gc
+from src.utils.cache import MISSING, TTLCache, cache_stats
+
+def test_second_cache_with_same_name_gets_its_own_entry():
+    primera = TTLCache("test_nombre", 10, 60)
+    segunda = TTLCache("test_nombre", 10, 60)
+    primera.set("a", 1)
+
+    assert (primera.name, segunda.name) == ("test_nombre", "test_nombre#2")
+    stats = cache_stats()
+    assert stats["test_nombre"]["entries"] == 1
+    assert stats["test_nombre#2"]["entries"] == 0
+
+def test_discarded_cache_leaves_the_registry():
+    cache = TTLCache("test_descartada", 10, 60)
+    assert "test_descartada" in cache_stats()
+    del cache
+    gc.collect()
+    assert "test_descartada" not in cache_stats()
+
+def test_version_change_invalidates_entries():
+    cache = TTLCache("test_version", 10, 60)
+    cache.set("a", 1, version="v1")
+    assert cache.get("a", version="v1") == 1
+    assert cache.get("a", version="v2") is MISSING
+    assert cache.invalidations == 1
@@ -0,0 +1,52 @@
+import time
+from types import SimpleNamespace
+import pytest
+from src.config import settings
+from src.db import catalog
+from src.db.catalog import CatalogSnapshot
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(catalog, "time", SimpleNamespace(monotonic=lambda: reloj.now, time=time.time))
+    monkeypatch.setattr(settings, "CATALOG_RETRY_SECONDS", 30.0)
+    monkeypatch.setattr(catalog, "_snapshot", None)
+    monkeypatch.setattr(catalog, "_failed_at", None)
+    return reloj
+
+@pytest.fixture
+def cargas(monkeypatch):
+    """Carga del catálogo falsa: falla mientras cargas.falla sea True y cuenta los intentos."""
+    cargas = SimpleNamespace(intentos=0, falla=True)
+
+    def load():
+        cargas.intentos += 1
+        if cargas.falla:
+            raise RuntimeError("BD caída")
+        return CatalogSnapshot([("1", None, "IBUPROFENO 400 MG", 10.0)])
+
+    monkeypatch.setattr(catalog, "_load_snapshot", load)
+    return cargas
+
+def test_failed_load_waits_for_cooldown_before_retrying(reloj, cargas):
+    assert catalog.get_catalog() is None
+    assert catalog.get_catalog() is None
+    assert cargas.intentos == 1
+
+    reloj.now += 29
+    assert catalog.get_catalog() is None
+    assert cargas.intentos == 1
+
+    reloj.now += 1
+    cargas.falla = False
+    snapshot = catalog.get_catalog()
+    assert snapshot is not None and len(snapshot) == 1
+    assert cargas.intentos == 2
+    assert catalog.get_catalog() is snapshot
+
+def test_refresh_clears_the_cooldown(reloj, cargas):
+    assert catalog.get_catalog() is None
+    cargas.falla = False
+    snapshot = catalog.refresh_catalog()
+    assert catalog.get_catalog() is snapshot
+    assert cargas.intentos == 2
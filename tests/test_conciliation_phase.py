@@ -0,0 +1,57 @@
+import pytest
+from src.config import settings
+from src.services.orchestration_service import OrchestrationService
+
+def _pendiente(nombre, *codigos):
+    return {"nombre_factura": nombre, "candidatos_bd": [{"codigo": c, "nombre": f"MED {c}", "precio": 1.0, "score": 80} for c in codigos]}
+
+class _Agente:
+    """Reemplaza al AIAssistant: registra cómo se agrupan las llamadas y responde según el ítem."""
+    def __init__(self, respuestas, falla=()):
+        self.respuestas = respuestas
+        self.falla = set(falla)
+        self.llamadas = []
+
+    async def conciliate_item(self, item):
+        self.llamadas.append(("item", [item["nombre_factura"]]))
+        return self._responder(item)
+
+    async def conciliate_batch(self, lote):
+        self.llamadas.append(("lote", [i["nombre_factura"] for i in lote]))
+        if self.falla & {i["nombre_factura"] for i in lote}:
+            raise TimeoutError("la IA no respondió")
+        return [self._responder(i) for i in lote]
+
+    def _responder(self, item):
+        return {"codigo_bd_conciliado": self.respuestas.get(item["nombre_factura"]), "confianza": 90}
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "SYNONYM_PROMOTION_ENABLED", False)
+    service = OrchestrationService.__new__(OrchestrationService)
+    service.mappings = {}
+    return service
+
+async def test_batches_items_and_validates_chosen_codes(service):
+    service.ai_agent = _Agente({"A": "1", "B": "99", "C": "3"})
+    pendientes = [_pendiente("A", "1", "2"), _pendiente("B", "5"), _pendiente("C", "3")]
+
+    resultado = await service.run_conciliation_phase(pendientes)
+
+    # Lotes de LLM_BATCH_SIZE; el último, de un solo ítem, va por la llamada individual
+    assert service.ai_agent.llamadas == [("lote", ["A", "B"]), ("item", ["C"])]
+    assert [(c["nombre_factura"], c["codigo_bd"], c["metodo_conciliacion"]) for c in resultado["conciliados"]] == [
+        ("A", "1", "IA/Fuzzy"), ("C", "3", "IA/Fuzzy")]
+    # "99" no está entre los candidatos de B: no se acepta
+    assert [f["nombre_factura"] for f in resultado["fallidos"]] == ["B"]
+
+async def test_failed_batch_marks_its_items_as_failed(service):
+    service.ai_agent = _Agente({"A": "1", "B": "5", "C": "3"}, falla={"A"})
+    pendientes = [_pendiente("A", "1"), _pendiente("B", "5"), _pendiente("C", "3")]
+
+    resultado = await service.run_conciliation_phase(pendientes)
+
+    assert [c["nombre_factura"] for c in resultado["conciliados"]] == ["C"]
+    assert [(f["nombre_factura"], f["error_conciliacion"]) for f in resultado["fallidos"]] == [
+        ("A", "TimeoutError"), ("B", "TimeoutError")]
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+import src.db
+from src.config import settings
+from src.db import aio
+
+FILAS = [("1", "T1", "IBUPROFENO 400 MG", 10.0), ("2", None, "Amoxicilina 500 MG", 20.0),
+         ("3", "1", "OTRO CON TROQUEL 1", 30.0)]
+
+@pytest.fixture(params=["sync", "async"])
+def db(request, tmp_path, monkeypatch):
+    """Tabla medicamentos en SQLite, sin catálogo en memoria; con y sin engine async."""
+    url = f"sqlite:///{tmp_path / 'medicamentos.db'}"
+    engine = create_engine(url)
+    with engine.begin() as cn:
+        cn.execute(text("CREATE TABLE medicamentos (codigo TEXT, troquel TEXT, nombre TEXT, precio REAL)"))
+        cn.execute(text("INSERT INTO medicamentos VALUES (:c, :t, :n, :p)"),
+                   [{"c": c, "t": t, "n": n, "p": p} for c, t, n, p in FILAS])
+
+    consultas = []
+    monkeypatch.setattr(settings, "CATALOG_SNAPSHOT_ENABLED", False)
+    monkeypatch.setattr(src.db, "get_conn", lambda: consultas.append(1) or engine.connect())
+    async_engine = create_async_engine(url.replace("sqlite", "sqlite+aiosqlite")) if request.param == "async" else None
+    monkeypatch.setattr(aio, "get_async_engine", lambda: async_engine)
+    yield consultas
+    engine.dispose()
+
+async def test_get_by_codigo_many_async_prefers_codigo_over_troquel(db):
+    resultado = await aio.get_by_codigo_many_async(["1", "T1", "2", "9", "", "1"])
+    assert resultado == {"1": ("1", "IBUPROFENO 400 MG", 10.0), "T1": ("1", "IBUPROFENO 400 MG", 10.0),
+                         "2": ("2", "Amoxicilina 500 MG", 20.0)}
+    assert resultado == src.db.get_by_codigo_many(["1", "T1", "2", "9", "", "1"])
+
+async def test_get_by_exact_name_many_async_ignores_case(db):
+    resultado = await aio.get_by_exact_name_many_async(["ibuprofeno 400 mg", "AMOXICILINA 500 MG", "NADA"])
+    assert set(resultado) == {"ibuprofeno 400 mg", "AMOXICILINA 500 MG"}
+    assert resultado["AMOXICILINA 500 MG"][0] == "2"
+
+async def test_empty_input_skips_the_db(db):
+    assert await aio.get_by_codigo_many_async([]) == {}
+    assert await aio.get_by_exact_name_many_async(["", None]) == {}
+    assert db == []
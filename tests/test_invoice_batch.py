@@ -0,0 +1,104 @@
+import io
+import json
+import zipfile
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src.config import settings
+from src.services import orchestration_service
+
+def _factura(*items):
+    """Factura con un paciente y una factura; cada ítem es (descripción, cantidad, precio_unitario)."""
+    return {"pacientes": [{
+        "informacion_paciente": {"nombre": "Paciente", "numero_afiliado": "1"},
+        "facturas": [{
+            "items": [
+                {"fecha": "2024-01-01", "descripción": d, "cantidad": c, "precio_unitario": p, "precio_total": c * p}
+                for d, c, p in items
+            ],
+            "resumen": {"monto_total": sum(c * p for _, c, p in items)},
+        }],
+    }]}
+
+@pytest.fixture
+def invoices(monkeypatch):
+    """Router de facturas sin BD: sin sinónimos, cola en memoria y fases 2 y 3 simuladas."""
+    monkeypatch.setattr(settings, "AUDIT_JOBS_BACKEND", "memory")
+    monkeypatch.setattr(orchestration_service, "load_all_synonyms_from_db", dict)
+    from src.routers import invoices
+
+    resueltos = []
+
+    async def resolve_items(items, on_phase=invoices._no_phase):
+        resueltos.append([i["nombre_factura"] for i in items])
+        conciliados = [{**i, "codigo_bd": "1", "precio_referencia": 10.0} for i in items if "IBUPROFENO" in i["nombre_factura"]]
+        # Las descripciones "PERDIDO" no vuelven de las fases 2 y 3
+        fallidos = [i for i in items if "IBUPROFENO" not in i["nombre_factura"] and "PERDIDO" not in i["nombre_factura"]]
+        return conciliados, fallidos
+
+    monkeypatch.setattr(invoices, "_resolve_items", resolve_items)
+    monkeypatch.setattr(invoices, "resueltos", resueltos, raising=False)
+    return invoices
+
+@pytest.fixture
+def client(invoices):
+    app = FastAPI()
+    app.include_router(invoices.router)
+    return TestClient(app)
+
+def _json(data) -> bytes:
+    return json.dumps(data).encode()
+
+def test_lote_de_archivos_resuelve_cada_descripcion_una_vez(invoices, client):
+    a = _factura(("IBUPROFENO 400", 2, 12.0), ("GASA", 1, 5.0))
+    b = _factura(("Ibuprofeno 400", 1, 10.0))
+    r = client.post("/invoices/audit/batch/upload", files=[
+        ("files", ("a.json", _json(a), "application/json")),
+        ("files", ("b.json", _json(b), "application/json")),
+        ("files", ("roto.json", b"{no es json", "application/json")),
+    ])
+    assert r.status_code == 200
+    body = r.json()
+    assert body["metricas_lote"] == {"facturas_recibidas": 3, "facturas_auditadas": 2, "items_procesados": 3, "descripciones_distintas": 2}
+    assert len(invoices.resueltos) == 1 and len(invoices.resueltos[0]) == 2
+
+    fa, fb, roto = body["facturas"]
+    assert fa["resumen"]["metricas"]["items_conciliados"] == 1
+    assert fa["resumen"]["metricas"]["items_no_conciliados"] == 1
+    assert fb["resumen"]["items_conciliados"][0]["monto_sobreprecio"] == 0.0
+    assert roto == {"archivo": "roto.json", "error": "El archivo no es un JSON válido."}
+
+def test_lote_zip(client):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("enero/a.json", _json(_factura(("IBUPROFENO 400", 1, 10.0))))
+        zf.writestr("enero/b.json", _json({"pacientes": "no"}))
+        zf.writestr("leame.txt", "se ignora")
+        zf.writestr("__MACOSX/enero/._a.json", "se ignora")
+    r = client.post("/invoices/audit/batch/upload", files=[
+        ("files", ("lote.zip", buffer.getvalue(), "application/zip")),
+        ("files", ("falso.zip", b"no es zip", "application/zip")),
+    ])
+    assert r.status_code == 200
+    facturas = r.json()["facturas"]
+    assert [f["archivo"] for f in facturas] == ["lote.zip/enero/a.json", "lote.zip/enero/b.json", "falso.zip"]
+    assert facturas[0]["resumen"]["metricas"]["items_conciliados"] == 1
+    assert facturas[1]["error"] == "La factura no tiene el formato esperado."
+    assert facturas[2]["error"] == "El archivo no es un ZIP válido."
+
+def test_lote_zip_supera_maximo(client, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_MAX_INVOICES", 1)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for nombre in ("a.json", "b.json"):
+            zf.writestr(nombre, _json(_factura(("GASA", 1, 5.0))))
+    r = client.post("/invoices/audit/batch/upload", files=[("files", ("lote.zip", buffer.getvalue(), "application/zip"))])
+    assert r.status_code == 413
+
+def test_descripcion_sin_resolucion_queda_no_conciliada(client):
+    r = client.post("/invoices/audit/batch", json=[_factura(("PERDIDO", 1, 5.0), ("IBUPROFENO 400", 1, 10.0))])
+    assert r.status_code == 200
+    resumen = r.json()["facturas"][0]["resumen"]
+    assert resumen["metricas"]["items_conciliados"] == 1
+    assert resumen["items_no_conciliados"][0]["nombre_factura"] == "PERDIDO"
+    assert resumen["items_no_conciliados"][0]["error_conciliacion"] == "sin_resolucion"
@@ -0,0 +1,118 @@
+import io
+import json
+import logging
+import re
+import sys
+import pandas as pd
+import pytest
+from pydantic import ValidationError
+from src.models import InvoiceInput
+from src.services.cleaning import InvoiceProcessor
+from src.utils import REPLACEMENTS
+from src.services.invoice_stream import InvalidInvoiceJSON, iter_invoice_items, stream_invoice_items
+
+def _item(descripcion, cantidad, precio, notas=None, fecha="2024-01-01"):
+    item = {"fecha": fecha, "descripción": descripcion, "cantidad": cantidad,
+            "precio_unitario": precio, "precio_total": round(cantidad * precio, 2)}
+    if notas is not None:
+        item["notas"] = notas
+    return item
+
+def _paciente(afiliado, *facturas):
+    return {"informacion_paciente": {"nombre": "Paciente", "numero_afiliado": afiliado},
+            "facturas": [{"items": items, "resumen": {"monto_total": None}} for items in facturas]}
+
+FACTURA = {"pacientes": [
+    _paciente("1",
+              [_item("IBUPROFENO 400MG COMP", 2, 10.5), _item("Agua dest. x 10 ml", 1, 3.0, notas="urgente")],
+              [_item("ibuprofeno 400 mg comp.", 3, 11.0, fecha="2024-01-02", notas="control")]),
+    _paciente("2",
+              [_item("AG DEST X 10 ML", 4, 3.0), _item("AMOXICILINA 500 MG", 1, 25.0)]),
+]}
+
+def _legacy_normalize_description(desc: str) -> str:
+    """normalize_description anterior: los re.sub de REPLACEMENTS sin compilar, en orden."""
+    if not isinstance(desc, str): return ""
+    normalized_desc = desc.upper().strip()
+    for pattern, replacement in REPLACEMENTS.items():
+        normalized_desc = re.sub(pattern, replacement, normalized_desc)
+    normalized_desc = re.sub(r'(\d+)\s*(MG|G|ML|UI|MCG|GRS|GR)', r'\1 \2', normalized_desc)
+    normalized_desc = re.sub(r'[^A-Z0-9\s]', ' ', normalized_desc)
+    return re.sub(r'\s+', ' ', normalized_desc).strip()
+
+def _legacy_aggregate(items: list) -> list:
+    """Agregación anterior de la Fase 1 (DataFrame + groupby), como referencia de resultados."""
+    df = pd.DataFrame(items)
+    for col in ['cantidad', 'precio_total', 'precio_unitario']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df['normalized_desc'] = df['descripción'].apply(_legacy_normalize_description)
+    agg_rules = {
+        'cantidad': 'sum', 'precio_total': 'sum', 'descripción': 'first',
+        'precio_unitario': 'first', 'fecha': 'first', 'notas': 'first'
+    }
+    return df.groupby('normalized_desc').agg(agg_rules).reset_index().to_dict('records')
+
+@pytest.fixture(params=["ijson", "json"])
+def backend(request, monkeypatch):
+    """Corre cada test con ijson y con el respaldo de json.load (ijson no instalado)."""
+    if request.param == "ijson":
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setitem(sys.modules, "ijson", None)
+    return request.param
+
+def _stream(data) -> list:
+    raw = data if isinstance(data, bytes) else json.dumps(data).encode()
+    return list(stream_invoice_items(io.BytesIO(raw)))
+
+def test_streams_every_item_in_document_order(backend):
+    items = _stream(FACTURA)
+    assert items == list(iter_invoice_items(InvoiceInput.model_validate(FACTURA)))
+    assert [i.descripción for i in items][:3] == ["IBUPROFENO 400MG COMP", "Agua dest. x 10 ml", "ibuprofeno 400 mg comp."]
+
+def test_aggregation_matches_previous_groupby(backend):
+    unique_items, _ = InvoiceProcessor().process_items(_stream(FACTURA))
+    esperado = _legacy_aggregate([i.model_dump() for i in iter_invoice_items(InvoiceInput.model_validate(FACTURA))])
+
+    def comparable(rows):
+        return [(r["normalized_desc"], int(r["cantidad"]), round(float(r["precio_total"]), 6), r["descripción"],
+                 float(r["precio_unitario"]), r["fecha"], r["notas"] if isinstance(r["notas"], str) else None)
+                for r in rows]
+
+    assert comparable(unique_items) == comparable(esperado)
+    por_desc = {r["normalized_desc"]: r for r in unique_items}
+    assert por_desc["IBUPROFENO 400 MG COMPRIMIDO"]["cantidad"] == 5
+    assert por_desc["IBUPROFENO 400 MG COMPRIMIDO"]["notas"] == "control"
+    assert por_desc["AGUA DESTILADA X 10 ML"]["precio_total"] == pytest.approx(15.0)
+
+@pytest.mark.parametrize("raw", [b"{bad", b'{"pacientes": [', b"", b'{"pacientes": "\xff"}'])
+def test_malformed_json_raises_invalid_invoice_json(backend, raw):
+    # El router responde 400 ante InvalidInvoiceJSON
+    with pytest.raises(InvalidInvoiceJSON):
+        _stream(raw)
+
+@pytest.mark.parametrize("data", [
+    [1],
+    {"facturas": []},
+    {"pacientes": {"item": 1}},
+    {"pacientes": [{"facturas": []}]},
+    {"pacientes": [_paciente("1", [])] + [{"informacion_paciente": {"nombre": "x"}, "facturas": []}]},
+    {"pacientes": [_paciente("1", ["no es un item"])]},
+    {"pacientes": [_paciente("1", [{**_item("IBUPROFENO", 1, 1.0), "cantidad": "muchos"}])]},
+    {"pacientes": [{"informacion_paciente": {"nombre": "x", "numero_afiliado": "1"}, "facturas": [{"items": []}]}]},
+])
+def test_schema_errors_raise_validation_error(backend, data):
+    with pytest.raises(ValidationError):
+        _stream(data)
+
+def test_empty_invoice(backend):
+    assert _stream({"pacientes": []}) == []
+    assert InvoiceProcessor().process_items([])[0] == []
+
+def test_without_ijson_reads_whole_file_with_json(monkeypatch, caplog):
+    # Respaldo explícito: corre aunque ijson no esté instalado en el entorno de CI
+    monkeypatch.setitem(sys.modules, "ijson", None)
+    with caplog.at_level(logging.WARNING, logger="src.services.invoice_stream"):
+        items = _stream(FACTURA)
+    assert items == list(iter_invoice_items(InvoiceInput.model_validate(FACTURA)))
+    assert "ijson no está instalado" in caplog.text
@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+import pytest
+from src.services import llm_cache
+from src.services.llm_cache import ConciliationCache, quantity_bucket
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj manual para la caché: reloj.now avanza solo cuando el test lo mueve."""
+    reloj = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: reloj.now))
+    return reloj
+
+@pytest.fixture
+def make_cache(tmp_path, reloj):
+    def make(ttl_seconds=3600, max_entries=100, namespace=""):
+        return ConciliationCache(str(tmp_path / "llm_cache.sqlite3"), ttl_seconds, max_entries, namespace=namespace)
+    return make
+
+@pytest.mark.parametrize("cantidad, esperado", [
+    (1, 1), (7, 7), (30, 30),           # hasta 30 se usa tal cual
+    (31, 16), (32, 32), (63, 32), (64, 64), (100, 64), (1000, 512),
+    ("20", 20), ("20.7", 20), (3.9, 3),  # texto y decimales se truncan
+    (None, 1), ("muchos", 1), ("", 1),   # lo que no es número cae en 1
+])
+def test_quantity_bucket(cantidad, esperado):
+    assert quantity_bucket(cantidad) == esperado
+
+def test_build_key_normalizes_and_ignores_candidate_order(make_cache):
+    cache = make_cache()
+    clave = cache.build_key("Ibuprofeno 400mg comp.", ["2", "1"], 40)
+    assert clave == cache.build_key("IBUPROFENO 400 MG COMP", ["1", "2"], 50)  # mismo bucket (32)
+    assert clave != cache.build_key("IBUPROFENO 400 MG COMP", ["1", "2"], 64)
+    assert clave != cache.build_key("IBUPROFENO 400 MG COMP", ["1", "3"], 40)
+    assert clave != make_cache(namespace="gpt-4o").build_key("IBUPROFENO 400 MG COMP", ["1", "2"], 40)
+
+def test_hits_and_misses(make_cache):
+    cache = make_cache()
+    assert cache.get("a") is None
+    cache.set("a", {"codigo_bd_conciliado": "1", "confianza": 90})
+    assert cache.get("a") == {"codigo_bd_conciliado": "1", "confianza": 90}
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 1)
+    assert stats["hit_rate"] == pytest.approx(50.0)
+
+def test_entries_expire_after_ttl(make_cache, reloj):
+    cache = make_cache(ttl_seconds=60)
+    cache.set("a", {"confianza": 90})
+
+    reloj.now += 60
+    assert cache.get("a") is not None  # justo en el límite todavía vale
+    reloj.now += 1
+    assert cache.get("a") is None
+    # La entrada vencida se borra al leerla
+    assert cache.stats()["entries"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_eviction_discards_least_recently_used(make_cache, reloj):
+    cache = make_cache(max_entries=2)
+    cache.set("a", {"n": 1})
+    reloj.now += 1
+    cache.set("b", {"n": 2})
+    reloj.now += 1
+    cache.get("a")  # "a" pasa a ser la más reciente
+    reloj.now += 1
+    cache.set("c", {"n": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1} and cache.get("c") == {"n": 3}
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+def test_set_replaces_existing_entry_without_evicting(make_cache):
+    cache = make_cache(max_entries=1)
+    cache.set("a", {"n": 1})
+    cache.set("a", {"n": 2})
+    assert cache.get("a") == {"n": 2}
+    assert cache.evictions == 0
+
+def test_entries_persist_across_instances(make_cache):
+    make_cache().set("a", {"n": 1})
+    assert make_cache().get("a") == {"n": 1}
+
+def test_hits_batch_last_use_writes(make_cache, reloj, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_TOUCH_FLUSH_EVERY", 3)
+    cache = make_cache()
+    for clave in "abc":
+        cache.set(clave, {"n": 1})
+    ultimos_usos = lambda: [r[0] for r in cache._conn.execute("SELECT ultimo_uso FROM conciliaciones ORDER BY clave")]
+    creado = reloj.now
+
+    reloj.now += 1
+    cache.get("a")
+    cache.get("b")
+    assert ultimos_usos() == [creado] * 3  # todavía en memoria
+
+    cache.get("c")
+    assert ultimos_usos() == [reloj.now] * 3
+
+def test_last_use_is_flushed_after_interval(make_cache, reloj):
+    cache = make_cache()
+    cache.set("a", {"n": 1})
+    reloj.now += llm_cache._TOUCH_FLUSH_SECONDS
+    cache.get("a")
+    assert cache._conn.execute("SELECT ultimo_uso FROM conciliaciones").fetchone()[0] == reloj.now
+
+def test_set_counts_table_only_when_over_capacity(make_cache, monkeypatch):
+    cache = make_cache(max_entries=3)
+    conteos = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda: conteos.append(1) or evict())
+    for clave in "abc":
+        cache.set(clave, {"n": 1})
+    assert conteos == []
+    cache.set("d", {"n": 1})
+    assert conteos == [1] and cache.stats()["entries"] == 3
+
+async def test_async_wrappers(make_cache):
+    cache = make_cache()
+    await cache.set_async("a", {"n": 1})
+    assert await cache.get_async("a") == {"n": 1}
+    assert await cache.get_async("b") is None
@@ -0,0 +1,96 @@
+import asyncio
+import httpx
+import pytest
+from openai import AsyncOpenAI
+import fake_openai_server
+from src.services.llm_scheduler import DeadlineExceeded, LLMScheduler, current_deadline
+
+PROMPT = '### Entrada:\n{"lista_de_candidatos": [{"codigo": "1", "score": 90}]}\n### Salida Esperada:'
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Servidor falso de OpenAI servido en proceso (sin red) con las estadísticas en cero."""
+    for clave in fake_openai_server.stats:
+        monkeypatch.setitem(fake_openai_server.stats, clave, 0)
+    monkeypatch.setattr(fake_openai_server, "LATENCY_MS", 0.0)
+    monkeypatch.setattr(fake_openai_server, "RATE_429", 0.0)
+    monkeypatch.setattr(fake_openai_server, "RATE_500", 0.0)
+    return fake_openai_server
+
+@pytest.fixture
+async def client():
+    transport = httpx.ASGITransport(app=fake_openai_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://fake-openai") as http_client:
+        yield AsyncOpenAI(api_key="fake", base_url="http://fake-openai/v1", max_retries=0, http_client=http_client)
+
+def _scheduler(**overrides) -> LLMScheduler:
+    params = dict(max_in_flight=4, requests_per_minute=0, tokens_per_minute=0, call_timeout=5.0,
+                  max_retries=3, retry_base_delay=0.01, retry_max_delay=0.05)
+    params.update(overrides)
+    return LLMScheduler(**params)
+
+def _call(client):
+    return lambda: client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": PROMPT}])
+
+def _dados(monkeypatch, *valores):
+    """Fija la secuencia de random.random() del servidor falso (decide 429/500/éxito)."""
+    secuencia = iter(valores)
+    monkeypatch.setattr(fake_openai_server.random, "random", lambda: next(secuencia))
+
+async def test_retries_429_and_500_until_success(fake_server, client, monkeypatch):
+    fake_server.RATE_429, fake_server.RATE_500 = 0.5, 0.3
+    _dados(monkeypatch, 0.0, 0.6, 0.9)  # 429, 500, éxito
+
+    response = await _scheduler().run(_call(client))
+
+    assert response.choices[0].message.content == '{"codigo_bd_conciliado": "1", "confianza": 90}'
+    assert fake_server.stats["requests"] == 3
+    assert (fake_server.stats["errors_429"], fake_server.stats["errors_500"]) == (1, 1)
+
+async def test_gives_up_after_max_retries(fake_server, client):
+    fake_server.RATE_500 = 1.0
+
+    with pytest.raises(Exception) as error:
+        await _scheduler(max_retries=2).run(_call(client))
+
+    assert getattr(error.value, "status_code", None) == 500
+    assert fake_server.stats["requests"] == 3
+
+async def test_deadline_cuts_in_flight_call(fake_server, client):
+    fake_server.LATENCY_MS = 2000
+    loop = asyncio.get_running_loop()
+    current_deadline.set(loop.time() + 0.2)
+
+    inicio = loop.time()
+    with pytest.raises((DeadlineExceeded, asyncio.TimeoutError)):
+        await _scheduler().run(_call(client))
+
+    assert loop.time() - inicio < 1.0
+    assert fake_server.stats["requests"] == 1
+
+async def test_deadline_cuts_wait_for_a_slot(fake_server, client):
+    fake_server.LATENCY_MS = 1000
+    scheduler = _scheduler(max_in_flight=1)
+    # La primera llamada (sin deadline) ocupa el único lugar durante 1s
+    ocupante = asyncio.ensure_future(scheduler.run(_call(client)))
+    await asyncio.sleep(0.05)
+    loop = asyncio.get_running_loop()
+    current_deadline.set(loop.time() + 0.2)
+
+    inicio = loop.time()
+    with pytest.raises(DeadlineExceeded):
+        await scheduler.run(_call(client))
+
+    assert loop.time() - inicio < 0.5
+    assert fake_server.stats["requests"] == 1
+    await ocupante
+
+@pytest.mark.parametrize("max_in_flight, esperado", [(3, 3), (1, 1), (0, 10)])
+async def test_concurrency_cap(fake_server, client, max_in_flight, esperado):
+    fake_server.LATENCY_MS = 50
+    scheduler = _scheduler(max_in_flight=max_in_flight)
+
+    await asyncio.gather(*(scheduler.run(_call(client)) for _ in range(10)))
+
+    assert fake_server.stats["requests"] == 10
+    assert fake_server.stats["max_in_flight"] == esperado
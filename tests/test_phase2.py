@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.config import settings
+from src.services import orchestration_service
+from src.services.orchestration_service import OrchestrationService
+
+@pytest.fixture
+def service(monkeypatch):
+    """OrchestrationService sin BD: búsquedas fijas y un scoring lento que registra la concurrencia."""
+    monkeypatch.setattr(settings, "SPEC_FILTER_ENABLED", False)
+    filas = [("1", "IBUPROFENO 400 MG X 20", 10.0), ("2", "IBUPROFENO 600 MG X 20", 12.0)]
+
+    async def search_fuzzy_many_async(nombres, k):
+        return {nombre: filas for nombre in nombres}
+
+    estado = {"activos": 0, "maximo": 0}
+    lock = threading.Lock()
+    score = orchestration_service.score_invoice_candidates
+
+    def score_lento(nombres, filas_por_item):
+        with lock:
+            estado["activos"] += 1
+            estado["maximo"] = max(estado["maximo"], estado["activos"])
+        time.sleep(0.05)
+        with lock:
+            estado["activos"] -= 1
+        return score(nombres, filas_por_item)
+
+    monkeypatch.setattr(orchestration_service, "search_fuzzy_many_async", search_fuzzy_many_async)
+    monkeypatch.setattr(orchestration_service, "score_invoice_candidates", score_lento)
+
+    def make(threads):
+        service = OrchestrationService.__new__(OrchestrationService)
+        service._executor = ThreadPoolExecutor(max_workers=threads)
+        service.estado = estado
+        return service
+    return make
+
+@pytest.mark.parametrize("threads", [1, 3])
+async def test_scoring_threads_bound_concurrent_audits(service, threads):
+    service = service(threads)
+    items = [{"nombre_factura": "IBUPROFENO 400MG"}, {"nombre_factura": "IBUPROFENO 600MG"}]
+
+    resultados = await asyncio.gather(*(service.find_fuzzy_candidates(items) for _ in range(5)))
+
+    assert service.estado["maximo"] == threads
+    for pendientes in resultados:
+        assert [p["nombre_factura"] for p in pendientes] == ["IBUPROFENO 400MG", "IBUPROFENO 600MG"]
+        assert pendientes[0]["candidatos_bd"][0]["codigo"] == "1"
+
+async def test_direct_matches_use_one_lookup_per_kind(monkeypatch):
+    catalogo = {"10": ("10", "IBUPROFENO 400 MG X 20", 10.0), "20": ("20", "AGUA DESTILADA X 10 ML", 3.0)}
+    llamadas = []
+
+    async def por_codigo(codigos):
+        codigos = list(codigos)
+        llamadas.append(("codigo", codigos))
+        return {c: catalogo[c] for c in codigos if c in catalogo}
+
+    async def por_nombre(nombres):
+        nombres = list(nombres)
+        llamadas.append(("nombre", nombres))
+        return {"Agua destilada x 10 ml": catalogo["20"]} if "Agua destilada x 10 ml" in nombres else {}
+
+    monkeypatch.setattr(orchestration_service, "get_by_codigo_many_async", por_codigo)
+    monkeypatch.setattr(orchestration_service, "get_by_exact_name_many_async", por_nombre)
+    service = OrchestrationService.__new__(OrchestrationService)
+    # Los mapeos se guardan normalizados; "viejo" apunta a un código que ya no está en el catálogo
+    service.mappings = {"IBUPROFENO 400 MG COMPRIMIDO": {"codigo": "10", "metodo": "Manual"},
+                        "Agua destilada x 10 ml": {"codigo": "99", "metodo": "IA-Auto"}}
+    items = [{"nombre_factura": n} for n in ("Ibuprofeno 400mg comp", "Agua destilada x 10 ml", "GASA")]
+
+    conciliados, sin_match = await service.match_direct_items(items)
+
+    assert [(c["nombre_factura"], c["codigo_bd"], c["metodo_conciliacion"]) for c in conciliados] == [
+        ("Ibuprofeno 400mg comp", "10", "Manual"), ("Agua destilada x 10 ml", "20", "Exacto")]
+    assert [i["nombre_factura"] for i in sin_match] == ["GASA"]
+    # Una búsqueda por código y una por nombre para toda la factura
+    assert llamadas == [("codigo", ["10", "99"]), ("nombre", ["Agua destilada x 10 ml", "GASA"])]
@@ -0,0 +1,28 @@
+from thefuzz import fuzz
+from src.services.scoring import MIN_CANDIDATE_SCORE, score_invoice_candidates
+
+FILAS = [("1", "IBUPROFENO 400 MG X 20 COMP", 10.0), ("2", "IBUPROFENO 600 MG X 20 COMP", None),
+         ("3", "AMOXICILINA 500 MG X 16 CAPS", 25.5), ("4", "Agua destilada x 10 ml", 3.0), ("5", None, 1.0)]
+
+def _referencia(nombre, filas):
+    """Scoring anterior: thefuzz fila por fila, sobre el umbral y ordenado por score (estable)."""
+    puntuados = [(fuzz.token_set_ratio(nombre, fila[1] or ""), fila) for fila in filas]
+    puntuados = [(score, fila) for score, fila in puntuados if score > MIN_CANDIDATE_SCORE]
+    return [(score, codigo) for score, (codigo, _, _) in sorted(puntuados, key=lambda p: p[0], reverse=True)]
+
+def test_vectorized_scores_match_thefuzz_per_item():
+    nombres = ["ibuprofeno 400mg comp x20", "AMOXICILINA 500", "agua dest 10ml", "sin candidatos"]
+    filas_por_item = [FILAS, FILAS[2:], FILAS, []]
+
+    resultado = score_invoice_candidates(nombres, filas_por_item)
+
+    assert len(resultado) == len(nombres)
+    for nombre, filas, puntuados in zip(nombres, filas_por_item, resultado):
+        assert [(score, cand["codigo"]) for score, cand in puntuados] == _referencia(nombre, filas)
+    assert resultado[3] == []
+    # El precio nulo del catálogo llega como 0.0
+    assert {c["codigo"]: c["precio"] for _, c in resultado[0]}["2"] == 0.0
+
+def test_no_pairs():
+    assert score_invoice_candidates([], []) == []
+    assert score_invoice_candidates(["a", "b"], [[], None]) == [[], []]
@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from src.config import settings
+from src.services import search_engine
+from src.services.search_engine import SearchEngine
+
+def _r(codigo, score, metodo):
+    return {"codigo": codigo, "nombre": codigo, "score": score, "search_method": metodo}
+
+@pytest.fixture
+def engine(monkeypatch):
+    """SearchEngine sin base de datos: cada método devuelve resultados fijos."""
+    monkeypatch.setattr(settings, "SEARCH_CACHE_ENABLED", False)
+    monkeypatch.setattr(search_engine, "catalog_version", lambda: None)
+    engine = SearchEngine()
+    async def exact(queries):
+        return [[] for _ in queries]
+
+    monkeypatch.setattr(engine, "_search_exact_code_many", exact)
+
+    async def fuzzy(queries, k):
+        return [[_r("F1", 0.62, "fuzzy")] for _ in queries]
+
+    async def components(queries, k):
+        return [[_r("C1", 0.95, "component"), _r("F1", 0.90, "component"), _r("C2", 0.80, "component")]
+                for _ in queries]
+
+    async def semantic(queries, k):
+        return [[_r("S1", 0.99, "semantic")] for _ in queries]
+
+    monkeypatch.setattr(engine, "_search_fuzzy_many", fuzzy)
+    monkeypatch.setattr(engine, "_search_components_many", components)
+    monkeypatch.setattr(engine, "_search_semantic_many", semantic)
+    return engine
+
+async def test_sequential_sorts_every_method_before_cutting_to_k(engine):
+    resultados = await engine.search_medication("IBUPROFENO 400", k=2, threshold=0.5, mode="sequential")
+    # Los mejores resultados de un método posterior desplazan a los peores del anterior
+    assert [r["codigo"] for r in resultados] == ["C1", "C2"]
+
+async def test_sequential_keeps_first_method_for_repeated_codes(engine):
+    resultados = await engine.search_medication("IBUPROFENO 400", k=5, threshold=0.5, mode="sequential")
+    assert [(r["codigo"], r["search_method"]) for r in resultados] == [
+        ("S1", "semantic"), ("C1", "component"), ("C2", "component"), ("F1", "fuzzy")]
+
+async def test_sequential_stops_once_k_results_are_found(engine):
+    resultados = await engine.search_medication("IBUPROFENO 400", k=1, threshold=0.5, mode="sequential")
+    assert [r["codigo"] for r in resultados] == ["F1"]
+
+def test_top_k_sorts_by_score():
+    resultados = [_r("A", 0.6, "fuzzy"), _r("B", 0.9, "fuzzy"), _r("C", 0.6, "fuzzy"), _r("D", 0.7, "fuzzy")]
+    assert [r["codigo"] for r in search_engine._top_k(resultados, 3)] == ["B", "D", "A"]
+
+async def test_no_cache_without_catalog_version(engine, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_CACHE_ENABLED", True)
+    await engine.search_medication("IBUPROFENO 400", k=1, threshold=0.5, mode="sequential")
+    assert engine.search_cache.stats()["entries"] == 0
+
+    monkeypatch.setattr(search_engine, "catalog_version", lambda: "v1")
+    await engine.search_medication("IBUPROFENO 400", k=1, threshold=0.5, mode="sequential")
+    assert engine.search_cache.stats()["entries"] == 1
+
+@pytest.fixture
+def hybrid(engine, monkeypatch):
+    """Mismo engine, con pesos iguales para que el orden dependa solo de los rankings."""
+    monkeypatch.setattr(settings, "SEARCH_LEXICAL_WEIGHT", 1.0)
+    monkeypatch.setattr(settings, "SEARCH_SEMANTIC_WEIGHT", 1.0)
+    monkeypatch.setattr(settings, "SEARCH_RRF_K", 60)
+    return engine
+
+async def test_hybrid_fuses_rankings_with_rrf(hybrid):
+    resultados = await hybrid.search_medication("IBUPROFENO 400", k=5, threshold=0.5, mode="hybrid")
+    # F1 suma el aporte de dos métodos; S1 y C1 empatan en RRF y desempata el score
+    assert [r["codigo"] for r in resultados] == ["F1", "S1", "C1", "C2"]
+    f1 = resultados[0]
+    assert f1["fusion_score"] == pytest.approx(1 / 61 + 1 / 62)
+    assert f1["score"] == 0.90
+    assert sorted(f1["search_method"].removeprefix("hybrid:").split("+")) == ["component", "fuzzy"]
+
+async def test_hybrid_deduplicates_exact_matches(hybrid, monkeypatch):
+    async def exact(queries):
+        return [[_r("F1", 1.0, "exact_code")] for _ in queries]
+
+    monkeypatch.setattr(hybrid, "_search_exact_code_many", exact)
+    resultados = await hybrid.search_medication("F1", k=5, threshold=0.5, mode="hybrid")
+    assert [(r["codigo"], r["search_method"]) for r in resultados][:2] == [("F1", "exact_code"), ("S1", "hybrid:semantic")]
+    assert [r["codigo"] for r in resultados].count("F1") == 1
+
+async def test_hybrid_falls_back_to_fuzzy_when_budget_runs_out(hybrid, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_LATENCY_BUDGET_MS", 50)
+    cancelados = []
+
+    def lento(nombre):
+        async def retriever(queries, k):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelados.append(nombre)
+                raise
+        return retriever
+
+    monkeypatch.setattr(hybrid, "_search_components_many", lento("component"))
+    monkeypatch.setattr(hybrid, "_search_semantic_many", lento("semantic"))
+    resultados = await hybrid.search_medication("IBUPROFENO 400", k=5, threshold=0.5, mode="hybrid")
+    assert [(r["codigo"], r["search_method"]) for r in resultados] == [("F1", "hybrid:fuzzy")]
+    await asyncio.sleep(0)
+    assert sorted(cancelados) == ["component", "semantic"]
+
+async def test_hybrid_ignores_failed_retriever(hybrid, monkeypatch):
+    async def roto(queries, k):
+        raise RuntimeError("índice no disponible")
+
+    monkeypatch.setattr(hybrid, "_search_semantic_many", roto)
+    resultados = await hybrid.search_medication("IBUPROFENO 400", k=5, threshold=0.5, mode="hybrid")
+    assert [r["codigo"] for r in resultados] == ["F1", "C1", "C2"]
+
+async def test_semantic_search_runs_once_for_the_whole_batch(monkeypatch):
+    llamadas = []
+
+    def semantic_search_many(queries, k):
+        llamadas.append((list(queries), k))
+        return [[_r(f"S{i}", 0.9, "semantic")] for i, _ in enumerate(queries)]
+
+    monkeypatch.setattr(search_engine, "_semantic_search_many", semantic_search_many)
+    resultados = await SearchEngine()._search_semantic_many(["IBUPROFENO", "AMOXICILINA"], 5)
+
+    assert llamadas == [(["IBUPROFENO", "AMOXICILINA"], 5)]
+    assert [[r["codigo"] for r in rs] for rs in resultados] == [["S0"], ["S1"]]
+
+async def test_search_many_runs_each_method_once_for_distinct_queries(engine, monkeypatch):
+    llamadas = []
+
+    async def exact(queries):
+        llamadas.append(("exact", list(queries)))
+        return [[_r("A1", 1.0, "exact_code")] if q == "A1" else [] for q in queries]
+
+    fuzzy = engine._search_fuzzy_many
+
+    async def fuzzy_registrado(queries, k):
+        llamadas.append(("fuzzy", list(queries)))
+        return await fuzzy(queries, k)
+
+    async def components(queries, k):
+        llamadas.append(("component", list(queries)))
+        return [[] for _ in queries]
+
+    monkeypatch.setattr(engine, "_search_exact_code_many", exact)
+    monkeypatch.setattr(engine, "_search_fuzzy_many", fuzzy_registrado)
+    monkeypatch.setattr(engine, "_search_components_many", components)
+
+    resultados = await engine.search_many(["Ibuprofeno 400", "A1", "IBUPROFENO 400"], k=1, threshold=0.5, mode="sequential")
+
+    # Las consultas que normalizan igual se buscan una vez; cada método solo ve las que aún no tienen k
+    assert llamadas == [("exact", ["Ibuprofeno 400", "A1"]), ("fuzzy", ["Ibuprofeno 400"])]
+    assert [[r["codigo"] for r in rs] for rs in resultados] == [["F1"], ["A1"], ["F1"]]
+    # Cada posición recibe su propia copia de los resultados
+    resultados[0][0]["score"] = 0
+    assert resultados[2][0]["score"] == 0.62
@@ -0,0 +1,120 @@
+import json
+import os
+import zlib
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+from src.config import settings
+from src.db.catalog import CatalogSnapshot
+from src.services import semantic_search
+from src.services.semantic_search import SemanticSearchService, build_semantic_index
+
+_DIM = 32
+MODELO = "modelo-de-prueba"
+
+class _Modelo:
+    """Reemplaza a SentenceTransformer sin descargar nada: un vector fijo por texto."""
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.llamadas = []
+
+    def encode(self, textos, batch_size=32, convert_to_numpy=True):
+        self.llamadas.append(list(textos))
+        return np.stack([np.random.default_rng(zlib.crc32(t.encode())).standard_normal(_DIM) for t in textos]).astype(np.float32)
+
+def _catalogo(n=300, extra=()):
+    filas = [(f"C{i}", None, f"MEDICAMENTO {i} MG", float(i)) for i in range(n)]
+    return CatalogSnapshot(filas + list(extra))
+
+@pytest.fixture
+def catalogo(monkeypatch):
+    """Catálogo en memoria para el índice; el test puede reemplazarlo para simular cambios en la BD."""
+    estado = {"catalogo": _catalogo()}
+    monkeypatch.setattr(semantic_search, "SentenceTransformer", _Modelo)
+    monkeypatch.setattr(semantic_search, "get_catalog", lambda: estado["catalogo"])
+    monkeypatch.setattr(semantic_search, "get_medication_specs_many", lambda meds: {m[0]: {} for m in meds})
+    monkeypatch.setattr(settings, "CATALOG_SNAPSHOT_ENABLED", True)
+    monkeypatch.setattr(settings, "SEMANTIC_MIN_SIMILARITY", 0.5)
+    return estado
+
+def _servicio(index_dir, model_name=MODELO):
+    """(servicio, cargó el índice)"""
+    service = SemanticSearchService(model_name)
+    return service, service.load_index(str(index_dir))
+
+def test_build_writes_index_and_load_searches_it(catalogo, tmp_path):
+    meta = build_semantic_index(str(tmp_path), MODELO, batch_size=64, index_type="flat")
+
+    assert sorted(os.listdir(tmp_path)) == ["index.faiss", "mapping.json", "meta.json"]
+    assert meta["count"] == 300 and meta["catalog_version"] == catalogo["catalogo"].version
+    with open(tmp_path / "meta.json", encoding="utf-8") as f:
+        assert json.load(f) == meta
+
+    service, cargado = _servicio(tmp_path)
+    assert cargado and not service.is_stale
+    resultado = service.search("MEDICAMENTO 42 MG", k=3)
+    assert resultado[0]["codigo"] == "C42"
+    assert resultado[0]["score"] == pytest.approx(100.0, abs=1e-3)
+
+def test_load_detects_stale_catalog(catalogo, tmp_path):
+    build_semantic_index(str(tmp_path), MODELO, batch_size=64, index_type="flat")
+    catalogo["catalogo"] = _catalogo(extra=[("NUEVO", None, "MEDICAMENTO NUEVO", 1.0)])
+
+    service, cargado = _servicio(tmp_path)
+    # El índice viejo se sigue usando, pero queda marcado para regenerarlo
+    assert cargado and service.is_stale
+
+def test_load_rejects_missing_or_mismatched_index(catalogo, tmp_path):
+    assert not _servicio(tmp_path)[1]
+    build_semantic_index(str(tmp_path), MODELO, batch_size=64, index_type="flat")
+    service, cargado = _servicio(tmp_path, model_name="otro-modelo")
+    assert not cargado
+    assert service.search_many(["MEDICAMENTO 1 MG"]) == [[]]
+
+@pytest.mark.parametrize("index_type", ["hnsw", "ivf_flat", "ivf_pq"])
+def test_approximate_indexes_find_the_exact_name(catalogo, tmp_path, monkeypatch, index_type):
+    monkeypatch.setattr(settings, "SEMANTIC_PQ_M", 8)
+    meta = build_semantic_index(str(tmp_path), MODELO, batch_size=64, index_type=index_type)
+    assert meta["index_type"] == index_type
+
+    service, cargado = _servicio(tmp_path)
+    assert cargado
+    # Los parámetros de búsqueda no viajan en el archivo: se aplican al cargar
+    if index_type == "hnsw":
+        assert service.index.hnsw.efSearch == settings.SEMANTIC_HNSW_EF_SEARCH
+    else:
+        assert semantic_search.faiss.extract_index_ivf(service.index).nprobe == settings.SEMANTIC_IVF_NPROBE
+    # PQ comprime los vectores: el exacto queda entre los primeros, no necesariamente primero
+    tope = 5 if index_type == "ivf_pq" else 1
+    nombres = [f"MEDICAMENTO {i} MG" for i in (7, 123, 299)]
+    for nombre, resultados in zip(nombres, service.search_many(nombres, k=5)):
+        assert nombre in [r["nombre"] for r in resultados[:tope]]
+
+def test_index_options():
+    assert semantic_search._pq_m(384) == 48
+    assert semantic_search._pq_m(100) == 25
+    with pytest.raises(ValueError):
+        semantic_search.create_index("lsh", 8, 10)
+
+def test_search_many_encodes_all_queries_at_once(catalogo, tmp_path):
+    build_semantic_index(str(tmp_path), MODELO, batch_size=64, index_type="flat")
+    service, _ = _servicio(tmp_path)
+    busquedas = []
+    index = service.index
+
+    class _Indice:
+        def search(self, embeddings, k):
+            busquedas.append(len(embeddings))
+            return index.search(embeddings, k)
+
+    service.index = _Indice()
+    nombres = ["MEDICAMENTO 3 MG", "MEDICAMENTO 200 MG", "MEDICAMENTO 3 MG"]
+    resultados = service.search_many(nombres, k=2)
+
+    assert service.model.llamadas == [nombres]
+    assert busquedas == [3]
+    assert [r[0]["codigo"] for r in resultados] == ["C3", "C200", "C3"]
+    assert service.search_many([]) == []
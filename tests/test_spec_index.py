@@ -0,0 +1,47 @@
+import time
+import pytest
+from src.config import settings
+from src.db import spec_index
+from src.db import specs as spec_store
+from src.db.catalog import CatalogSnapshot
+
+FILAS = [("1", None, "IBUPROFENO 400 MG COMP X 20", 10.0), ("2", None, "IBUPROFENO 600 MG COMP X 20", 12.0),
+         ("3", None, "IBUPROFENO 400 MG COMP X 10", 6.0), ("4", None, "IBUPROFENO 0.4 G COMP X 20", 9.0),
+         ("6", None, "AMOXICILINA 500 MG CAPS X 16", 20.0)]
+
+@pytest.fixture
+def catalogo(monkeypatch):
+    """Catálogo en memoria; las especificaciones se parsean del nombre (sin medicamentos_spec)."""
+    catalogo = CatalogSnapshot(FILAS)
+    monkeypatch.setattr(settings, "CATALOG_SNAPSHOT_ENABLED", True)
+    monkeypatch.setattr(spec_index, "get_catalog", lambda: catalogo)
+    monkeypatch.setattr(spec_index, "_index", None)
+    monkeypatch.setattr(spec_store, "get_medication_specs_many",
+                        lambda filas: {f[0]: spec_store.parse_medication_nombre(f[1]) for f in filas})
+    return {fila[0]: fila for fila in catalogo.rows}
+
+def test_filter_keeps_compatible_candidates_and_adds_from_the_index(catalogo):
+    spec_index.build_spec_index()
+    nombres = ["ibuprofeno 400mg comp x20", "GASA", "AMOXICILINA 875 MG"]
+    filas = [[catalogo["2"], catalogo["1"], catalogo["6"]], [catalogo["2"]], [catalogo["6"]]]
+
+    resultado = spec_index.filter_candidates_by_specs(nombres, filas, k=3)
+
+    # Fuera la dosis distinta (2), el otro principio activo (6) y el envase distinto (3);
+    # el índice suma la dosis 0.4 G, que equivale a 400 MG (4)
+    assert [f[0] for f in resultado[0]] == ["1", "4"]
+    # Sin especificaciones en la factura, o sin ningún compatible, quedan los candidatos originales
+    assert resultado[1] == [catalogo["2"]]
+    assert resultado[2] == [catalogo["6"]]
+
+def test_index_is_built_in_background_and_reused(catalogo):
+    # La búsqueda no espera al índice: lo pide y sigue sin él
+    assert spec_index.get_spec_index() is None
+    for _ in range(100):
+        if not spec_index._building.is_set():
+            break
+        time.sleep(0.05)
+    construido = spec_index.get_spec_index()
+    assert construido is not None and spec_index.get_spec_index() is construido
+    # Sin envase en la clave valen todos los de 400 mg, los de nombre más corto primero
+    assert [f[0] for f in construido.candidates("IBUPROFENO", ((400.0, "mg"), "comprimido", None), k=5)] == ["4", "1", "3"]
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import create_engine, text
+import src.db
+from src.config import settings
+from src.db import specs
+from src.services import search
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """BD SQLite con medicamentos_spec; cuenta conexiones y consultas al esquema."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'specs.db'}")
+    columnas = ", ".join(f"{f} TEXT" for f in specs.SPEC_FIELDS)
+    with engine.begin() as cn:
+        cn.execute(text(f"CREATE TABLE medicamentos_spec (codigo TEXT PRIMARY KEY, nombre TEXT, {columnas}, parser_version INTEGER)"))
+        cn.execute(text("INSERT INTO medicamentos_spec (codigo, nombre, brand, active, parser_version) "
+                        "VALUES ('1', 'IBUPROFENO 400 MG', 'MARCA', 'IBUPROFENO', :v)"), {"v": specs.PARSER_VERSION})
+
+    contador = {"conexiones": 0, "has_table": 0}
+
+    def get_conn():
+        contador["conexiones"] += 1
+        return engine.connect()
+
+    def has_table(cn):
+        contador["has_table"] += 1
+        return True
+
+    monkeypatch.setattr(settings, "CATALOG_SNAPSHOT_ENABLED", False)
+    monkeypatch.setattr(src.db, "get_conn", get_conn)
+    monkeypatch.setattr(specs, "_spec_table_exists", has_table)
+    specs.reset_spec_cache()
+    yield contador
+    specs.reset_spec_cache()
+
+def test_table_check_runs_once(db):
+    for _ in range(3):
+        result = specs.get_medication_specs_many([("1", "IBUPROFENO 400 MG"), ("2", "AMOXICILINA 500 MG")])
+        assert result["1"]["brand"] == "MARCA"          # de la tabla
+        assert result["2"] == specs.parse_medication_nombre("AMOXICILINA 500 MG")  # parseado a demanda
+    assert db == {"conexiones": 3, "has_table": 1}
+
+def test_search_medication_fetches_specs_once(db, monkeypatch):
+    filas = [("1", "IBUPROFENO 400 MG", 10.0), ("2", "IBUPROFENO 600 MG", 12.0), ("3", "IBUPROFENO JARABE", 8.0)]
+    monkeypatch.setattr(search, "get_by_codigo", lambda codigo: None)
+    monkeypatch.setattr(search, "search_fuzzy", lambda query, k: filas)
+
+    resultados = search.search_medication("IBUPROFENO", k=5)
+
+    assert [r["codigo"] for r in resultados] == ["1", "2", "3"]
+    assert resultados[0]["specifications"]["brand"] == "MARCA"
+    assert db["conexiones"] == 1
@@ -0,0 +1,80 @@
+import threading
+import pytest
+from src.config import settings
+from src.services import orchestration_service, synonym_promoter
+from src.services.orchestration_service import OrchestrationService
+from src.services.synonym_promoter import SynonymPromoter
+
+@pytest.fixture
+def guardados(monkeypatch):
+    """Reemplaza upsert_auto_synonyms: (lotes guardados, evento que se activa con el primero)."""
+    lotes = []
+    guardado = threading.Event()
+
+    def upsert(lote):
+        lotes.append(sorted(lote))
+        guardado.set()
+
+    monkeypatch.setattr(synonym_promoter, "upsert_auto_synonyms", upsert)
+    return lotes, guardado
+
+def test_flushes_when_batch_size_is_reached(guardados):
+    guardados, guardado = guardados
+    promoter = SynonymPromoter(batch_size=2, flush_seconds=60)
+    promoter.enqueue("IBUPROFENO 400", "1")
+    promoter.enqueue("IBUPROFENO 400", "2")  # mismo nombre: gana el último código
+    promoter.enqueue("AMOXICILINA 500", "3")
+    assert guardado.wait(5)
+    assert guardados == [[("AMOXICILINA 500", "3"), ("IBUPROFENO 400", "2")]]
+    promoter.stop()
+    assert promoter.promoted == 2
+
+def test_flushes_after_flush_seconds(guardados):
+    guardados, guardado = guardados
+    promoter = SynonymPromoter(batch_size=100, flush_seconds=0.05)
+    promoter.enqueue("IBUPROFENO 400", "1")
+    assert guardado.wait(5)
+    assert guardados == [[("IBUPROFENO 400", "1")]]
+    promoter.stop()
+
+def test_stop_saves_pending_and_ends_the_thread(guardados):
+    guardados, _ = guardados
+    promoter = SynonymPromoter(batch_size=100, flush_seconds=60)
+    promoter.enqueue("IBUPROFENO 400", "1")
+    promoter.stop()
+    assert guardados == [[("IBUPROFENO 400", "1")]]
+    assert not promoter._thread.is_alive()
+
+def test_failed_write_is_counted_and_the_worker_keeps_running(monkeypatch):
+    def falla(lote):
+        raise RuntimeError("BD caída")
+
+    monkeypatch.setattr(synonym_promoter, "upsert_auto_synonyms", falla)
+    promoter = SynonymPromoter(batch_size=1, flush_seconds=60)
+    promoter.enqueue("IBUPROFENO 400", "1")
+    promoter.enqueue("AMOXICILINA 500", "3")
+    promoter.stop()
+    assert (promoter.promoted, promoter.failed) == (0, 2)
+
+def test_only_confident_ai_matches_are_promoted(monkeypatch):
+    encolados = []
+
+    class _Promotor:
+        def enqueue(self, nombre, codigo):
+            encolados.append((nombre, codigo))
+
+    monkeypatch.setattr(settings, "SYNONYM_PROMOTION_MIN_CONFIDENCE", 95)
+    monkeypatch.setattr(orchestration_service, "get_synonym_promoter", _Promotor)
+    service = OrchestrationService.__new__(OrchestrationService)
+    service.mappings = {"AGUA DESTILADA X 10 ML": {"codigo": "9", "metodo": "Manual"}}
+
+    service._promote_synonyms([
+        {"nombre_factura": "Ibuprofeno 400mg", "codigo_bd": "1", "confianza": 97},
+        {"nombre_factura": "Amoxicilina 500", "codigo_bd": "3", "confianza": 80},
+        {"nombre_factura": "agua destilada x 10 ml", "codigo_bd": "4", "confianza": 99},
+    ])
+
+    # La corrección manual no se pisa y la confianza baja no se aprende
+    assert encolados == [("IBUPROFENO 400 MG", "1")]
+    assert service.mappings["IBUPROFENO 400 MG"] == {"codigo": "1", "metodo": "IA-Auto"}
+    assert service.mappings["AGUA DESTILADA X 10 ML"]["metodo"] == "Manual"
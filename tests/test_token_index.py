@@ -0,0 +1,47 @@
+import threading
+import pytest
+from src.config import settings
+from src.db import aio, token_index
+from src.db.catalog import CatalogSnapshot
+
+FILAS = [("1", None, "IBUPROFENO 400 MG COMPRIMIDOS X 20", 10.0), ("2", None, "IBUPROFENO 600 MG", 12.0),
+         ("3", None, "AMOXICILINA 500 MG CAPSULAS", 20.0)]
+
+@pytest.fixture
+def catalogo(monkeypatch):
+    catalogo = CatalogSnapshot(FILAS)
+    monkeypatch.setattr(token_index, "get_catalog", lambda: catalogo)
+    monkeypatch.setattr(token_index, "_index", None)
+    return catalogo
+
+def test_get_token_index_builds_in_background(catalogo, monkeypatch):
+    construido = threading.Event()
+    build = token_index.build_token_index
+    monkeypatch.setattr(token_index, "build_token_index", lambda: (build(), construido.set()))
+
+    assert token_index.get_token_index() is None  # la búsqueda no espera la construcción
+    assert construido.wait(5)
+    index = token_index.get_token_index()
+    assert index is not None and index.version == catalogo.version
+
+def test_build_token_index_reuses_current_index(catalogo):
+    index = token_index.build_token_index()
+    assert token_index.build_token_index() is index
+    assert [r[0] for r in index.search(["IBUPROFENO"], 5)] == ["2", "1"]
+
+async def test_search_fuzzy_async_runs_index_off_the_loop(catalogo, monkeypatch):
+    token_index.build_token_index()
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "index")
+    monkeypatch.setattr(settings, "SEARCH_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "CATALOG_SNAPSHOT_ENABLED", True)
+    hilos = []
+    search = token_index.TokenIndex.search
+    monkeypatch.setattr(token_index.TokenIndex, "search",
+                        lambda self, words, k: hilos.append(threading.current_thread()) or search(self, words, k))
+
+    assert [r[0] for r in await aio.search_fuzzy_async("amoxicilina", k=5)] == ["3"]
+    resultados = await aio.search_fuzzy_many_async(["ibuprofeno 600", "amoxicilina"], k=5)
+    assert [r[0] for r in resultados["ibuprofeno 600"]] == ["2"]
+
+    assert len(hilos) == 3
+    assert all(h is not threading.main_thread() for h in hilos)
@@ -0,0 +1,67 @@
+import pytest
+import src.db
+from src.config import settings
+
+class _Conexion:
+    """Conexión falsa: registra cada sentencia y devuelve las filas preparadas para la consulta pg_trgm."""
+    def __init__(self, filas):
+        self.filas = filas
+        self.sentencias = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.sentencias.append((query, params))
+        return _Resultado(self.filas if query is not src.db._TRGM_SET_LIMIT_QUERY else [])
+
+class _Resultado(list):
+    def fetchall(self):
+        return list(self)
+
+@pytest.fixture
+def trgm(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "trgm")
+    monkeypatch.setattr(settings, "SEARCH_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "TRGM_SIMILARITY_THRESHOLD", 0.4)
+
+    def conectar(filas):
+        cn = _Conexion(filas)
+        monkeypatch.setattr(src.db, "get_conn", lambda: cn)
+        return cn
+    return conectar
+
+def test_search_fuzzy_pushes_ranking_and_top_k_to_postgres(trgm):
+    # PostgreSQL ya devuelve las filas ordenadas por similitud: se respetan tal cual
+    filas = [("2", "IBUPROFENO 400 MG X 20", 12.0), ("1", "IBUPROFENO 400 MG X 10", 10.0)]
+    cn = trgm(filas)
+
+    assert src.db.search_fuzzy("ibuprofeno 400mg", k=7) == filas
+    assert cn.sentencias == [
+        (src.db._TRGM_SET_LIMIT_QUERY, {"limit": 0.4}),
+        (src.db._TRGM_SEARCH_QUERY, {"q": src.db.normalize_text("ibuprofeno 400mg"), "k": 7}),
+    ]
+
+def test_search_fuzzy_many_sends_every_term_in_one_statement(trgm):
+    # Filas de _TRGM_SEARCH_MANY_QUERY: (término, codigo, nombre, precio, similitud, largo)
+    cn = trgm([(0, "1", "IBUPROFENO 400 MG", 10.0, 0.9, 17), (1, "3", "AMOXICILINA 500 MG", 20.0, 0.8, 18)])
+
+    resultado = src.db.search_fuzzy_many(["ibuprofeno 400", "amoxicilina 500", "ibuprofeno 400", "gasa"], k=5)
+
+    assert resultado == {"ibuprofeno 400": [("1", "IBUPROFENO 400 MG", 10.0)],
+                         "amoxicilina 500": [("3", "AMOXICILINA 500 MG", 20.0)], "gasa": []}
+    set_limit, busqueda = cn.sentencias
+    assert set_limit == (src.db._TRGM_SET_LIMIT_QUERY, {"limit": 0.4})
+    assert busqueda[0] is src.db._TRGM_SEARCH_MANY_QUERY
+    assert busqueda[1] == {"qs": [src.db.normalize_text(q) for q in ("ibuprofeno 400", "amoxicilina 500", "gasa")], "k": 5}
+
+def test_trgm_fetches_fewer_phase2_candidates(monkeypatch):
+    monkeypatch.setattr(settings, "TRGM_CANDIDATES_K", 10)
+    monkeypatch.setattr(settings, "FUZZY_CANDIDATES_K", 50)
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "trgm")
+    assert src.db.fuzzy_candidate_limit() == 10
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "sql")
+    assert src.db.fuzzy_candidate_limit() == 50